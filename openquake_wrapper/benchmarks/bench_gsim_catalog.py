@@ -0,0 +1,203 @@
+# Fichier : benchmarks/bench_gsim_catalog.py
+# Mesure le wrapper sur tout le catalogue de GMMs du workflow principal : temps par étape et pic de mémoire.
+#
+# Usage : python3 benchmarks/bench_gsim_catalog.py [--catalog ../data/gmm_catalog.csv_for_main_workflow.xlsx]
+#                                                 [--output baseline.json] [--compare baseline.json --threshold 0.25]
+#                                                 [--only module:Classe,...] [--isolate] [--no-plot]
+# Chaque modèle est évalué en processus (même code que la CLI) sur les paramètres représentatifs de build_imt_index.
+# Avec --isolate, chaque modèle tourne dans un sous-processus : l'import et le pic RSS sont alors mesurés à froid.
+# Codes de sortie de --compare : 0 sans régression, 1 avec régressions, 3 si la référence a été mesurée dans un autre
+# environnement (version d'OpenQuake, Python, machine ou mode --isolate) : la comparaison est alors refusée.
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import platform
+import resource
+import subprocess
+import zipfile
+import xml.etree.ElementTree as ET
+from argparse import Namespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import run_gmm_calculation_v8 as wrapper
+
+BASELINE_FORMAT = 1
+DEFAULT_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "gmm_catalog.csv_for_main_workflow.xlsx")
+STAGES = ("import", "contexts", "imt_detection", "evaluation", "plotting")
+# Une hausse n'est signalée que si elle dépasse à la fois le seuil relatif et ce minimum absolu (bruit de mesure).
+MIN_REGRESSION_SECONDS = 0.05
+# Champs qui doivent être identiques entre la référence et la mesure pour que la comparaison ait un sens.
+ENVIRONMENT_FIELDS = ("openquake_version", "python", "machine", "isolated")
+EXIT_ENVIRONMENT_MISMATCH = 3
+XLSX_NS = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+def _column_index(cell_ref):
+    """'C12' -> 2."""
+    index = 0
+    for char in cell_ref:
+        if not char.isalpha(): break
+        index = index * 26 + ord(char.upper()) - ord("A") + 1
+    return index - 1
+
+def read_catalog(path):
+    """Lit la première feuille du classeur (zipfile + XML, sans dépendance) ; renvoie une liste de dicts par ligne."""
+    with zipfile.ZipFile(path) as book:
+        shared = []
+        if "xl/sharedStrings.xml" in book.namelist():
+            for si in ET.fromstring(book.read("xl/sharedStrings.xml")).findall("x:si", XLSX_NS):
+                shared.append("".join(t.text or "" for t in si.iter(f"{{{XLSX_NS['x']}}}t")))
+        sheet = ET.fromstring(book.read("xl/worksheets/sheet1.xml"))
+    rows = []
+    for row in sheet.find("x:sheetData", XLSX_NS).findall("x:row", XLSX_NS):
+        values = {}
+        for cell in row.findall("x:c", XLSX_NS):
+            v = cell.find("x:v", XLSX_NS)
+            if v is None or v.text is None: continue
+            values[_column_index(cell.get("r"))] = shared[int(v.text)] if cell.get("t") == "s" else v.text
+        if values: rows.append([values.get(i, "") for i in range(max(values) + 1)])
+    header, records = rows[0], []
+    for row in rows[1:]:
+        record = {name: (row[i] if i < len(row) else "") for i, name in enumerate(header) if name}
+        if record.get("module") and record.get("class_name"): records.append(record)
+    return records
+
+def peak_rss_mb():
+    # ru_maxrss est en Ko sous Linux, en octets sous macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def bench_model(module_name, class_name, make_plot=True):
+    """Évalue un modèle comme la CLI et renvoie ses temps par étape (secondes), ses compteurs d'IMTs et le pic RSS."""
+    record = {"module": module_name, "class_name": class_name}
+    started = time.perf_counter()
+    try:
+        # Importé ici (il charge openquake.hazardlib) pour que l'étape import du premier modèle soit mesurée à froid.
+        from build_imt_index import representative_parameters
+        gmm_class = getattr(importlib.import_module(f"openquake.hazardlib.gsim.{module_name}"), class_name)
+        params = representative_parameters(gmm_class, class_name)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+    import_time = time.perf_counter() - started
+    timings = {}
+    # Les booléens passent en 0/1 : la chaîne "True" n'est pas convertie par parse_user_params.
+    args = Namespace(module=module_name, class_name=class_name, keys=",".join(params),
+                     values=",".join(str(int(v)) if isinstance(v, bool) else str(v) for v in params.values()),
+                     plot_format="png", preview=False)
+    try:
+        response, _ = wrapper.calculate_gmm_with_plot(args, make_plot=make_plot, write_plot=False, timings=timings)
+        record.update(imts=response["successful_imts_count"], failed_imts=response["failed_imts_count"])
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    # Le module est importé avant calculate_gmm pour lire REQUIRES_* : on lui attribue ce temps.
+    timings["import"] = timings.get("import", 0.0) + import_time
+    record["stages_s"] = {stage: round(timings.get(stage, 0.0), 4) for stage in STAGES}
+    probes = timings.get("failed_probes", {})
+    record["failed_probes"] = {"count": probes.get("count", 0), "time_s": round(probes.get("time_s", 0.0), 4),
+                               "rejected": probes.get("rejected", 0)}
+    record["total_s"] = round(time.perf_counter() - started, 4)
+    record["peak_rss_mb"] = peak_rss_mb()
+    return record
+
+def bench_isolated(module_name, class_name, make_plot=True):
+    command = [sys.executable, os.path.abspath(__file__), "--single", f"{module_name}:{class_name}"]
+    if not make_plot: command.append("--no-plot")
+    proc = subprocess.run(command, capture_output=True, text=True)
+    try:
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return {"module": module_name, "class_name": class_name, "error": f"Subprocess failed: {proc.stderr.strip()[-500:]}"}
+
+def run_benchmark(models, isolate=False, make_plot=True):
+    results, started = {}, time.perf_counter()
+    for module_name, class_name in models:
+        record = (bench_isolated if isolate else bench_model)(module_name, class_name, make_plot)
+        results[f"{module_name}.{class_name}"] = record
+        status = record.get("error") or f"{record['total_s']:.3f} s, {record['peak_rss_mb']} MB"
+        print(f"{module_name}.{class_name}: {status}", file=sys.stderr)
+    return {
+        "format": BASELINE_FORMAT, "openquake_version": wrapper.get_openquake_version(),
+        "python": platform.python_version(), "machine": platform.machine(), "isolated": isolate,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "wall_time_s": round(time.perf_counter() - started, 1),
+        "models": results,
+    }
+
+def environment_mismatch(baseline, current):
+    """Champs d'environnement qui diffèrent entre les deux fichiers de résultats ({champ: [référence, mesure]})."""
+    return {field: [baseline.get(field), current.get(field)] for field in ENVIRONMENT_FIELDS
+            if baseline.get(field) != current.get(field)}
+
+def compare(baseline, current, threshold):
+    """Liste les hausses relatives supérieures à threshold (total et par étape) entre deux fichiers de résultats."""
+    regressions = []
+    for key, record in current["models"].items():
+        before = baseline["models"].get(key)
+        if not before or "error" in before or "error" in record: continue
+        pairs = [("total", before["total_s"], record["total_s"])]
+        pairs += [(stage, before["stages_s"].get(stage, 0.0), record["stages_s"].get(stage, 0.0)) for stage in STAGES]
+        for stage, old, new in pairs:
+            if new - old > MIN_REGRESSION_SECONDS and new > old * (1 + threshold):
+                regressions.append({"model": key, "stage": stage, "baseline_s": old, "current_s": new,
+                                    "ratio": round(new / old, 2) if old else None})
+    return sorted(regressions, key=lambda r: -(r["current_s"] - r["baseline_s"]))
+
+def parse_models(only, catalog_path):
+    if only:
+        return [tuple(item.strip().split(":", 1)) for item in only.split(",") if item.strip()]
+    seen, models = set(), []
+    for record in read_catalog(catalog_path):
+        model = (record["module"].strip(), record["class_name"].strip())
+        if model not in seen:
+            seen.add(model)
+            models.append(model)
+    return models
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark du wrapper GMM sur le catalogue du workflow")
+    parser.add_argument('--catalog', default=DEFAULT_CATALOG, help="Classeur xlsx listant les GMMs (colonnes module, class_name)")
+    parser.add_argument('--only', help="Liste 'module:Classe' séparée par virgules (remplace le catalogue)")
+    parser.add_argument('--limit', type=int, help="Ne mesure que les N premiers modèles")
+    parser.add_argument('--output', help="Fichier JSON des résultats (nouvelle référence)")
+    parser.add_argument('--compare', help="Fichier de référence à comparer aux résultats")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Hausse relative signalée comme régression (défaut 0.25)")
+    parser.add_argument('--isolate', action='store_true', help="Un sous-processus par modèle (import et pic RSS à froid)")
+    parser.add_argument('--no-plot', action='store_true', help="Ne mesure pas l'étape de tracé")
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    os.environ.pop("GMM_CACHE_DIR", None)
+
+    if args.single:
+        module_name, class_name = args.single.split(":", 1)
+        print(json.dumps(bench_model(module_name, class_name, not args.no_plot)))
+        sys.exit(0)
+
+    models = parse_models(args.only, args.catalog)[:args.limit]
+    report = run_benchmark(models, args.isolate, not args.no_plot)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    slowest = sorted((r for r in report["models"].values() if "total_s" in r), key=lambda r: -r["total_s"])[:10]
+    probing = sorted((r for r in report["models"].values() if r.get("failed_probes", {}).get("count")),
+                     key=lambda r: -r["failed_probes"]["time_s"])[:10]
+    print(json.dumps({"models": len(report["models"]), "errors": sum("error" in r for r in report["models"].values()),
+                      "wall_time_s": report["wall_time_s"],
+                      "slowest": [{"model": f"{r['module']}.{r['class_name']}", "total_s": r["total_s"], "stages_s": r["stages_s"]}
+                                  for r in slowest],
+                      "failed_probing": [{"model": f"{r['module']}.{r['class_name']}", **r["failed_probes"]} for r in probing]}, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        mismatch = environment_mismatch(baseline, report)
+        if mismatch:
+            print(f"Refusing to compare with {args.compare}: measured in a different environment "
+                  f"({', '.join(f'{k} {v[0]!r} != {v[1]!r}' for k, v in mismatch.items())})", file=sys.stderr)
+            print(json.dumps({"threshold": args.threshold, "environment_mismatch": mismatch, "regressions": None}, indent=2))
+            sys.exit(EXIT_ENVIRONMENT_MISMATCH)
+        regressions = compare(baseline, report, args.threshold)
+        print(json.dumps({"threshold": args.threshold, "regressions": regressions}, indent=2))
+        sys.exit(1 if regressions else 0)
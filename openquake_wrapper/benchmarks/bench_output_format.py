@@ -0,0 +1,101 @@
+# Fichier : benchmarks/bench_output_format.py
+# Taille et temps de sérialisation / relecture de la réponse selon le format de sortie : records (un dict par IMT,
+# JSON indenté comme la CLI ou compact), columnar (tableaux par famille d'IMTs, JSON compact) et npz.
+#
+# Usage : python3 benchmarks/bench_output_format.py [--repeat 5] [--scenarios 500]
+# Cas mesurés : spectre SA, spectre EAS dense, grille SDi période x facteur de résistance (synthétique, aucun GMM
+# SDi n'étant fourni par toutes les versions d'OpenQuake) et mode batch sur N scénarios.
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+from argparse import Namespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import run_gmm_calculation_v8 as wrapper
+
+KEYS = "mag,rrup,rjb,vs30,ztor,rake,dip,width,z1pt0,vs30measured,rx,ry0"
+VALUES = "6.5,{rrup},{rjb},500,{ztor},90,70,10,50,0,{rx},0"
+ZTOR = 2.0
+
+def site_distances(n):
+    """n sites de 2 à 300 km de rrup, alignés perpendiculairement à la faille côté toit : rjb et rx en sont déduits."""
+    rrup = np.logspace(np.log10(ZTOR), np.log10(300.0), n)
+    rjb = np.sqrt(np.maximum(rrup ** 2 - ZTOR ** 2, 0.0))
+    return {name: ";".join(f"{v:.4f}" for v in values) for name, values in (("rrup", rrup), ("rjb", rjb), ("rx", rjb))}
+
+def sdi_response(n_periods=40, ratios=(1.5, 2.0, 3.0, 4.0, 6.0)):
+    """Réponse factice d'un modèle SDi : une entrée par couple (période, R), mise en forme par format_imt_result."""
+    results = []
+    for period in np.logspace(-1.5, 1, n_periods):
+        for ratio in ratios:
+            params = {"period": round(float(period), 4), "strength_ratio": ratio}
+            mean = np.log(0.5 * period * ratio ** 0.5)
+            results.append(wrapper.format_imt_result("Synthetic", "SDi", params, f"SDi({params['period']}s,R={ratio})",
+                                                     True, np.array([mean]), [np.array([0.7])], False))
+    return {"success": True, "gmm": "Synthetic", "module": "synthetic", "total_imts_tested": len(results),
+            "successful_imts_count": len(results), "failed_imts_count": 0,
+            "successful_imts": [r["display_name"] for r in results], "failed_imts": None, "imt_results": results}
+
+def build_cases(n_scenarios):
+    single = lambda module, class_name, keys, values: wrapper.calculate_gmm(
+        Namespace(module=module, class_name=class_name, keys=keys, values=values), make_plot=False)
+    return {
+        "SA (AbrahamsonEtAl2014)": single("abrahamson_2014", "AbrahamsonEtAl2014", KEYS, VALUES.format(rrup=25, rjb=20, ztor=ZTOR, rx=15)),
+        "EAS (BaylessAbrahamson2018)": single("bayless_abrahamson_2018", "BaylessAbrahamson2018",
+                                              "vs30,z1pt0,rrup,rake,ztor,mag", "760,50,25,90,2,6.5"),
+        "SDi grid (synthetic)": sdi_response(),
+        f"batch x{n_scenarios} (AbrahamsonEtAl2014)": wrapper.calculate_gmm_batch(
+            Namespace(module="abrahamson_2014", class_name="AbrahamsonEtAl2014", keys=KEYS,
+                      values=VALUES.format(ztor=ZTOR, **site_distances(n_scenarios)), grid=False, scenarios=None)),
+    }
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), out
+
+def read_npz(data):
+    with np.load(io.BytesIO(data)) as z:
+        return {name: z[name] for name in z.files}
+
+def npz_bytes(response):
+    buffer = io.BytesIO()
+    wrapper.write_npz(response, buffer)
+    return buffer.getvalue()
+
+def measure(response, repeat):
+    # Le temps de sérialisation inclut la conversion en colonnes, faite à chaque réponse.
+    formats = {
+        "records_indent": (lambda: json.dumps(response, indent=2).encode(), lambda d: json.loads(d)),
+        "records_compact": (lambda: json.dumps(response, separators=(",", ":")).encode(), lambda d: json.loads(d)),
+        "columnar_json": (lambda: json.dumps(wrapper.columnar_response(response), separators=(",", ":")).encode(), lambda d: json.loads(d)),
+        "npz": (lambda: npz_bytes(response), read_npz),
+    }
+    report = {}
+    for name, (dump, load) in formats.items():
+        dump_s, data = best_of(dump, repeat)
+        load_s, _ = best_of(lambda: load(data), repeat)
+        report[name] = {"bytes": len(data), "serialize_ms": round(dump_s * 1e3, 3), "parse_ms": round(load_s * 1e3, 3)}
+    base = report["records_indent"]["bytes"]
+    for entry in report.values():
+        entry["size_ratio"] = round(entry["bytes"] / base, 3)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark des formats de sortie (records, columnar, npz)")
+    parser.add_argument('--repeat', type=int, default=5, help="Répétitions par mesure (on garde la meilleure)")
+    parser.add_argument('--scenarios', type=int, default=500, help="Nombre de scénarios du cas batch")
+    args = parser.parse_args()
+    os.environ.pop("GMM_CACHE_DIR", None)
+    cases = build_cases(args.scenarios)
+    print(json.dumps({name: dict(measure(response, args.repeat), imts=len(response["imt_results"]))
+                      for name, response in cases.items()}, indent=2))
@@ -0,0 +1,75 @@
+# Fichier : benchmarks/bench_plot_rendering.py
+# Temps de rendu par type de graphique : ancienne méthode pyplot (nouvelle figure à chaque appel)
+# contre les figures modèles de plot_rendering (PNG 150 dpi, aperçu PNG 72 dpi, SVG).
+#
+# Usage : python3 benchmarks/bench_plot_rendering.py [--repeat 10]
+
+import os
+import io
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import plot_rendering
+
+def synthetic_results(kind, n=60):
+    """Résultats factices ayant la même forme que imt_results pour le type de spectre donné."""
+    style = plot_rendering.PLOT_STYLES[kind]
+    x = np.logspace(-2, 1, n)
+    mean = 0.3 * np.exp(-((np.log(x) + 1.5) ** 2) / 4)
+    if kind == "SDi":
+        return [{"imt": "SDi", "sdi_period": float(p), "strength_ratio": r, "mean_value": float(m * r), "stddev_total_ln": 0.6}
+                for r in (1.5, 2.0, 3.0, 4.0, 6.0) for p, m in zip(x[::4], mean[::4])]
+    return [{"imt": style["imt"], style["x_key"]: float(p), "mean_value": float(m), "stddev_total_ln": 0.6} for p, m in zip(x, mean)]
+
+def legacy_render(kind, results, gmm_name):
+    """Reproduit l'ancien rendu : plt.figure à chaque appel, tracé via l'état global de pyplot, 150 dpi."""
+    style = plot_rendering.PLOT_STYLES[kind]
+    x_key = style["x_key"]
+    plt.figure(figsize=style["figsize"])
+    groups = {}
+    for r in results: groups.setdefault(r.get("strength_ratio"), []).append(r)
+    for i, (ratio, data) in enumerate(sorted(groups.items(), key=lambda g: g[0] or 0)):
+        data = sorted(data, key=lambda r: r[x_key])
+        x = [r[x_key] for r in data]
+        m = np.array([r["mean_value"] for r in data]); s = np.array([r["stddev_total_ln"] for r in data])
+        color = style["colors"][i % 5] if kind == "SDi" else style["line"]
+        plt.fill_between(x, m * np.exp(-s), m * np.exp(s), color=style.get("fill", color), alpha=0.2)
+        plt.plot(x, m, '-o', color=color, label=style["label"].format(ratio=ratio), linewidth=2, markersize=4)
+    plt.xscale('log'); plt.yscale('log'); plt.grid(True, which="both", ls="--", linewidth=0.5)
+    plt.xlabel(style["xlabel"]); plt.ylabel(style["ylabel"]); plt.title(style["title"].format(gmm=gmm_name), fontweight='bold')
+    plt.legend(); plt.tight_layout()
+    buffer = io.BytesIO(); plt.savefig(buffer, format="png", dpi=150); plt.close()
+    return buffer.getvalue()
+
+def timed(repeat, func):
+    func()  # premier appel (création des modèles, cache des polices) exclu de la mesure
+    started = time.perf_counter()
+    for _ in range(repeat): out = func()
+    return (time.perf_counter() - started) / repeat * 1e3, len(out)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark du rendu des graphiques")
+    parser.add_argument('--repeat', type=int, default=10, help="Nombre de rendus par mesure")
+    args = parser.parse_args()
+
+    variants = [
+        ("legacy pyplot", lambda k, r: legacy_render(k, r, "BenchGMM")),
+        ("template png", lambda k, r: plot_rendering.render_spectrum(k, r, "BenchGMM", "png", plot_rendering.DEFAULT_DPI)),
+        ("preview png", lambda k, r: plot_rendering.render_spectrum(k, r, "BenchGMM", "png", plot_rendering.PREVIEW_DPI)),
+        ("template svg", lambda k, r: plot_rendering.render_spectrum(k, r, "BenchGMM", "svg")),
+    ]
+    print(f"{'kind':<8}" + "".join(f"{name:>22}" for name, _ in variants))
+    for kind in plot_rendering.PLOT_STYLES:
+        results = synthetic_results(kind)
+        cells = []
+        for _, render in variants:
+            ms, size = timed(args.repeat, lambda: render(kind, results))
+            cells.append(f"{ms:8.1f} ms {size / 1024:7.1f} kB")
+        print(f"{kind:<8}" + "".join(f"{c:>22}" for c in cells))
@@ -0,0 +1,66 @@
+# Fichier : benchmarks/bench_vectorized_evaluation.py
+# Compare l'évaluation IMT par IMT (get_mean_and_stddevs) à l'appel vectorisé unique (GMPE.compute).
+#
+# Usage : python3 benchmarks/bench_vectorized_evaluation.py [--gmms abrahamson_2014:AbrahamsonEtAl2014,...] [--repeat 5]
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import run_gmm_calculation_v8 as wrapper
+from build_imt_index import representative_parameters
+
+DEFAULT_GMMS = "abrahamson_2014:AbrahamsonEtAl2014,boore_2014:BooreEtAl2014,campbell_bozorgnia_2014:CampbellBozorgnia2014,kotha_2020:KothaEtAl2020ESHM20"
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), out
+
+def bench_gmm(module_name, class_name, repeat):
+    gmm_class = getattr(__import__(f"openquake.hazardlib.gsim.{module_name}", fromlist=[class_name]), class_name)
+    user_params = representative_parameters(gmm_class, class_name)
+    _, gmm, _ = wrapper.prepare_gmm(module_name, class_name, user_params)
+    sctx, rctx, dctx = wrapper.build_contexts(gmm_class, user_params)
+    imt_objs = []
+    for imt_name, imt_params in wrapper.get_indexed_imts(gmm_class) or wrapper.get_supported_imts(gmm_class):
+        imt_obj, _ = wrapper.make_imt(imt_name, imt_params)
+        if wrapper.test_imt_support(gmm, sctx, rctx, dctx, imt_obj)[0]:
+            imt_objs.append(imt_obj)
+    if not wrapper.supports_batched_compute(gmm):
+        return {"gmm": class_name, "imts": len(imt_objs), "error": "no batched compute path"}
+
+    t_loop, loop = best_of(repeat, lambda: [wrapper.test_imt_support(gmm, sctx, rctx, dctx, im) for im in imt_objs])
+    t_batch, (mean, sig) = best_of(repeat, lambda: wrapper.compute_imts_batched(gmm, sctx, rctx, dctx, imt_objs))
+    loop_mean = np.array([r[1] for r in loop])
+    loop_sig = np.array([r[2][0] for r in loop])
+    identical = bool(np.array_equal(loop_mean, mean) and np.array_equal(loop_sig, sig))
+    return {"gmm": class_name, "imts": len(imt_objs), "per_imt_ms": t_loop * 1e3, "batched_ms": t_batch * 1e3,
+            "speedup": t_loop / t_batch if t_batch else float("inf"), "identical": identical,
+            "max_abs_diff": float(max(np.abs(loop_mean - mean).max(), np.abs(loop_sig - sig).max())) if imt_objs else 0.0}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark : évaluation IMT par IMT vs appel vectorisé")
+    parser.add_argument('--gmms', default=DEFAULT_GMMS, help="Paires module:Classe séparées par virgules")
+    parser.add_argument('--repeat', type=int, default=5, help="Nombre de répétitions (on garde le meilleur temps)")
+    args = parser.parse_args()
+
+    print(f"{'GMM':<32} {'IMTs':>5} {'per-IMT (ms)':>13} {'batched (ms)':>13} {'speedup':>8}  identical")
+    all_identical = True
+    for pair in args.gmms.split(','):
+        module_name, class_name = pair.strip().split(':')
+        r = bench_gmm(module_name, class_name, args.repeat)
+        if "error" in r:
+            print(f"{r['gmm']:<32} {r['imts']:>5}  {r['error']}")
+            continue
+        all_identical &= r["identical"]
+        print(f"{r['gmm']:<32} {r['imts']:>5} {r['per_imt_ms']:>13.2f} {r['batched_ms']:>13.2f} {r['speedup']:>7.1f}x  "
+              f"{'yes' if r['identical'] else 'NO (max diff %.3g)' % r['max_abs_diff']}")
+    sys.exit(0 if all_identical else 1)
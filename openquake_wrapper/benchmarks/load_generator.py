@@ -0,0 +1,84 @@
+# Fichier : benchmarks/load_generator.py
+# Simule une rafale de requêtes Telegram contre gmm_server.py et mesure débit et latences.
+#
+# Usage : python3 benchmarks/load_generator.py [--url http://localhost:8000] [--requests 50] [--concurrency 20]
+#                                              [--distinct 10] [--mode calculate|jobs]
+# --distinct fixe le nombre de scénarios différents (les autres sont des doublons, dédoublonnés ou servis par le cache).
+
+import json
+import time
+import socket
+import argparse
+import http.client
+import urllib.error
+import urllib.request
+import concurrent.futures
+
+import numpy as np
+
+KEYS = "mag,rrup,rjb,vs30,ztor,rake,dip,width,z1pt0,vs30measured,rx,ry0"
+VALUES = "{mag},25,20,500,2,90,70,10,50,0,15,0"
+
+# Code "HTTP" d'une requête sans réponse (connexion refusée ou réinitialisée, délai dépassé).
+CONNECTION_ERROR = "connection_error"
+
+def _open(request, timeout):
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+    except (urllib.error.URLError, ConnectionError, socket.timeout, http.client.HTTPException) as e:
+        return CONNECTION_ERROR, {"error": f"{type(e).__name__}: {e}"}
+
+def post(url, payload, timeout):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"})
+    return _open(request, timeout)
+
+def get(url, timeout):
+    return _open(url, timeout)
+
+def one_request(base_url, mode, payload, timeout):
+    """Envoie une requête (synchrone, ou soumission puis long-poll) ; renvoie (code HTTP final, latence)."""
+    started = time.perf_counter()
+    if mode == "calculate":
+        status, _ = post(f"{base_url}/calculate", payload, timeout)
+    else:
+        status, body = post(f"{base_url}/jobs", payload, timeout)
+        while status == 202 or (status == 200 and body.get("status") in ("queued", "running")):
+            status, body = get(f"{base_url}/jobs/{body['job_id']}?wait=30", timeout)
+    return status, time.perf_counter() - started
+
+def run_burst(base_url, mode, n_requests, concurrency, distinct, timeout):
+    payloads = [{"module": "abrahamson_2014", "class_name": "AbrahamsonEtAl2014", "keys": KEYS,
+                 "values": VALUES.format(mag=round(5.0 + 0.1 * (i % distinct), 1))} for i in range(n_requests)]
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(lambda p: one_request(base_url, mode, p, timeout), payloads))
+    elapsed = time.perf_counter() - started
+    ok = np.array([latency for status, latency in outcomes if status == 200])
+    codes = {}
+    for status, _ in outcomes: codes[str(status)] = codes.get(str(status), 0) + 1
+    return {
+        "mode": mode, "requests": n_requests, "concurrency": concurrency, "distinct_scenarios": distinct,
+        "elapsed_s": round(elapsed, 3), "throughput_rps": round(len(ok) / elapsed, 2),
+        "status_codes": codes, "busy_rejections": codes.get("503", 0),
+        "failed_requests": sum(n for code, n in codes.items() if code != "200"), "connection_errors": codes.get(CONNECTION_ERROR, 0),
+        "latency_p50_s": round(float(np.percentile(ok, 50)), 3) if len(ok) else None,
+        "latency_p95_s": round(float(np.percentile(ok, 95)), 3) if len(ok) else None,
+        "latency_max_s": round(float(ok.max()), 3) if len(ok) else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Générateur de charge pour gmm_server.py")
+    parser.add_argument('--url', default="http://localhost:8000", help="Adresse du serveur")
+    parser.add_argument('--requests', type=int, default=50, help="Nombre total de requêtes")
+    parser.add_argument('--concurrency', type=int, default=20, help="Requêtes simultanées")
+    parser.add_argument('--distinct', type=int, default=10, help="Nombre de scénarios différents")
+    parser.add_argument('--mode', default="calculate", choices=["calculate", "jobs"], help="POST /calculate (synchrone) ou /jobs + long-poll")
+    parser.add_argument('--timeout', type=float, default=600.0, help="Délai HTTP par appel (secondes)")
+    args = parser.parse_args()
+    report = run_burst(args.url.rstrip('/'), args.mode, args.requests, args.concurrency, max(1, args.distinct), args.timeout)
+    status, stats = get(f"{args.url.rstrip('/')}/jobs", args.timeout)
+    if status == 200: report["server_queue"] = stats
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,139 @@
+# Fichier : build_imt_index.py
+# Construit hors ligne l'index des IMTs confirmés pour chaque classe GMM d'OpenQuake.
+#
+# Usage : python3 build_imt_index.py [--output imt_capability_index.json] [--modules abrahamson_2014,...]
+# Le wrapper charge l'index au démarrage et l'ignore dès que la version d'OpenQuake installée change.
+# Seuls les IMTs qui échouent quels que soient les paramètres (construction impossible, coefficients absents) sont
+# écartés ("skipped") ; ceux qui échouent sur le scénario représentatif restent évalués ("unconfirmed").
+
+import sys
+import json
+import time
+import argparse
+import inspect
+import pkgutil
+import importlib
+
+import numpy as np
+import run_gmm_calculation_v8 as wrapper
+from openquake.hazardlib import gsim as gsim_package
+from openquake.hazardlib.gsim.base import GMPE
+
+# Valeurs représentatives utilisées pour sonder les IMTs ; tout paramètre absent vaut DEFAULT_PARAMETER_VALUE.
+REPRESENTATIVE_PARAMETERS = {
+    # Site
+    "vs30": 760.0, "vs30measured": True, "z1pt0": 50.0, "z2pt5": 1.0, "z1pt4": 50.0, "backarc": False,
+    "xvf": 0.0, "region": 3, "geology": 8, "slope": 0.1, "siteclass": "3", "soiltype": 1, "f0": 5.0,
+    "ec8": "A", "ec8_p18": "A", "h800": 0.0, "bas": 0, "fpeak": 5.0, "kappa0": 0.04, "lat": 40.0, "lon": 10.0,
+    # Rupture
+    "mag": 6.5, "rake": 90.0, "dip": 70.0, "ztor": 2.0, "width": 10.0, "hypo_depth": 10.0,
+    "hypo_lat": 40.0, "hypo_lon": 10.0, "in_cshm": False,
+    # Distances
+    "rrup": 25.0, "rjb": 20.0, "rx": 15.0, "ry0": 0.0, "rhypo": 26.0, "repi": 20.0, "rvolc": 0.0,
+    "rcdpp": 0.0, "azimuth": 0.0,
+    # Paramètres de constructeur (HassaniAtkinson2018)
+    "d_sigma": 100.0,
+}
+DEFAULT_PARAMETER_VALUE = 1.0
+
+def representative_parameters(gmm_class, class_name=None):
+    """Jeu de paramètres couvrant tous les REQUIRES_* de la classe (et ses arguments de constructeur connus)."""
+    class_name = class_name or gmm_class.__name__
+    req_sites, req_rupture, req_distances = wrapper.get_required_parameters(gmm_class)
+    params = {p: REPRESENTATIVE_PARAMETERS.get(p, DEFAULT_PARAMETER_VALUE) for p in req_sites | req_rupture | req_distances}
+    if 'HassaniAtkinson2018' in class_name:
+        params.update(d_sigma=REPRESENTATIVE_PARAMETERS["d_sigma"], kappa0=REPRESENTATIVE_PARAMETERS["kappa0"])
+    return params
+
+def iter_gsim_classes(module_names=None):
+    """Parcourt les modules openquake.hazardlib.gsim et renvoie (module, nom de classe, classe)."""
+    if module_names is None:
+        prefix = gsim_package.__name__ + "."
+        module_names = [name[len(prefix):] for _, name, ispkg in pkgutil.walk_packages(gsim_package.__path__, prefix) if not ispkg]
+    for module_name in sorted(module_names):
+        try:
+            module = importlib.import_module(f"{gsim_package.__name__}.{module_name}")
+        except Exception as e:
+            print(f"Skipping module {module_name}: {e}", file=sys.stderr)
+            continue
+        for class_name, gmm_class in inspect.getmembers(module, inspect.isclass):
+            if gmm_class.__module__ == module.__name__ and issubclass(gmm_class, GMPE) and not inspect.isabstract(gmm_class):
+                yield module_name, class_name, gmm_class
+
+def probe_imt(gmm, sctx, rctx, dctx, imt_obj):
+    """Renvoie "confirmed", "unconfirmed" (l'échec peut dépendre des paramètres) ou "coefficients" (IMT absent des tables)."""
+    from openquake.hazardlib import const
+    try:
+        mean, stddevs = gmm.get_mean_and_stddevs(sctx, rctx, dctx, imt_obj, [const.StdDev.TOTAL])
+    except KeyError as e:
+        # CoeffsTable lève KeyError(imt) pour une période ou une fréquence hors de ses tables.
+        return "coefficients" if e.args and hasattr(e.args[0], "string") else "unconfirmed"
+    except Exception:
+        return "unconfirmed"
+    ok = len(stddevs[0]) > 0 and float(stddevs[0][0]) < 9000 and np.isfinite(mean).all()
+    return "confirmed" if ok else "unconfirmed"
+
+def probe_class(module_name, class_name, gmm_class):
+    """Évalue chaque IMT candidat sur un scénario représentatif et classe ceux qui ne sont pas confirmés."""
+    req_sites, req_rupture, req_distances = wrapper.get_required_parameters(gmm_class)
+    entry = {
+        "module": module_name, "class_name": class_name,
+        "requires": {"sites": sorted(req_sites), "rupture": sorted(req_rupture), "distances": sorted(req_distances)},
+    }
+    try:
+        user_params = representative_parameters(gmm_class, class_name)
+        init_params = inspect.signature(gmm_class.__init__).parameters
+        entry["init_parameters"] = [n for n, p in init_params.items() if n != "self" and p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD)]
+        _, gmm, constructor_args = wrapper.prepare_gmm(module_name, class_name, user_params)
+        entry["constructor_args"] = {k: v for k, v in constructor_args.items() if isinstance(v, (str, int, float, bool, dict))}
+        sctx, rctx, dctx = wrapper.build_contexts(gmm_class, user_params)
+        candidates = wrapper.get_supported_imts(gmm_class)
+    except Exception as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+        return entry
+
+    imts, unconfirmed, skipped = [], [], []
+    for imt_name, imt_params in candidates:
+        try:
+            imt_obj, _ = wrapper.make_imt(imt_name, imt_params)
+        except Exception:
+            skipped.append([imt_name, imt_params, "construction"])
+            continue
+        status = probe_imt(gmm, sctx, rctx, dctx, imt_obj)
+        if status == "coefficients":
+            skipped.append([imt_name, imt_params, status])
+            continue
+        if status == "unconfirmed": unconfirmed.append(len(imts))
+        imts.append([imt_name, imt_params])
+    # imts : IMTs évalués par le wrapper (dans l'ordre de détection) ; unconfirmed : leurs positions en échec ici.
+    entry.update(imts=imts, unconfirmed=unconfirmed, skipped=skipped, candidate_count=len(candidates))
+    confirmed = [imts[i] for i in sorted(set(range(len(imts))) - set(unconfirmed))]
+    entry["sa_periods"] = sorted({p for n, p in confirmed if n in ("SA", "AvgSA")})
+    entry["frequencies"] = sorted({p for n, p in confirmed if n in ("FAS", "EAS", "DRVT")})
+    return entry
+
+def build_index(module_names=None):
+    started = time.time()
+    classes = {}
+    for module_name, class_name, gmm_class in iter_gsim_classes(module_names):
+        entry = probe_class(module_name, class_name, gmm_class)
+        classes[wrapper.gmm_index_key(gmm_class)] = entry
+        status = entry.get("error") or (f"{len(entry['imts']) - len(entry['unconfirmed'])}/{entry['candidate_count']} IMTs confirmed, "
+                                        f"{len(entry['skipped'])} skipped")
+        print(f"{module_name}.{class_name}: {status}", file=sys.stderr)
+    return {
+        "format": wrapper.IMT_INDEX_FORMAT, "openquake_version": wrapper.get_openquake_version(),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "build_seconds": round(time.time() - started, 1),
+        "classes": classes,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construit l'index des IMTs confirmés pour les GMMs OpenQuake")
+    parser.add_argument('--output', default=wrapper.IMT_INDEX_PATH, help="Fichier JSON de sortie")
+    parser.add_argument('--modules', default="", help="Modules GSIM à indexer, séparés par virgules (tous par défaut)")
+    args = parser.parse_args()
+    modules = [m.strip() for m in args.modules.split(',') if m.strip()] or None
+    index = build_index(modules)
+    with open(args.output, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    print(f"Wrote {len(index['classes'])} classes to {args.output}", file=sys.stderr)
@@ -0,0 +1,68 @@
+# Fichier : gm_sampling.py
+# Tirage Monte Carlo de spectres corrélés entre périodes, à partir des moyennes et écarts-types (log) d'un GMM.
+#
+# Tous les spectres sont tirés en une seule opération numpy : ln(Y) = mu + sigma * (L @ Z), où Z est une
+# matrice (M, N) de normales centrées réduites et L le facteur de Cholesky de la matrice de corrélation.
+# Les tableaux sont rangés par période (M, N) : chaque ligne est contiguë, ce qui accélère le calcul des percentiles.
+
+import functools
+
+import numpy as np
+
+# Modèles de corrélation inter-périodes : nom CLI -> classe de openquake.hazardlib.cross_correlation.
+# "none" : périodes indépendantes ; "full" : un seul epsilon pour tout le spectre.
+CORRELATION_MODELS = {
+    "baker_jayaram_2008": "BakerJayaram2008",
+    "goda_atkinson_2009": "GodaAtkinson2009",
+    "none": None,
+    "full": None,
+}
+DEFAULT_CORRELATION = "baker_jayaram_2008"
+# Au-delà, les échantillons sont tirés par blocs pour borner la mémoire des matrices intermédiaires.
+MAX_BLOCK_VALUES = 10_000_000
+
+@functools.lru_cache(maxsize=64)
+def correlation_matrix(model, periods):
+    """Matrice (M, M) de corrélation entre les périodes (tuple, en secondes) selon le modèle choisi."""
+    if model not in CORRELATION_MODELS:
+        raise ValueError(f"Unknown correlation model '{model}', expected one of {', '.join(CORRELATION_MODELS)}")
+    M = len(periods)
+    if model == "none": return np.eye(M)
+    if model == "full": return np.ones((M, M))
+    from openquake.hazardlib import cross_correlation
+    from openquake.hazardlib.imt import SA
+    correlation = getattr(cross_correlation, CORRELATION_MODELS[model])()
+    imts = [SA(period) for period in periods]
+    matrix = np.eye(M)
+    for i in range(M):
+        for j in range(i + 1, M):
+            matrix[i, j] = matrix[j, i] = correlation.get_correlation(imts[i], imts[j])
+    return matrix
+
+@functools.lru_cache(maxsize=64)
+def correlation_factor(model, periods):
+    """Facteur L tel que L @ L.T = matrice de corrélation (Cholesky ; décomposition propre si elle n'est que semi-définie)."""
+    matrix = correlation_matrix(model, periods)
+    try:
+        return np.linalg.cholesky(matrix)
+    except np.linalg.LinAlgError:
+        w, v = np.linalg.eigh(matrix)
+        return v * np.sqrt(np.clip(w, 0.0, None))
+
+def sample_ln(mean_ln, sigma_ln, periods, n_samples, model=DEFAULT_CORRELATION, seed=None, dtype=np.float64):
+    """Tire n_samples spectres ln(Y) corrélés ; renvoie un tableau (M, n_samples), un spectre par colonne."""
+    mean_ln, sigma_ln = np.asarray(mean_ln, dtype=dtype), np.asarray(sigma_ln, dtype=dtype)
+    factor = correlation_factor(model, tuple(float(p) for p in periods)).astype(dtype) * sigma_ln[:, None]
+    rng = np.random.default_rng(seed)
+    M = len(mean_ln)
+    samples = np.empty((M, n_samples), dtype=dtype)
+    block = max(1, MAX_BLOCK_VALUES // max(M, 1))
+    for start in range(0, n_samples, block):
+        stop = min(start + block, n_samples)
+        samples[:, start:stop] = factor @ rng.standard_normal((M, stop - start), dtype=dtype)
+    samples += mean_ln[:, None]
+    return samples
+
+def percentiles_ln(samples, percentiles):
+    """Percentiles par période des spectres tirés (M, N) ; renvoie un tableau (len(percentiles), M)."""
+    return np.percentile(samples, percentiles, axis=1)
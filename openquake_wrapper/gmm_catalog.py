@@ -0,0 +1,197 @@
+# Fichier : gmm_catalog.py
+# Catalogue local des GMMs (paramètres requis, IMTs définis) généré depuis l'OpenQuake installé.
+#
+# Usage : python3 gmm_catalog.py [--rebuild] [--class_name ...] [--module ...] [--prefix ...] [--search ...]
+#                                [--imt SA] [--param vs30] [--available vs30,mag,rrup] [--format rows]
+# Remplace les lectures de la feuille Google (colonnes site.N, rupture.N, distance.N, supported_imts.N) :
+# le catalogue est mis en cache sur disque et régénéré dès que la version d'OpenQuake change.
+
+import os
+import sys
+import json
+import time
+import bisect
+import difflib
+import argparse
+
+CATALOG_FORMAT = 1
+CATALOG_PATH = os.environ.get("GMM_CATALOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gmm_catalog.json"))
+_CATALOGS = {}
+
+def _normalize(name):
+    """'Abrahamson et al. 2014' -> 'abrahamsonetal2014' : clé de recherche insensible à la casse et à la ponctuation."""
+    return "".join(c for c in name.lower() if c.isalnum())
+
+def describe_class(module_name, class_name, gmm_class):
+    """Entrée du catalogue : paramètres REQUIRES_*, IMTs définis, région tectonique et composante."""
+    def names(values):
+        return sorted(getattr(v, "__name__", str(v)) for v in values)
+    return {
+        "module": module_name, "class_name": class_name,
+        "site": sorted(getattr(gmm_class, "REQUIRES_SITES_PARAMETERS", ())),
+        "rupture": sorted(getattr(gmm_class, "REQUIRES_RUPTURE_PARAMETERS", ())),
+        "distance": sorted(getattr(gmm_class, "REQUIRES_DISTANCES", ())),
+        "supported_imts": names(getattr(gmm_class, "DEFINED_FOR_INTENSITY_MEASURE_TYPES", ())),
+        "trt": str(getattr(gmm_class, "DEFINED_FOR_TECTONIC_REGION_TYPE", "") or ""),
+        "component": str(getattr(gmm_class, "DEFINED_FOR_INTENSITY_MEASURE_COMPONENT", "") or ""),
+    }
+
+def generate_catalog(module_names=None):
+    """Parcourt openquake.hazardlib.gsim (import de tous les modules : quelques dizaines de secondes)."""
+    import run_gmm_calculation_v8 as wrapper
+    from build_imt_index import iter_gsim_classes
+    started = time.time()
+    entries = [describe_class(m, c, cls) for m, c, cls in iter_gsim_classes(module_names)]
+    return {"format": CATALOG_FORMAT, "openquake_version": wrapper.get_openquake_version(),
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "build_seconds": round(time.time() - started, 1),
+            "entries": entries}
+
+class GMMCatalog:
+    """Catalogue indexé en mémoire : recherche exacte, par préfixe (bisect), approchée (difflib), par IMT ou paramètre."""
+
+    def __init__(self, data):
+        self.openquake_version = data.get("openquake_version")
+        self.built_at = data.get("built_at")
+        self.entries = sorted(data["entries"], key=lambda e: (_normalize(e["class_name"]), e["module"]))
+        self._keys = [_normalize(e["class_name"]) for e in self.entries]
+        self._by_key, self._by_class, self._by_module = {}, {}, {}
+        self._by_imt, self._by_param = {}, {}
+        for i, entry in enumerate(self.entries):
+            self._by_key[f"{entry['module']}.{entry['class_name']}"] = i
+            self._by_class.setdefault(entry["class_name"], []).append(i)
+            self._by_module.setdefault(entry["module"], []).append(i)
+            for imt_name in entry["supported_imts"]:
+                self._by_imt.setdefault(imt_name, set()).add(i)
+            for param in entry["site"] + entry["rupture"] + entry["distance"]:
+                self._by_param.setdefault(param, set()).add(i)
+        self._modules = sorted(self._by_module)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, module_name, class_name):
+        i = self._by_key.get(f"{module_name}.{class_name}")
+        return None if i is None else self.entries[i]
+
+    def by_class(self, class_name):
+        return [self.entries[i] for i in self._by_class.get(class_name, [])]
+
+    def by_module(self, module_name):
+        return [self.entries[i] for i in self._by_module.get(module_name, [])]
+
+    def prefix(self, text):
+        """Classes dont le nom (normalisé) commence par text, dans l'ordre alphabétique."""
+        key = _normalize(text)
+        start = bisect.bisect_left(self._keys, key)
+        stop = bisect.bisect_left(self._keys, key + "￿")
+        return self.entries[start:stop]
+
+    def search(self, text, limit=10, cutoff=0.6):
+        """Recherche approchée sur les noms de classes et de modules : préfixe, puis sous-chaîne, puis difflib."""
+        key = _normalize(text)
+        if not key: return []
+        found = [self._by_key[f"{e['module']}.{e['class_name']}"] for e in self.prefix(text)]
+        found += [i for i, k in enumerate(self._keys) if key in k and i not in found]
+        for module_name in self._modules:
+            if key in _normalize(module_name):
+                found += [i for i in self._by_module[module_name] if i not in found]
+        if len(found) < limit:
+            close = difflib.get_close_matches(key, self._keys, n=limit, cutoff=cutoff)
+            ranks = {}
+            for rank, match in enumerate(close):
+                ranks.setdefault(match, rank)
+            found += [i for i, k in sorted(enumerate(self._keys), key=lambda x: ranks.get(x[1], len(close)))
+                      if k in ranks and i not in found]
+        return [self.entries[i] for i in found[:limit]]
+
+    def filter(self, imts=(), params=(), available=None):
+        """Modèles définissant tous les IMTs `imts` et requérant tous les paramètres `params`.
+
+        Avec available (ensemble de paramètres connus), ne garde que les modèles calculables avec ces seuls paramètres.
+        """
+        selected = set(range(len(self.entries)))
+        for imt_name in imts: selected &= self._by_imt.get(imt_name, set())
+        for param in params: selected &= self._by_param.get(param, set())
+        if available is not None:
+            available = set(available)
+            selected = {i for i in selected
+                        if set(self.entries[i]["site"] + self.entries[i]["rupture"] + self.entries[i]["distance"]) <= available}
+        return [self.entries[i] for i in sorted(selected)]
+
+    def stats(self):
+        return {"models": len(self.entries), "modules": len(self._modules), "imts": sorted(self._by_imt),
+                "parameters": sorted(self._by_param), "openquake_version": self.openquake_version, "built_at": self.built_at}
+
+def as_row(entry):
+    """Entrée au format des lignes de la feuille du workflow (module, class_name, site.N, rupture.N, distance.N, supported_imts.N)."""
+    row = {"module": entry["module"], "class_name": entry["class_name"]}
+    for column in ("site", "rupture", "distance", "supported_imts"):
+        row.update({f"{column}.{i}": value for i, value in enumerate(entry[column])})
+    return row
+
+def load_catalog(path=None, rebuild=False):
+    """Catalogue en mémoire ; le fichier est (re)généré s'il manque, est illisible ou date d'une autre version d'OpenQuake."""
+    path = path or CATALOG_PATH
+    if path in _CATALOGS and not rebuild:
+        return _CATALOGS[path]
+    data = None
+    if not rebuild:
+        try:
+            with open(path) as f: data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+    if data is not None:
+        from run_gmm_calculation_v8 import get_openquake_version
+        if data.get("format") != CATALOG_FORMAT or data.get("openquake_version") != get_openquake_version():
+            print(f"GMM catalog {path} was built for OpenQuake {data.get('openquake_version')}, rebuilding it.", file=sys.stderr)
+            data = None
+    if data is None:
+        data = generate_catalog()
+        try:
+            with open(path, "w") as f: json.dump(data, f, separators=(",", ":"))
+        except OSError as e:
+            print(f"Could not write GMM catalog {path}: {e}", file=sys.stderr)
+    _CATALOGS[path] = GMMCatalog(data)
+    return _CATALOGS[path]
+
+def query_catalog(catalog, class_name=None, module=None, prefix=None, search=None, imts=(), params=(), available=None, limit=None):
+    """Combine les critères (CLI et serveur) ; sans critère, renvoie tout le catalogue."""
+    if class_name and module:
+        entry = catalog.get(module, class_name)
+        entries = [entry] if entry else []
+    elif class_name: entries = catalog.by_class(class_name)
+    elif module: entries = catalog.by_module(module)
+    elif prefix: entries = catalog.prefix(prefix)
+    elif search: entries = catalog.search(search, limit=limit or 10)
+    else: entries = catalog.entries
+    if imts or params or available is not None:
+        keep = {(e["module"], e["class_name"]) for e in catalog.filter(imts, params, available)}
+        entries = [e for e in entries if (e["module"], e["class_name"]) in keep]
+    return entries[:limit] if limit else entries
+
+def split_list(value):
+    return [v.strip() for v in value.split(',') if v.strip()] if value else []
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catalogue local des GMMs OpenQuake (paramètres requis et IMTs)")
+    parser.add_argument('--rebuild', action='store_true', help="Régénère le catalogue depuis l'OpenQuake installé")
+    parser.add_argument('--path', default=CATALOG_PATH, help="Fichier du catalogue")
+    parser.add_argument('--class_name', help="Nom exact de la classe")
+    parser.add_argument('--module', help="Nom exact du module")
+    parser.add_argument('--prefix', help="Début du nom de classe")
+    parser.add_argument('--search', help="Recherche approchée sur les noms de classes et de modules")
+    parser.add_argument('--imt', help="IMTs requis, séparés par virgules (ex. SA,PGV)")
+    parser.add_argument('--param', help="Paramètres requis par le modèle, séparés par virgules")
+    parser.add_argument('--available', help="Paramètres disponibles : ne garde que les modèles calculables avec eux")
+    parser.add_argument('--limit', type=int, help="Nombre maximal de résultats")
+    parser.add_argument('--format', default="entries", choices=["entries", "rows"], help="rows : colonnes de la feuille du workflow")
+    parser.add_argument('--stats', action='store_true', help="Résumé du catalogue")
+    args = parser.parse_args()
+    catalog = load_catalog(args.path, rebuild=args.rebuild)
+    if args.stats:
+        print(json.dumps(catalog.stats(), indent=2))
+        sys.exit(0)
+    entries = query_catalog(catalog, args.class_name, args.module, args.prefix, args.search, split_list(args.imt), split_list(args.param),
+                            split_list(args.available) if args.available is not None else None, args.limit)
+    print(json.dumps({"success": True, "count": len(entries),
+                      "results": [as_row(e) for e in entries] if args.format == "rows" else entries}, indent=2))
@@ -0,0 +1,390 @@
+# Fichier : gmm_server.py
+# Serveur HTTP persistant pour le wrapper GMM : OpenQuake reste importé entre deux requêtes.
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import importlib
+import threading
+from argparse import Namespace
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import run_gmm_calculation_v8 as wrapper
+from job_queue import JobQueue, QueueFullError, DEFAULT_MAX_QUEUE, DEFAULT_JOB_TIMEOUT
+from result_cache import ResultCache
+import gmm_catalog
+import metrics
+import report_pdf
+
+DEFAULT_WORKERS = 2
+MAX_LONG_POLL = 60.0
+# File de jobs partagée par les threads HTTP ; None = calcul directement dans le thread de la requête.
+JOBS = None
+# Calculs en streaming simultanés (ils écrivent sur la connexion et restent dans le thread HTTP, hors de la file) :
+# borné au nombre de workers, None = sans limite (--workers 0).
+STREAMS = None
+# Métriques agrégées des calculs du serveur (GET /metrics), alimentées dans le processus principal.
+METRICS = metrics.MetricsRegistry()
+
+def _optional_int(payload, field, minimum=0):
+    """Entier facultatif du corps de la requête, au moins égal à minimum ; ValueError (400) sinon."""
+    value = payload.get(field)
+    if value is None: return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise ValueError(f"{field} must be a non-negative integer" if minimum == 0 else f"{field} must be an integer >= {minimum}")
+    return value
+
+def build_args(payload):
+    """Convertit le corps JSON d'une requête en arguments équivalents à ceux de la CLI."""
+    if not isinstance(payload, dict):
+        raise ValueError("Request body must be a JSON object")
+    gmms = payload.get("gmms")
+    if isinstance(gmms, list):
+        # [{"module": ..., "class_name": ..., "weight": ...}, ...] -> "module:Classe:poids,..."
+        gmms = ",".join(f"{g['module']}:{g['class_name']}:{g.get('weight', 1.0)}" for g in gmms)
+    for field in ("module", "class_name"):
+        if not gmms and not payload.get(field):
+            raise ValueError(f"Missing field: {field}")
+    if "params" in payload:
+        # Une liste de valeurs devient un vecteur du mode batch ("a;b;c").
+        params = payload["params"]
+        keys = list(params.keys())
+        values = [";".join(str(x) for x in v) if isinstance(v, list) else str(v) for v in params.values()]
+    else:
+        keys, values = payload.get("keys", ""), payload.get("values", "")
+        if isinstance(keys, list): keys = [str(k) for k in keys]
+        else: keys = str(keys).split(',')
+        if isinstance(values, list): values = [str(v) for v in values]
+        else: values = str(values).split(',')
+    if len(keys) != len(values):
+        raise ValueError(f"Got {len(keys)} keys but {len(values)} values")
+    output_format = payload.get("output_format") or "records"
+    if output_format not in wrapper.OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {', '.join(wrapper.OUTPUT_FORMATS)}")
+    if output_format != "records" and (gmms or payload.get("stream")):
+        raise ValueError("output_format columnar/npz is only available for single-scenario and batch calculations")
+    return Namespace(module=payload.get("module"), class_name=payload.get("class_name"),
+                     keys=",".join(keys), values=",".join(values), grid=bool(payload.get("grid", False)),
+                     gmms=gmms, percentiles=payload.get("percentiles"), workers=_optional_int(payload, "workers"),
+                     plot_format=payload.get("plot_format"), preview=bool(payload.get("preview", False)),
+                     inline_plot=bool(payload.get("inline_plot", False)), stream=bool(payload.get("stream", False)),
+                     samples=_optional_int(payload, "samples", minimum=1),
+                     correlation=payload.get("correlation"), seed=_optional_int(payload, "seed"), timings=bool(payload.get("timings", False)),
+                     output_format=output_format)
+
+def calculate(args):
+    """Calcul d'une requête ; avec inline_plot, le graphique est renvoyé en base64 au lieu d'être écrit sur disque.
+
+    output_format columnar ou npz (en base64) remplace imt_results par des tableaux par famille d'IMTs.
+    """
+    if args.inline_plot and not args.gmms and not args.samples and not wrapper.is_batch_request(args):
+        timings = {} if args.timings else None
+        response, plot_bytes = wrapper.calculate_gmm_with_plot(args, write_plot=False, timings=timings)
+        if timings is not None: response["timings"] = wrapper.timings_report(timings)
+        response["plot_base64"] = base64.b64encode(plot_bytes).decode("ascii") if plot_bytes else None
+        response["plot_format"] = args.plot_format or "png"
+    else:
+        response = wrapper.dispatch_calculation(args)
+    return wrapper.format_output(response, args.output_format)
+
+def build_reports(payload):
+    """Corps de POST /report : une demande de rapport, ou {"reports": [...], "merge": bool} ; renvoie la forme liste."""
+    if not isinstance(payload, dict):
+        raise ValueError("Request body must be a JSON object")
+    items = payload["reports"] if "reports" in payload else [payload]
+    if not isinstance(items, list) or not items:
+        raise ValueError("reports must be a non-empty list")
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("Each report must be a JSON object")
+        if not isinstance(item.get("response"), dict) and not (item.get("module") and item.get("class_name")):
+            raise ValueError("Each report needs a calculation response or module and class_name")
+    return {"reports": items, "merge": bool(payload.get("merge", False))}
+
+def run_reports(payload):
+    """Rapports PDF en processus (WeasyPrint), renvoyés en base64 ; un seul PDF pour toutes les demandes avec merge."""
+    pdfs, responses, timings = report_pdf.generate_reports(payload["reports"], payload["merge"])
+    if payload["merge"]:
+        reports = [{"gmms": [r.get("gmm") for r in responses], "pdf_base64": base64.b64encode(pdfs[0]).decode("ascii")}]
+    else:
+        reports = [{"gmm": r.get("gmm"), "pdf_base64": base64.b64encode(pdf).decode("ascii")} for r, pdf in zip(responses, pdfs)]
+    return {"success": True, "count": len(payload["reports"]), "merged": payload["merge"], "reports": reports, "timings": timings}
+
+def run_job(payload):
+    """Exécuté dans un processus worker de la file : même calcul que /calculate (ou /report).
+
+    Le bloc timings est toujours calculé pour les métriques ; record_job_metrics le retire s'il n'a pas été demandé.
+    Les membres d'un ensemble sont évalués dans ce worker, sans nouveau pool : GMM_WORKERS borne tous les processus.
+    """
+    if "reports" in payload: return run_reports(payload)
+    args = build_args(payload)
+    args.timings, args.workers = True, 0
+    return calculate(args)
+
+def observe(args, status, seconds, response=None, keep_timings=True):
+    """Ajoute un calcul aux métriques du serveur ; retire le bloc timings de la réponse si keep_timings est faux."""
+    timings = None
+    if isinstance(response, dict):
+        timings = response.get("timings") if keep_timings else response.pop("timings", None)
+        if not response.get("success", True): status = "error"
+    METRICS.observe(wrapper.metrics_label(args) or "unknown", status, seconds, timings)
+
+def record_job_metrics(job):
+    """Appelé par la file à la fin de chaque job, avant que les requêtes en attente ne lisent son résultat."""
+    status = {"done": "ok", "timeout": "timeout"}.get(job.status, "error")
+    if "reports" in job.payload:
+        METRICS.observe("report", status, job.finished - (job.started or job.submitted))
+        return
+    args = build_args(job.payload)
+    observe(args, status, job.finished - (job.started or job.submitted), job.result, keep_timings=args.timings)
+
+def job_key(args):
+    """Deux requêtes équivalentes (mêmes arguments) partagent le même job tant qu'il est en cours."""
+    return ResultCache.make_key(vars(args))
+
+# Code HTTP d'un job terminé sans résultat.
+JOB_ERROR_STATUS = {"GMMCalculationError": 422, "timeout": 504}
+# /report : une demande invalide (réponse de calcul inutilisable...) est une erreur du client, avec ou sans file.
+REPORT_ERROR_STATUS = dict(JOB_ERROR_STATUS, ValueError=400, TypeError=400)
+
+class GMMHTTPServer(ThreadingHTTPServer):
+    # File d'attente TCP de listen() : avec la valeur par défaut (5), une rafale de connexions est refusée par le
+    # noyau (reset) avant que le serveur ne puisse répondre 503.
+    request_queue_size = 128
+    daemon_threads = True
+
+class GMMRequestHandler(BaseHTTPRequestHandler):
+    server_version = "OpenGSIMWrapper/1.0"
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream_ndjson(self, args):
+        """Réponse NDJSON (une ligne par IMT) ; l'en-tête n'est envoyé qu'avec la première ligne, pour
+        qu'une erreur survenue avant tout résultat garde son code HTTP habituel."""
+        started = []
+        def write(line):
+            if not started:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                started.append(True)
+            self.wfile.write(line.encode("utf-8") + b"\n")
+            self.wfile.flush()
+        summary = None
+        try:
+            summary = wrapper.stream_gmm_calculation(args, write)
+        except Exception as e:
+            if not started: raise
+            write(json.dumps({"type": "error", "success": False, "error": f"{type(e).__name__}: {e}"}))
+        self.close_connection = True
+        return summary
+
+    def _send_busy(self, error):
+        data = json.dumps({"success": False, "error": "busy", "detail": str(error)}).encode("utf-8")
+        self.send_response(503)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Retry-After", "5")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_job(self, job):
+        body = dict(job.to_dict(), success=job.status not in ("failed", "timeout"))
+        self._send_json(JOB_ERROR_STATUS.get(job.error_type, 500) if not body["success"] else 200, body)
+
+    def _get_job(self, job_id, query):
+        job = JOBS.get(job_id) if JOBS else None
+        if job is None:
+            self._send_json(404, {"success": False, "error": f"Unknown job: {job_id}"})
+            return
+        try:
+            wait = min(float(query.get("wait", ["0"])[0]), MAX_LONG_POLL)
+        except ValueError:
+            self._send_json(400, {"success": False, "error": "Bad Request: wait must be a number of seconds"})
+            return
+        if wait > 0: JOBS.wait(job, wait)
+        self._send_job(job)
+
+    def _get_catalog(self, query):
+        # ?class_name=&module=&prefix=&search=&imt=SA,PGV&param=vs30&available=mag,rrup,vs30&limit=&format=rows
+        first = lambda name: query.get(name, [None])[0]
+        try:
+            limit = int(first("limit")) if first("limit") else None
+        except ValueError:
+            self._send_json(400, {"success": False, "error": "Bad Request: limit must be an integer"})
+            return
+        catalog = gmm_catalog.load_catalog()
+        entries = gmm_catalog.query_catalog(catalog, first("class_name"), first("module"), first("prefix"), first("search"),
+                                            gmm_catalog.split_list(first("imt")), gmm_catalog.split_list(first("param")),
+                                            gmm_catalog.split_list(first("available")) if "available" in query else None, limit)
+        if first("format") == "rows": entries = [gmm_catalog.as_row(e) for e in entries]
+        self._send_json(200, {"success": True, "openquake_version": catalog.openquake_version, "count": len(entries), "results": entries})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/')
+        if path.startswith("/jobs/"):
+            self._get_job(path[len("/jobs/"):], parse_qs(url.query))
+        elif path == "/jobs":
+            if JOBS is None: self._send_json(404, {"success": False, "error": "Job queue is disabled (--workers 0)"})
+            else: self._send_json(200, dict(JOBS.stats(), success=True))
+        elif path == "/catalog":
+            self._get_catalog(parse_qs(url.query))
+        elif path == "/metrics":
+            data = METRICS.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path == "/health":
+            self._send_json(200, {"success": True, "openquake_version": wrapper.get_openquake_version()})
+        elif path == "/cache/stats":
+            cache = wrapper.get_result_cache()
+            if cache is None: self._send_json(404, {"success": False, "error": "Result cache is disabled (set GMM_CACHE_DIR)"})
+            else: self._send_json(200, dict(cache.stats(), success=True))
+        else:
+            self._send_json(404, {"success": False, "error": f"Unknown endpoint: {self.path}"})
+
+    def _send_report_error(self, error_type, message):
+        status = REPORT_ERROR_STATUS.get(error_type, 500)
+        prefix = {400: "Bad Request: ", 500: f"Internal Error: {error_type}: "}.get(status, "")
+        self._send_json(status, {"success": False, "error": prefix + message})
+
+    def _post_report(self, payload):
+        """POST /report : synchrone, via la file de jobs si elle est active ; mêmes codes d'erreur dans les deux cas."""
+        if JOBS is not None:
+            try:
+                job, _ = JOBS.submit(ResultCache.make_key(payload), payload)
+            except QueueFullError as e:
+                self._send_busy(e)
+                return
+            JOBS.wait(job)
+            if job.status == "done": self._send_json(200, job.result)
+            else: self._send_report_error(job.error_type, job.error)
+            return
+        started = time.perf_counter()
+        try:
+            response = run_reports(payload)
+        except Exception as e:
+            METRICS.observe("report", "error", time.perf_counter() - started)
+            self._send_report_error(type(e).__name__, str(e))
+            return
+        METRICS.observe("report", "ok", time.perf_counter() - started)
+        self._send_json(200, response)
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        if path not in ("/calculate", "/jobs", "/report"):
+            self._send_json(404, {"success": False, "error": f"Unknown endpoint: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if path == "/report":
+                self._post_report(build_reports(payload))
+                return
+            args = build_args(payload)
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {"success": False, "error": f"Bad Request: {e}"})
+            return
+        if args.stream and (path == "/jobs" or args.gmms or wrapper.is_batch_request(args)):
+            self._send_json(400, {"success": False, "error": "Bad Request: stream is only available for single-scenario calculations on /calculate"})
+            return
+        if path == "/jobs" and JOBS is None:
+            self._send_json(404, {"success": False, "error": "Job queue is disabled (--workers 0)"})
+            return
+        if JOBS is not None and not args.stream:
+            try:
+                job, deduplicated = JOBS.submit(job_key(args), payload)
+            except QueueFullError as e:
+                self._send_busy(e)
+                return
+            if path == "/jobs":
+                self._send_json(202, dict(job.to_dict(), success=True, deduplicated=deduplicated))
+                return
+            # /calculate reste synchrone : la requête attend son job dans la file.
+            JOBS.wait(job)
+            if job.status == "done": self._send_json(200, job.result)
+            else: self._send_json(JOB_ERROR_STATUS.get(job.error_type, 500), {"success": False, "error": job.error})
+            return
+        if args.stream and STREAMS is not None and not STREAMS.acquire(blocking=False):
+            self._send_busy(f"Server busy: {JOBS.workers} streaming calculations already running")
+            return
+        started, show_timings = time.perf_counter(), args.timings
+        try:
+            if args.stream:
+                try:
+                    summary = self._stream_ndjson(args)
+                finally:
+                    if STREAMS is not None: STREAMS.release()
+                observe(args, "ok", time.perf_counter() - started, summary)
+            else:
+                args.timings = True
+                response = calculate(args)
+                observe(args, "ok", time.perf_counter() - started, response, keep_timings=show_timings)
+                self._send_json(200, response)
+        except wrapper.GMMCalculationError as e:
+            observe(args, "error", time.perf_counter() - started)
+            self._send_json(422, {"success": False, "error": str(e)})
+        except Exception as e:
+            observe(args, "error", time.perf_counter() - started)
+            self._send_json(500, {"success": False, "error": f"Internal Error: {type(e).__name__}: {e}"})
+
+    def log_message(self, format, *args):
+        print(f"[gmm_server] {self.address_string()} - {format % args}", file=sys.stderr)
+
+def preload_modules(module_names):
+    """Importe à l'avance les modules GSIM les plus demandés pour que la première requête soit chaude."""
+    for name in module_names:
+        try:
+            importlib.import_module(f"openquake.hazardlib.gsim.{name}")
+        except Exception as e:
+            print(f"[gmm_server] Could not preload {name}: {e}", file=sys.stderr)
+
+def init_worker(preload):
+    preload_modules(preload)
+    wrapper.load_imt_index()
+
+def serve(host, port, preload=(), workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE, job_timeout=DEFAULT_JOB_TIMEOUT):
+    global JOBS, STREAMS
+    init_worker(preload)
+    gmm_catalog.load_catalog()
+    if workers > 0:
+        JOBS = JobQueue(run_job, workers, max_queue, job_timeout, initializer=init_worker, initargs=(list(preload),),
+                        on_done=record_job_metrics)
+        STREAMS = threading.BoundedSemaphore(workers)
+    httpd = GMMHTTPServer((host, port), GMMRequestHandler)
+    print(f"[gmm_server] Listening on http://{host}:{port}", file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if JOBS is not None: JOBS.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serveur HTTP persistant pour le calcul des IMTs d'un GMM OpenQuake")
+    parser.add_argument('--host', default="0.0.0.0", help="Adresse d'écoute")
+    parser.add_argument('--port', type=int, default=8000, help="Port d'écoute")
+    parser.add_argument('--preload', default="", help="Modules GSIM à importer au démarrage, séparés par virgules")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get("GMM_WORKERS", DEFAULT_WORKERS)),
+                        help="Processus de calcul (0 : calcul dans le thread de la requête, sans file)")
+    parser.add_argument('--max-queue', type=int, default=int(os.environ.get("GMM_MAX_QUEUE", DEFAULT_MAX_QUEUE)),
+                        help="Jobs en attente au-delà desquels les requêtes sont refusées (503 busy)")
+    parser.add_argument('--job-timeout', type=float, default=float(os.environ.get("GMM_JOB_TIMEOUT", DEFAULT_JOB_TIMEOUT)),
+                        help="Durée maximale d'un job en secondes")
+    args = parser.parse_args()
+    serve(args.host, args.port, [m.strip() for m in args.preload.split(',') if m.strip()],
+          args.workers, args.max_queue, args.job_timeout)
@@ -0,0 +1,148 @@
+# Fichier : job_queue.py
+# File de calculs du serveur : nombre de workers borné, profondeur de file maximale, délai par job
+# et dédoublonnage des requêtes identiques en cours.
+#
+# La file est gérée par une boucle asyncio dans un thread dédié ; les calculs tournent dans un pool de
+# processus (chaque worker importe OpenQuake une seule fois). Les threads HTTP soumettent et attendent
+# les jobs via les méthodes thread-safe submit / get / wait.
+
+import sys
+import time
+import uuid
+import asyncio
+import threading
+import concurrent.futures
+
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_JOB_TIMEOUT = 300.0
+# Durée de conservation des jobs terminés (secondes), pour que le client puisse relever le résultat.
+JOB_RETENTION = 600.0
+
+class QueueFullError(Exception):
+    """La file est pleine : le client doit réessayer plus tard (HTTP 503)."""
+
+class Job:
+    def __init__(self, key, payload):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.payload = payload
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.error_type = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        body = {"job_id": self.id, "status": self.status, "submitted_at": self.submitted}
+        if self.started: body["queue_wait_s"] = round(self.started - self.submitted, 3)
+        if self.finished: body["run_time_s"] = round(self.finished - (self.started or self.submitted), 3)
+        if self.status == "done": body["result"] = self.result
+        if self.error: body["error"] = self.error
+        return body
+
+class JobQueue:
+    """File de jobs asyncio ; func(payload) est exécutée dans un ProcessPoolExecutor de `workers` processus.
+
+    Un job dépassant `timeout` est marqué "timeout" aussitôt, mais son processus garde la place jusqu'à la
+    fin effective du calcul : le nombre de calculs simultanés ne dépasse jamais `workers`.
+    on_done(job), si fourni, est appelé dans le thread de la file dès qu'un job se termine, avant de réveiller
+    les requêtes qui l'attendent.
+    """
+
+    def __init__(self, func, workers, max_queue=DEFAULT_MAX_QUEUE, timeout=DEFAULT_JOB_TIMEOUT, initializer=None, initargs=(),
+                 on_done=None):
+        self.func = func
+        self.on_done = on_done
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+        self._jobs = {}
+        self._inflight = {}
+        self._counters = {"submitted": 0, "deduplicated": 0, "rejected": 0, "done": 0, "failed": 0, "timeout": 0}
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, args=(ready,), name="gmm-job-queue", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def _run_loop(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        for _ in range(self.workers):
+            self._loop.create_task(self._worker())
+        self._loop.call_soon(ready.set)
+        self._loop.run_forever()
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status, job.started = "running", time.time()
+            future = self._loop.run_in_executor(self._pool, self.func, job.payload)
+            try:
+                job.result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+                job.status = "done"
+            except asyncio.TimeoutError:
+                job.status, job.error, job.error_type = "timeout", f"Job exceeded the {self.timeout:g} s timeout", "timeout"
+            except Exception as e:
+                job.status, job.error, job.error_type = "failed", str(e), type(e).__name__
+            job.finished = time.time()
+            self._counters[job.status] += 1
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            if self.on_done is not None:
+                try:
+                    self.on_done(job)
+                except Exception as e:
+                    print(f"[job_queue] on_done failed for job {job.id}: {type(e).__name__}: {e}", file=sys.stderr)
+            job.done.set()
+            if not future.done():
+                # On garde le slot occupé tant que le processus calcule encore.
+                await asyncio.wait([future])
+            self._queue.task_done()
+
+    async def _submit(self, key, payload):
+        self._purge()
+        job = self._inflight.get(key)
+        if job is not None:
+            self._counters["deduplicated"] += 1
+            return job, True
+        if self._queue.full():
+            self._counters["rejected"] += 1
+            raise QueueFullError(f"Server busy: {self._queue.qsize()} jobs waiting (max {self.max_queue})")
+        job = Job(key, payload)
+        self._queue.put_nowait(job)
+        self._jobs[job.id] = self._inflight[key] = job
+        self._counters["submitted"] += 1
+        return job, False
+
+    def _purge(self):
+        limit = time.time() - JOB_RETENTION
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < limit]:
+            del self._jobs[job_id]
+
+    def submit(self, key, payload):
+        """Ajoute un job (ou renvoie le job identique déjà en cours) ; renvoie (job, dédoublonné).
+
+        Lève QueueFullError si la file est pleine.
+        """
+        return asyncio.run_coroutine_threadsafe(self._submit(key, payload), self._loop).result()
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def wait(self, job, timeout=None):
+        """Attend la fin du job (long-poll) ; renvoie True s'il est terminé."""
+        return job.done.wait(timeout)
+
+    def stats(self):
+        running = sum(1 for j in list(self._jobs.values()) if j.status == "running")
+        return dict(self._counters, workers=self.workers, max_queue=self.max_queue, timeout_s=self.timeout,
+                    queued=self._queue.qsize(), running=running, retained_jobs=len(self._jobs))
+
+    def shutdown(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._pool.shutdown(wait=False, cancel_futures=True)
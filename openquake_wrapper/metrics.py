@@ -0,0 +1,97 @@
+# Fichier : metrics.py
+# Métriques agrégées des calculs (format texte Prometheus) : latence par classe GMM, temps par étape,
+# IMTs sondés sans succès et hits du cache.
+#
+# Le serveur garde un registre en mémoire (GET /metrics) ; la CLI, qui vit le temps d'un appel, cumule ses
+# mesures dans un fichier (--metrics-file ou $GMM_METRICS_FILE) lisible par le textfile collector de node_exporter.
+
+import os
+import json
+import fcntl
+import threading
+
+# Bornes (secondes) des histogrammes de latence ; la dernière classe (+Inf) est implicite.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _labels(**labels):
+    # Échappement des valeurs d'étiquettes selon le format texte Prometheus.
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """Compteurs et histogrammes par classe GMM ; thread-safe, sérialisable en JSON (to_dict, puis MetricsRegistry(state))."""
+
+    def __init__(self, state=None):
+        self._lock = threading.Lock()
+        # Un état enregistré avec d'autres bornes d'histogramme est abandonné.
+        self.gmms = state["gmms"] if state and state.get("buckets") == list(LATENCY_BUCKETS) else {}
+
+    def to_dict(self):
+        with self._lock:
+            return {"buckets": list(LATENCY_BUCKETS), "gmms": json.loads(json.dumps(self.gmms))}
+
+    def observe(self, gmm, status, total_s, timings=None):
+        """Enregistre un calcul : gmm (nom de classe), status (ok, error, timeout), durée totale et bloc timings éventuel."""
+        with self._lock:
+            entry = self.gmms.setdefault(gmm, {"status": {}, "buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0,
+                                               "stages": {}, "failed_probes": 0, "failed_probe_seconds": 0.0, "cache_hits": 0})
+            entry["status"][status] = entry["status"].get(status, 0) + 1
+            entry["count"] += 1
+            entry["sum"] += total_s
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if total_s <= bound: entry["buckets"][i] += 1
+            if timings:
+                for stage, seconds in timings.get("stages_s", {}).items():
+                    entry["stages"][stage] = entry["stages"].get(stage, 0.0) + seconds
+                probes = timings.get("failed_probes", {})
+                entry["failed_probes"] += probes.get("count", 0)
+                entry["failed_probe_seconds"] += probes.get("time_s", 0.0)
+                entry["cache_hits"] += timings.get("imt_source") == "cache"
+
+    def render(self):
+        """Exposition au format texte Prometheus (version 0.0.4)."""
+        with self._lock:
+            gmms = sorted(self.gmms.items())
+            lines = ["# HELP gmm_calculations_total Calculations per GMM class and outcome.",
+                     "# TYPE gmm_calculations_total counter"]
+            lines += [f"gmm_calculations_total{_labels(gmm=g, status=s)} {n}" for g, e in gmms for s, n in sorted(e["status"].items())]
+            lines += ["# HELP gmm_calculation_seconds Wall time of a calculation per GMM class.",
+                      "# TYPE gmm_calculation_seconds histogram"]
+            for g, e in gmms:
+                for bound, n in zip(LATENCY_BUCKETS, e["buckets"]):
+                    lines.append(f"gmm_calculation_seconds_bucket{_labels(gmm=g, le=_number(bound))} {n}")
+                lines.append(f"gmm_calculation_seconds_bucket{_labels(gmm=g, le='+Inf')} {e['count']}")
+                lines.append(f"gmm_calculation_seconds_sum{_labels(gmm=g)} {_number(e['sum'])}")
+                lines.append(f"gmm_calculation_seconds_count{_labels(gmm=g)} {e['count']}")
+            lines += ["# HELP gmm_stage_seconds_total Time spent per calculation stage and GMM class.",
+                      "# TYPE gmm_stage_seconds_total counter"]
+            lines += [f"gmm_stage_seconds_total{_labels(gmm=g, stage=s)} {_number(t)}" for g, e in gmms for s, t in sorted(e["stages"].items())]
+            lines += ["# HELP gmm_failed_imt_probes_total IMTs probed without success per GMM class.",
+                      "# TYPE gmm_failed_imt_probes_total counter"]
+            lines += [f"gmm_failed_imt_probes_total{_labels(gmm=g)} {e['failed_probes']}" for g, e in gmms]
+            lines += ["# HELP gmm_failed_imt_probe_seconds_total Time spent probing unsupported IMTs per GMM class.",
+                      "# TYPE gmm_failed_imt_probe_seconds_total counter"]
+            lines += [f"gmm_failed_imt_probe_seconds_total{_labels(gmm=g)} {_number(e['failed_probe_seconds'])}" for g, e in gmms]
+            lines += ["# HELP gmm_cache_hits_total Calculations served from the result cache per GMM class.",
+                      "# TYPE gmm_cache_hits_total counter"]
+            lines += [f"gmm_cache_hits_total{_labels(gmm=g)} {e['cache_hits']}" for g, e in gmms]
+        return "\n".join(lines) + "\n"
+
+def update_metrics_file(path, gmm, status, total_s, timings=None):
+    """Ajoute un calcul au fichier de métriques (CLI) ; l'état cumulé est gardé dans path + '.json'.
+
+    Un verrou fcntl sérialise les appels concurrents ; les fichiers sont remplacés atomiquement.
+    """
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path + ".json") as f: registry = MetricsRegistry(json.load(f))
+        except (OSError, ValueError):
+            registry = MetricsRegistry()
+        registry.observe(gmm, status, total_s, timings)
+        for target, content in ((path + ".json", json.dumps(registry.to_dict())), (path, registry.render())):
+            with open(target + ".tmp", "w") as f: f.write(content)
+            os.replace(target + ".tmp", target)
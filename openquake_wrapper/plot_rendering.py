@@ -0,0 +1,185 @@
+# Fichier : plot_rendering.py
+# Rendu des spectres avec l'API objet de Matplotlib (Figure + canvas Agg), sans l'état global de pyplot.
+# Matplotlib n'est importé qu'au premier tracé : choisir la série, les options ou écrire un fichier n'en a pas besoin.
+#
+# Les figures pré-stylées sont gardées au niveau du module, une par type de graphique, et réutilisées d'une
+# requête à l'autre par tous les threads du processus (serveur, workers de la file) : seules les courbes sont
+# remplacées. Une commande CLI ne trace qu'un graphique par processus et n'en tire donc aucun gain.
+# Les images sont renvoyées en mémoire ou écrites sous un nom unique.
+
+import os
+import io
+import time
+import tempfile
+import threading
+
+import numpy as np
+
+DEFAULT_DPI = 150
+PREVIEW_DPI = 72
+PLOT_DIR = os.environ.get("GMM_PLOT_DIR", tempfile.gettempdir())
+# Les fichiers ayant un nom unique, les anciens graphiques sont supprimés au-delà de cet âge (secondes).
+PLOT_MAX_AGE = float(os.environ.get("GMM_PLOT_MAX_AGE", 24 * 3600))
+CLEANUP_INTERVAL = 600
+
+# Un style par type de spectre ; l'ordre du dict est l'ordre de priorité utilisé par select_plot_series.
+PLOT_STYLES = {
+    "SA": {"imt": "SA", "x_key": "sa_period", "file_prefix": "response_spectrum", "figsize": (10, 6),
+           "fill": "royalblue", "line": "darkblue", "label": "Mean SA",
+           "xlabel": "Period (s)", "ylabel": "Spectral Acceleration (g)", "title": "Response Spectrum - {gmm}"},
+    "AvgSA": {"imt": "AvgSA", "x_key": "sa_period", "file_prefix": "avg_sa_spectrum", "figsize": (10, 6),
+              "fill": "darkorange", "line": "orangered", "label": "Mean AvgSA",
+              "xlabel": "Period (s)", "ylabel": "Average Spectral Acceleration (g)", "title": "Average SA Spectrum - {gmm}"},
+    "VHR_SA": {"imt": "VHR_SA", "x_key": "sa_period", "file_prefix": "vh_ratio_spectrum", "figsize": (10, 6),
+               "fill": "mediumseagreen", "line": "darkgreen", "label": "Mean V/H Ratio",
+               "xlabel": "Period (s)", "ylabel": "V/H Ratio", "title": "V/H Ratio Spectrum - {gmm}"},
+    "DRVT": {"imt": "DRVT", "x_key": "frequency", "file_prefix": "drvt_spectrum", "figsize": (10, 6),
+             "fill": "teal", "line": "darkcyan", "label": "Mean DRVT",
+             "xlabel": "Frequency (Hz)", "ylabel": "Duration (s)", "title": "Duration Spectrum (DRVT) - {gmm}"},
+    "FAS": {"imt": "FAS", "x_key": "frequency", "file_prefix": "fas_spectrum", "figsize": (10, 6),
+            "fill": "darkgreen", "line": "darkgreen", "label": "Mean FAS",
+            "xlabel": "Frequency (Hz)", "ylabel": "Fourier Amplitude Spectrum (g.s)", "title": "Fourier Amplitude Spectrum - {gmm}"},
+    "EAS": {"imt": "EAS", "x_key": "frequency", "file_prefix": "eas_spectrum", "figsize": (10, 6),
+            "fill": "purple", "line": "purple", "label": "Mean EAS",
+            "xlabel": "Frequency (Hz)", "ylabel": "Effective Amplitude Spectrum (cm/s)", "title": "Effective Amplitude Spectrum - {gmm}"},
+    "SDi": {"imt": "SDi", "x_key": "sdi_period", "file_prefix": "sdi_spectrum", "figsize": (12, 8),
+            "colors": ["darkblue", "darkgreen", "darkred", "orange", "purple"], "label": "Mean SDi (R={ratio})",
+            "xlabel": "Period (s)", "ylabel": "Inelastic Spectral Displacement (cm)", "title": "Inelastic Displacement Spectra - {gmm}"},
+}
+MIN_POINTS = 3
+
+_templates = {}
+# Matplotlib n'est pas thread-safe (le parseur mathtext des graduations est partagé, par exemple) : un seul
+# tracé à la fois par processus, ce qui protège aussi les figures modèles.
+_render_lock = threading.Lock()
+_last_cleanup = [0.0]
+
+def select_plot_series(results):
+    """Choisit le spectre à tracer (premier type avec au moins 3 points) ; renvoie (kind, résultats) ou (None, [])."""
+    for kind, style in PLOT_STYLES.items():
+        series = [r for r in results if r["imt"] == style["imt"]]
+        if len(series) >= MIN_POINTS:
+            return kind, series
+    return None, []
+
+def _get_template(kind):
+    """Figure pré-stylée (échelles, grille, libellés) du type `kind`, créée au premier usage ; appelée sous _render_lock."""
+    if kind not in _templates:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        style = PLOT_STYLES[kind]
+        fig = Figure(figsize=style["figsize"])
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        ax.set_xscale('log'); ax.set_yscale('log')
+        ax.grid(True, which="both", ls="--", linewidth=0.5)
+        ax.set_xlabel(style["xlabel"]); ax.set_ylabel(style["ylabel"])
+        _templates[kind] = (fig, ax)
+    return _templates[kind]
+
+def _clear_data(ax):
+    for artist in list(ax.lines) + list(ax.collections):
+        artist.remove()
+    legend = ax.get_legend()
+    if legend is not None: legend.remove()
+    ax.ignore_existing_data_limits = True
+
+def _draw_band(ax, x, mean_values, stddev_ln, fill, line, label, alpha, band_label):
+    ax.fill_between(x, mean_values * np.exp(-stddev_ln), mean_values * np.exp(stddev_ln), color=fill, alpha=alpha, label=band_label)
+    ax.plot(x, mean_values, '-o', color=line, label=label, linewidth=2, markersize=4)
+
+def render_spectrum(kind, results, gmm_name, fmt="png", dpi=None):
+    """Trace le spectre `kind` et renvoie l'image (bytes) au format png ou svg."""
+    style = PLOT_STYLES[kind]
+    with _render_lock:
+        fig, ax = _get_template(kind)
+        _clear_data(ax)
+        x_key = style["x_key"]
+        if kind == "SDi":
+            by_ratio = {}
+            for r in results: by_ratio.setdefault(r["strength_ratio"], []).append(r)
+            for i, ratio in enumerate(sorted(by_ratio)):
+                data = sorted(by_ratio[ratio], key=lambda r: r[x_key])
+                color = style["colors"][i % len(style["colors"])]
+                _draw_band(ax, [r[x_key] for r in data], np.array([r["mean_value"] for r in data]),
+                           np.array([r["stddev_total_ln"] for r in data]), color, color, style["label"].format(ratio=ratio), 0.1, None)
+            ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+        else:
+            data = sorted(results, key=lambda r: r[x_key])
+            _draw_band(ax, [r[x_key] for r in data], np.array([r["mean_value"] for r in data]),
+                       np.array([r["stddev_total_ln"] for r in data]), style["fill"], style["line"], style["label"], 0.2, 'Mean ± 1σ range')
+            ax.legend()
+        ax.autoscale_view()
+        ax.set_title(style["title"].format(gmm=gmm_name), fontweight='bold')
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, dpi=dpi or DEFAULT_DPI)
+        return buffer.getvalue()
+
+# Nombre maximal de points tracés pour une liste de sites ; au-delà, un sous-échantillon régulier est affiché.
+MAX_MAP_POINTS = 200_000
+
+def render_map(lons, lats, values, title, unit, grid_shape=None, outline=None, fmt="png", dpi=None, log_scale=True):
+    """Carte d'une valeur par site : image si les sites forment une grille (grid_shape = (ny, nx)), nuage de points sinon.
+
+    outline : (lons, lats) du contour de la rupture, tracé par-dessus. Renvoie l'image (bytes).
+    """
+    with _render_lock:
+        from matplotlib.figure import Figure
+        from matplotlib.colors import LogNorm
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(figsize=(9, 7.5))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        values = np.asarray(values, dtype=float)
+        finite = values[np.isfinite(values) & (values > 0 if log_scale else True)]
+        norm = LogNorm(vmin=finite.min(), vmax=finite.max()) if log_scale and finite.size else None
+        if grid_shape is not None:
+            extent = (float(lons.min()), float(lons.max()), float(lats.min()), float(lats.max()))
+            image = ax.imshow(values.reshape(grid_shape), origin='lower', extent=extent, norm=norm, cmap='viridis',
+                              aspect='auto', interpolation='nearest')
+        else:
+            step = max(1, len(values) // MAX_MAP_POINTS)
+            image = ax.scatter(lons[::step], lats[::step], c=values[::step], s=8, norm=norm, cmap='viridis', linewidths=0)
+        if outline is not None:
+            ax.plot(outline[0], outline[1], '-', color='red', linewidth=1.5)
+            ax.plot(outline[0][:2], outline[1][:2], '-', color='red', linewidth=3, label='Rupture (top edge)')
+            ax.legend(loc='upper right')
+        fig.colorbar(image, ax=ax, label=unit)
+        ax.set_xlabel("Longitude (°)"); ax.set_ylabel("Latitude (°)")
+        ax.set_title(title, fontweight='bold')
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, dpi=dpi or DEFAULT_DPI)
+        return buffer.getvalue()
+
+def cleanup_old_plots(output_dir=None, max_age=PLOT_MAX_AGE):
+    """Supprime les graphiques générés par ce module il y a plus de max_age secondes ; renvoie leur nombre."""
+    prefixes = tuple(f"{style['file_prefix']}_" for style in PLOT_STYLES.values())
+    now, removed = time.time(), 0
+    for entry in os.scandir(output_dir or PLOT_DIR):
+        try:
+            if entry.name.startswith(prefixes) and entry.is_file() and now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+def write_plot(data, kind, fmt="png", output_dir=None):
+    """Écrit l'image sous un nom unique (pas d'écrasement entre requêtes concurrentes) et renvoie son chemin."""
+    if time.time() - _last_cleanup[0] > CLEANUP_INTERVAL:
+        _last_cleanup[0] = time.time()
+        cleanup_old_plots(output_dir)
+    fd, path = tempfile.mkstemp(prefix=f"{PLOT_STYLES[kind]['file_prefix']}_", suffix=f".{fmt}", dir=output_dir or PLOT_DIR)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(path, 0o644)  # mkstemp crée le fichier en 0600 ; les autres services doivent pouvoir le lire
+    return path
+
+def plot_options(fmt=None, preview=False):
+    """Format et résolution : le mode aperçu (Telegram) réduit la résolution."""
+    fmt = (fmt or "png").lower()
+    if fmt not in ("png", "svg"):
+        raise ValueError(f"Unsupported plot format '{fmt}', expected png or svg")
+    return fmt, PREVIEW_DPI if preview else DEFAULT_DPI
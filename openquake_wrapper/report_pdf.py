@@ -0,0 +1,286 @@
+# Fichier : report_pdf.py
+# Rapport PDF d'un calcul (description du modèle, résultats, graphique, interprétation, définitions) produit
+# en processus avec WeasyPrint, au lieu d'écrire un fichier HTML puis de lancer la commande `weasyprint`.
+#
+# Usage : python3 report_pdf.py --response-file result.json [--interpretation-file ...] [--definitions-file ...] --output report.pdf
+#         python3 report_pdf.py --module ... --class_name ... --keys ... --values ... --output report.pdf
+#         python3 report_pdf.py --batch reports.json --output-dir reports/ [--merge]
+# Le gabarit HTML, la feuille de style compilée, la configuration des polices et le logo sont chargés une seule fois
+# par processus ; le graphique est intégré depuis la mémoire (URI data: base64), sans passer par /tmp.
+
+import os
+import sys
+import json
+import html
+import time
+import base64
+import argparse
+import datetime
+import functools
+import importlib
+import threading
+from string import Template
+
+import plot_rendering
+
+AUTHOR_NAME = os.environ.get("GMM_REPORT_AUTHOR", "Pr. Boumédiène DERRAS")
+PROJECT_TITLE = os.environ.get("GMM_REPORT_TITLE", "Advanced Seismic Analysis Project")
+LOGO_PATH = os.environ.get("GMM_REPORT_LOGO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logo.png"))
+AI_CREDIT = "This {section} was generated by a Gemini 2.0 Flash AI agent and should be reviewed by a qualified expert."
+# Types spectraux résumés dans le texte des résultats, dans l'ordre du workflow (seul le premier présent est résumé).
+SPECTRAL_TYPES = ("SA", "SDi", "EAS", "FAS", "DRVT", "AvgSA", "VHR_SA")
+MIME_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+REPORT_CSS = """
+body { font-family: Helvetica, Arial, sans-serif; font-size: 11pt; line-height: 1.5; max-width: 800px; margin: auto; color: #333; }
+.header { display: flex; justify-content: space-between; align-items: flex-start; border-bottom: 2px solid #004a99; padding-bottom: 20px; margin-bottom: 40px; }
+.header-left { max-width: 75%; }
+.header h1 { margin: 0; font-size: 24pt; color: #004a99; }
+.header .subtitle { margin: 5px 0 0 0; font-size: 14pt; color: #555; font-weight: normal; }
+.header .author-info { margin-top: 20px; font-size: 10pt; color: #666; }
+.header-right { text-align: right; }
+.logo { max-height: 80px; }
+h2 { font-size: 16pt; color: #444; margin-top: 30px; border-bottom: 1px solid #ccc; padding-bottom: 5px; page-break-after: avoid; }
+p.description, div.description, div.description_definitions { text-align: justify; color: #555; }
+pre { white-space: pre-wrap; word-wrap: break-word; font-family: 'Courier New', monospace; font-size: 9pt; background-color: #f4f4f4; padding: 15px; border: 1px solid #ddd; border-radius: 5px; }
+img.plot { max-width: 100%; height: auto; margin-top: 20px; }
+.appendix { page-break-before: always; }
+.ai-credit { text-align: right; font-size: 8pt; font-style: italic; color: #999; margin-top: 15px; }
+@page { size: A4; margin: 2.5cm; @bottom-center { content: "Page " counter(page) " of " counter(pages); font-family: Helvetica, Arial, sans-serif; font-size: 9pt; color: #888; } }
+"""
+
+REPORT_TEMPLATE = Template("""<html>
+  <head><meta charset="utf-8"><title>Seismic Analysis Report</title></head>
+  <body>
+    <header class="header">
+      <div class="header-left">
+        <h1>Seismic Analysis Report</h1>
+        <p class="subtitle">$project_title</p>
+        <p class="author-info">Prepared by: $author<br/>Date: $date</p>
+      </div>
+      <div class="header-right">$logo</div>
+    </header>
+    <h2>Model Description</h2>
+    $description
+    <h2>Textual Calculation Results</h2>
+    <pre>$report_text</pre>
+    $plot
+    $interpretation
+    $definitions
+  </body>
+</html>
+""")
+
+# WeasyPrint (et ses bibliothèques Pango) n'est importé qu'au premier rendu ; le rendu est sérialisé entre les
+# threads du serveur, la configuration des polices étant partagée.
+_render_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _font_config():
+    from weasyprint.text.fonts import FontConfiguration
+    return FontConfiguration()
+
+@functools.lru_cache(maxsize=1)
+def _stylesheet():
+    from weasyprint import CSS
+    return CSS(string=REPORT_CSS, font_config=_font_config())
+
+@functools.lru_cache(maxsize=4)
+def _logo_html(path):
+    """Balise du logo en URI data: (lue une fois) ; vide si le fichier est absent."""
+    try:
+        with open(path, "rb") as f: data = f.read()
+    except OSError:
+        return ""
+    mime = MIME_TYPES.get(os.path.splitext(path)[1].lstrip(".").lower(), "image/png")
+    return f'<img src="data:{mime};base64,{base64.b64encode(data).decode("ascii")}" alt="Logo" class="logo" />'
+
+def describe_model(module_name, class_name):
+    """Documentation de la classe GMM (équivalent de la colonne info.documentation de la feuille)."""
+    try:
+        gmm_class = getattr(importlib.import_module(f"openquake.hazardlib.gsim.{module_name}"), class_name)
+    except Exception:
+        return None
+    return (gmm_class.__doc__ or "").strip() or None
+
+def format_results_text(response, parameters=None):
+    """Résumé textuel des résultats, identique à celui du nœud Code1 du workflow n8n."""
+    lines = [f"🏗️ GMM_class Calculation: {response.get('gmm') or 'N/A'}", "", "📊 Abstract:",
+             f"• Module: {response.get('module') or 'N/A'}"]
+    if parameters:
+        lines.append("• Physical Parameters:")
+        lines += [f"  - {key} = {value}" for key, value in parameters.items()]
+    lines.append(f"• Numbers of IMs supported by model: {response.get('successful_imts_count', 0)}/{response.get('total_imts_tested', 0)}")
+    results = [r for r in response.get("imt_results") or [] if r.get("success", True)]
+    scalars = [r for r in results if r["imt"] not in SPECTRAL_TYPES]
+    if scalars:
+        lines += ["", "📈 Base IMTs (successful):"]
+        lines += [f"• {r['display_name']}: {float(r['mean_value']):.4f}{r.get('unit') or ''} (σ={float(r['stddev_total_ln']):.4f})" for r in scalars]
+    for kind in SPECTRAL_TYPES:
+        series = [r for r in results if r["imt"] == kind]
+        if not series: continue
+        x_key = plot_rendering.PLOT_STYLES[kind]["x_key"]
+        series.sort(key=lambda r: r.get(x_key) or 0)
+        if len(series) > 9:
+            # 3 premières, 3 du milieu et 3 dernières valeurs, sans doublon.
+            middle = len(series) // 2 - 1
+            series = list({r["display_name"]: r for r in series[:3] + series[middle:middle + 3] + series[-3:]}.values())
+        lines += ["", f"🌊 {kind} Spectrum Summary (Sampled Values):"]
+        lines += [f"• {r['display_name']}: {float(r['mean_value']):.5f}{r.get('unit') or ''} (σ={float(r['stddev_total_ln']):.4f})" for r in series]
+        break
+    lines.append("")
+    if response.get("failed_imts_count"):
+        lines.append(f"⚠️ {response['failed_imts_count']} IMTs not supported.")
+    return "\n".join(lines) + "\n"
+
+def _paragraphs(text, css_class="description"):
+    """Un <p> par bloc séparé d'une ligne vide, les retours simples devenant des espaces (comme le nœud Code5)."""
+    blocks = [b.strip() for b in text.replace("\r\n", "\n").split("\n\n") if b.strip()]
+    return "".join(f'<p class="{css_class}">{html.escape(" ".join(b.splitlines()))}</p>' for b in blocks)
+
+def render_report_html(response, plot_bytes=None, plot_format="png", report_text=None, interpretation=None,
+                       definitions=None, description=None, parameters=None):
+    """HTML complet du rapport ; le graphique (octets en mémoire) est intégré en URI data:.
+
+    Sans report_text, le résumé est construit à partir de imt_results (format_results_text) ; sans description,
+    la documentation de la classe GMM est utilisée.
+    """
+    if description is None:
+        description = describe_model(response.get("module"), response.get("gmm")) or "No model description provided."
+    if plot_bytes:
+        uri = f"data:{MIME_TYPES.get(plot_format, 'image/png')};base64,{base64.b64encode(plot_bytes).decode('ascii')}"
+        plot = f'<h2>Response Spectrum Plot</h2>\n    <img src="{uri}" alt="Response Spectrum Plot" class="plot" />'
+    else:
+        plot = "<h2>Response Spectrum Plot</h2>\n    <p><em>(No plot was generated for this calculation.)</em></p>" if plot_bytes is not None else ""
+    if interpretation:
+        interpretation = (f'<h2>AI-Powered Interpretation</h2>\n    <div class="description">{html.escape(interpretation).replace(chr(10), "<br>")}</div>\n'
+                          f'    <p class="ai-credit">{AI_CREDIT.format(section="interpretation")}</p>')
+    if definitions:
+        definitions = (f'<div class="appendix">\n      <h2>Appendix: Term Definitions</h2>\n'
+                       f'      <div class="description_definitions">{html.escape(definitions).replace(chr(10), "<br>")}</div>\n'
+                       f'      <p class="ai-credit">{AI_CREDIT.format(section="definitions section")}</p>\n    </div>')
+    return REPORT_TEMPLATE.substitute(
+        project_title=html.escape(PROJECT_TITLE), author=html.escape(AUTHOR_NAME),
+        date=f"{datetime.date.today().day} {datetime.date.today():%B %Y}", logo=_logo_html(LOGO_PATH),
+        description=_paragraphs(description), report_text=html.escape(report_text or format_results_text(response, parameters)),
+        plot=plot, interpretation=interpretation or "", definitions=definitions or "")
+
+def render_documents(html_pages):
+    """Mise en page WeasyPrint de plusieurs rapports HTML avec la feuille de style et les polices en cache."""
+    try:
+        from weasyprint import HTML
+    except (ImportError, OSError) as e:
+        raise RuntimeError(f"PDF rendering requires WeasyPrint and the Pango libraries: {e}") from e
+    with _render_lock:
+        return [HTML(string=page).render(stylesheets=[_stylesheet()], font_config=_font_config()) for page in html_pages]
+
+def write_pdfs(html_pages, merge=False):
+    """PDF (octets) de chaque rapport, ou un seul PDF regroupant toutes les pages avec merge=True."""
+    documents = render_documents(html_pages)
+    with _render_lock:
+        if merge and documents:
+            return [documents[0].copy([page for document in documents for page in document.pages]).write_pdf()]
+        return [document.write_pdf() for document in documents]
+
+# Champs de imt_results lus par le résumé textuel et le graphique.
+RESULT_FIELDS = ("imt", "display_name", "mean_value", "stddev_total_ln")
+
+def check_response(response):
+    """Vérifie une réponse de calcul fournie par le client ; ValueError (400 sur le serveur) si elle est inutilisable."""
+    results = response.get("imt_results") if isinstance(response, dict) else None
+    if not isinstance(results, list) or not all(isinstance(r, dict) and all(f in r for f in RESULT_FIELDS) for r in results):
+        raise ValueError(f"response must be a calculation result whose imt_results entries have {', '.join(RESULT_FIELDS)}")
+    return response
+
+def prepare_report(item):
+    """Calcule (si nécessaire) le scénario d'une demande de rapport et renvoie le HTML et la réponse du calcul.
+
+    item contient soit "response" (sortie JSON d'un calcul déjà fait), soit les champs d'un calcul
+    (module, class_name, keys, values...), plus les textes optionnels report_text, interpretation,
+    definitions et description.
+    """
+    import run_gmm_calculation_v8 as wrapper
+    plot_format = item.get("plot_format") or "png"
+    parameters = None
+    if item.get("response") is not None:
+        response = check_response(item["response"])
+        plot_bytes = None
+        if item.get("plot", True):
+            try:
+                plot_fmt, plot_dpi = plot_rendering.plot_options(plot_format, bool(item.get("preview", False)))
+            except ValueError as e:
+                raise wrapper.GMMCalculationError(f"Plot Option Error: {e}") from e
+            _, plot_bytes = wrapper.render_response_plot(response.get("imt_results") or [], response.get("gmm"), plot_fmt, plot_dpi, write=False)
+            plot_bytes = plot_bytes or b""
+    else:
+        from argparse import Namespace
+        for field in ("module", "class_name", "keys", "values"):
+            if not item.get(field): raise ValueError(f"Missing field: {field}")
+        keys = item["keys"] if isinstance(item["keys"], str) else ",".join(item["keys"])
+        values = item["values"] if isinstance(item["values"], str) else ",".join(str(v) for v in item["values"])
+        args = Namespace(module=item["module"], class_name=item["class_name"], keys=keys, values=values,
+                         plot_format=plot_format, preview=bool(item.get("preview", False)))
+        response, plot_bytes = wrapper.calculate_gmm_with_plot(args, make_plot=item.get("plot", True), write_plot=False)
+        plot_bytes = (plot_bytes or b"") if item.get("plot", True) else None
+        parameters = dict(zip(keys.split(','), values.split(',')))
+    page = render_report_html(response, plot_bytes, plot_format, item.get("report_text"), item.get("interpretation"),
+                              item.get("definitions"), item.get("description"), parameters)
+    return page, response
+
+def generate_reports(items, merge=False):
+    """Rapports PDF d'une liste de demandes en un seul appel ; renvoie (liste de PDF en octets, réponses, durées)."""
+    started = time.perf_counter()
+    prepared = [prepare_report(item) for item in items]
+    html_time = time.perf_counter() - started
+    pdfs = write_pdfs([page for page, _ in prepared], merge)
+    return pdfs, [response for _, response in prepared], {"html_s": round(html_time, 4), "pdf_s": round(time.perf_counter() - started - html_time, 4)}
+
+def _read_text(path):
+    if not path: return None
+    with open(path, encoding="utf-8") as f: return f.read()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rapport PDF d'un calcul GMM (WeasyPrint en processus)")
+    parser.add_argument('--response-file', help="Sortie JSON de run_gmm_calculation_v8.py (sinon le calcul est fait ici)")
+    parser.add_argument('--module', help="Module GMM")
+    parser.add_argument('--class_name', help="Nom de la classe GMM")
+    parser.add_argument('--keys', default="", help="Clés des paramètres séparées par virgules")
+    parser.add_argument('--values', default="", help="Valeurs des paramètres séparées par virgules")
+    parser.add_argument('--report-text-file', help="Texte des résultats (par défaut : résumé construit depuis imt_results)")
+    parser.add_argument('--interpretation-file', help="Interprétation (texte) à ajouter au rapport")
+    parser.add_argument('--definitions-file', help="Définitions des termes (annexe)")
+    parser.add_argument('--description', help="Description du modèle (par défaut : documentation de la classe)")
+    parser.add_argument('--plot-format', default="png", choices=["png", "svg"], help="Format du graphique intégré")
+    parser.add_argument('--no-plot', action='store_true', help="Rapport sans graphique")
+    parser.add_argument('--output', default="final_report.pdf", help="Fichier PDF (ou PDF regroupé avec --batch --merge)")
+    parser.add_argument('--batch', help="Fichier JSON : liste de demandes de rapport (champs de /report)")
+    parser.add_argument('--output-dir', default=".", help="Mode batch : répertoire des PDF (report_<n>_<classe>.pdf)")
+    parser.add_argument('--merge', action='store_true', help="Mode batch : un seul PDF regroupant tous les rapports (--output)")
+    args = parser.parse_args()
+
+    if args.batch:
+        with open(args.batch) as f: items = json.load(f)
+    else:
+        item = {"report_text": _read_text(args.report_text_file), "interpretation": _read_text(args.interpretation_file),
+                "definitions": _read_text(args.definitions_file), "description": args.description,
+                "plot_format": args.plot_format, "plot": not args.no_plot}
+        if args.response_file:
+            with open(args.response_file) as f: item["response"] = json.load(f)
+        elif args.module and args.class_name:
+            item.update(module=args.module, class_name=args.class_name, keys=args.keys, values=args.values)
+        else:
+            parser.error("--response-file, --module/--class_name or --batch is required")
+        items = [item]
+    try:
+        pdfs, responses, timings = generate_reports(items, args.merge)
+    except Exception as e:
+        print(json.dumps({"success": False, "error": f"{type(e).__name__}: {e}"}), file=sys.stderr)
+        sys.exit(1)
+    if args.batch and not args.merge:
+        os.makedirs(args.output_dir, exist_ok=True)
+        paths = [os.path.join(args.output_dir, f"report_{i + 1}_{r.get('gmm') or 'gmm'}.pdf") for i, r in enumerate(responses)]
+    else:
+        paths = [args.output]
+    for path, pdf in zip(paths, pdfs):
+        with open(path, "wb") as f: f.write(pdf)
+    print(json.dumps({"success": True, "reports": paths, "count": len(items), "timings": timings}, indent=2))
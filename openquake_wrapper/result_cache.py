@@ -0,0 +1,102 @@
+# Fichier : result_cache.py
+# Cache disque des réponses du wrapper (JSON + graphique), partagé entre processus et persistant aux redémarrages.
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import contextlib
+
+class ResultCache:
+    """Cache adressé par contenu, stocké dans SQLite, borné en taille (éviction LRU) et avec durée de vie (TTL).
+
+    Chaque opération ouvre sa propre connexion : l'objet peut être partagé entre threads et la base
+    entre plusieurs processus (docker exec concurrents, serveur).
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, ttl_seconds=7 * 24 * 3600):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "gmm_results.sqlite")
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, response TEXT NOT NULL, plot BLOB, "
+                       "size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _count(db, name, n=1):
+        db.execute("INSERT INTO counters (name, value) VALUES (?, ?) "
+                   "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, n))
+
+    @staticmethod
+    def make_key(payload):
+        """Clé SHA-256 d'un objet JSON-sérialisable (clés triées, pour que deux entrées équivalentes coïncident)."""
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Renvoie (response, plot_bytes) ou None ; met à jour les compteurs et la date d'accès."""
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute("SELECT response, plot, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds and row[2] + self.ttl_seconds < now:
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._count(db, "expired")
+                row = None
+            if row is None:
+                self._count(db, "misses")
+                return None
+            db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._count(db, "hits")
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, response, plot_bytes=None):
+        data = json.dumps(response, separators=(",", ":"))
+        size = len(data) + (len(plot_bytes) if plot_bytes else 0)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO entries (key, response, plot, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                       (key, data, plot_bytes, size, now, now))
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY accessed ASC").fetchall():
+            if total <= self.max_bytes: break
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._count(db, "evictions", evicted)
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM entries")
+            db.execute("DELETE FROM counters")
+
+    def stats(self):
+        with self._connect() as db:
+            entries, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            counters = dict(db.execute("SELECT name, value FROM counters").fetchall())
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "entries": entries, "size_bytes": total, "max_bytes": self.max_bytes, "ttl_seconds": self.ttl_seconds,
+            "hits": hits, "misses": misses, "evictions": counters.get("evictions", 0), "expired": counters.get("expired", 0),
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+        }
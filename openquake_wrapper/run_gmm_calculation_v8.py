@@ -7,19 +7,108 @@ import json
 import argparse
 import importlib
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import inspect
+import functools
+import time
 
 sys.path.insert(0, "/app/oq-engine-source")
 
-from openquake.hazardlib import const, imt
-from openquake.hazardlib.contexts import SitesContext, RuptureContext, DistancesContext
-from openquake.hazardlib.gsim.base import GMPE, CoeffsTable
+# Les modules openquake.hazardlib, inspect et Matplotlib (dans plot_rendering) sont importés dans les
+# fonctions qui s'en servent : une erreur d'arguments, --cache-stats ou une requête sans graphique
+# ne paient pas leur chargement. Voir --profile-startup pour le détail du temps d'import.
+
+from result_cache import ResultCache
+import plot_rendering
+
+class GMMCalculationError(Exception):
+    """Erreur de calcul, dont le message est renvoyé tel quel dans le JSON d'erreur."""
+
+# Index des IMTs confirmés par classe, construit hors ligne par build_imt_index.py.
+IMT_INDEX_FORMAT = 2
+IMT_INDEX_PATH = os.environ.get("GMM_IMT_INDEX", os.path.join(os.path.dirname(os.path.abspath(__file__)), "imt_capability_index.json"))
+_IMT_INDEXES = {}
+
+def get_openquake_version():
+    try:
+        from openquake.baselib import __version__
+        return __version__
+    except ImportError:
+        return None
+
+def load_imt_index(path=None):
+    """Charge l'index des capacités IMT, ou None s'il est absent, illisible ou construit pour une autre version d'OpenQuake."""
+    path = path or IMT_INDEX_PATH
+    if path not in _IMT_INDEXES:
+        index = None
+        try:
+            with open(path) as f: index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+        if index is not None and (index.get("format") != IMT_INDEX_FORMAT or index.get("openquake_version") != get_openquake_version()):
+            print(f"IMT index {path} was built for OpenQuake {index.get('openquake_version')}, ignoring it.", file=sys.stderr)
+            index = None
+        _IMT_INDEXES[path] = index
+    return _IMT_INDEXES[path]
+
+def gmm_index_key(gmm_class):
+    return f"{gmm_class.__module__}.{gmm_class.__name__}"
+
+def get_index_entry(gmm_class, path=None):
+    index = load_imt_index(path)
+    entry = index["classes"].get(gmm_index_key(gmm_class)) if index else None
+    return entry if entry and entry.get("imts") else None
+
+def get_indexed_imts(gmm_class, path=None, confirmed_only=False):
+    """IMTs à évaluer pour cette classe d'après l'index, ou None si la classe n'y figure pas.
+
+    Seuls manquent les IMTs impossibles quels que soient les paramètres (voir count_index_skipped) ; ceux qui
+    ont échoué sur le scénario représentatif de l'index restent évalués, sauf avec confirmed_only.
+    """
+    entry = get_index_entry(gmm_class, path)
+    if entry is None: return None
+    unconfirmed = set(entry.get("unconfirmed", ())) if confirmed_only else set()
+    return [(imt_name, imt_params) for i, (imt_name, imt_params) in enumerate(entry["imts"]) if i not in unconfirmed]
+
+def count_index_skipped(gmm_class, path=None):
+    """Nombre d'IMTs détectés par introspection que l'index écarte (construction impossible ou coefficients absents)."""
+    entry = get_index_entry(gmm_class, path)
+    return len(entry.get("skipped", ())) if entry else 0
+
+def select_imts(gmm_class):
+    """IMTs à évaluer : (liste, imt_source, nombre d'IMTs écartés par l'index)."""
+    indexed = get_indexed_imts(gmm_class)
+    if indexed: return indexed, "index", count_index_skipped(gmm_class)
+    return get_supported_imts(gmm_class), "introspection", 0
+
+# Cache des réponses, activé par GMM_CACHE_DIR (ou --cache-dir). Incrémenter RESULT_CACHE_FORMAT si la réponse change de forme.
+RESULT_CACHE_FORMAT = 2
+_RESULT_CACHES = {}
+
+def get_result_cache(directory=None):
+    directory = directory or os.environ.get("GMM_CACHE_DIR")
+    if not directory: return None
+    if directory not in _RESULT_CACHES:
+        _RESULT_CACHES[directory] = ResultCache(
+            directory, max_bytes=int(float(os.environ.get("GMM_CACHE_MAX_MB", 256)) * 1024 * 1024),
+            ttl_seconds=float(os.environ.get("GMM_CACHE_TTL", 7 * 24 * 3600)))
+    return _RESULT_CACHES[directory]
+
+def _normalize_cache_value(value):
+    if isinstance(value, (bool, np.bool_)): return bool(value)
+    if isinstance(value, (int, float, np.integer, np.floating)): return float(f"{float(value):.10g}")
+    return str(value).strip()
+
+def result_cache_key(module_name, gmm_class, constructor_args, user_params, plot_key):
+    """Clé du cache : classe, arguments du constructeur et paramètres requis après normalisation, version d'OpenQuake."""
+    required = set().union(*get_required_parameters(gmm_class))
+    return ResultCache.make_key({
+        "format": RESULT_CACHE_FORMAT, "openquake_version": get_openquake_version(),
+        "module": module_name, "gmm": gmm_index_key(gmm_class), "constructor_args": constructor_args,
+        "params": {p: _normalize_cache_value(user_params[p]) for p in sorted(required)}, "plot": plot_key,
+    })
 
 def get_fas_frequencies(gmm_class):
     """Lit dynamiquement les fréquences supportées par un GMM (pour FAS, EAS, DRVT)."""
+    from openquake.hazardlib.gsim.base import CoeffsTable
     frequencies = []
     try:
         for attr_name in dir(gmm_class):
@@ -29,16 +118,22 @@ def get_fas_frequencies(gmm_class):
                     for key in attr._coeffs.keys():
                         if hasattr(key, 'frequency'):
                             frequencies.append(float(key.frequency))
-            except:
+            except Exception:
                 continue
         if not frequencies:
             frequencies = [0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 25.0, 50.0, 100.0]
-    except:
+    except Exception:
         frequencies = [0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 25.0, 50.0, 100.0]
     return sorted(list(set(frequencies)))
 
 def get_supported_imts(gmm_class):
     """Méthode intelligente pour détecter automatiquement les IMTs supportés par un modèle GMM."""
+    # L'introspection ne dépend que de la classe : on la fait une seule fois par processus.
+    return list(_detect_supported_imts(gmm_class))
+
+@functools.lru_cache(maxsize=None)
+def _detect_supported_imts(gmm_class):
+    from openquake.hazardlib import imt
     supported_imts = []
     if hasattr(gmm_class, 'DEFINED_FOR_INTENSITY_MEASURE_TYPES'):
         defined_imts = gmm_class.DEFINED_FOR_INTENSITY_MEASURE_TYPES
@@ -71,7 +166,7 @@ def get_supported_imts(gmm_class):
             if hasattr(imt, imt_name): supported_imts.append((imt_name, None))
         sa_periods = get_sa_periods(gmm_class)
         for period in sa_periods: supported_imts.append(("SA", period))
-    return supported_imts
+    return tuple(supported_imts)
 
 def get_sdi_parameters(gmm_class):
     periods, strength_ratios = [], []
@@ -83,7 +178,7 @@ def get_sdi_parameters(gmm_class):
                     try:
                         ratio = float(key.split('R=')[1].split(',')[0].strip())
                         if ratio not in strength_ratios: strength_ratios.append(ratio)
-                    except: continue
+                    except Exception: continue
             if strength_ratios:
                 first_key = list(coeffs.keys())[0]
                 coeff_table = coeffs[first_key]
@@ -91,13 +186,14 @@ def get_sdi_parameters(gmm_class):
                     if hasattr(imt_key, 'period') and float(imt_key.period) not in periods: periods.append(float(imt_key.period))
         if not periods: periods = [0.04, 0.06, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0, 5.0]
         if not strength_ratios: strength_ratios = [1.5, 2.0, 3.0, 4.0, 6.0]
-    except:
+    except Exception:
         periods = [0.04, 0.06, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0, 5.0]
         strength_ratios = [1.5, 2.0, 3.0, 4.0, 6.0]
     periods.sort(); strength_ratios.sort()
     return periods, strength_ratios
 
 def get_sa_periods(gmm_class):
+    from openquake.hazardlib.gsim.base import CoeffsTable
     periods = []
     try:
         for attr_name in dir(gmm_class):
@@ -111,285 +207,467 @@ def get_sa_periods(gmm_class):
                                 periods.append(float(key))
                             elif hasattr(key, 'period') and key.period > 0:
                                 periods.append(float(key.period))
-            except: 
+            except Exception:
                 continue
         if not periods:
             periods = [0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0, 5.0, 7.5, 10.0]
-    except:
+    except Exception:
         periods = [0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0, 5.0, 7.5, 10.0]
     return sorted(list(set(periods)))
 
 def test_imt_support(gmm, sctx, rctx, dctx, imt_obj):
+    from openquake.hazardlib import const
     try:
         mean, stddevs = gmm.get_mean_and_stddevs(sctx, rctx, dctx, imt_obj, [const.StdDev.TOTAL])
         return True, mean, stddevs
     except Exception:
         return False, None, None
 
-def create_response_spectrum_plot(sa_results, gmm_name, output_path="/tmp/response_spectrum.png"):
-    if not sa_results: return None
-    try:
-        sa_results.sort(key=lambda r: r['sa_period'])
-        periods = [r["sa_period"] for r in sa_results]
-        mean_values = np.array([r["mean_value"] for r in sa_results])
-        stddev_ln_values = np.array([r["stddev_total_ln"] for r in sa_results])
-        plt.figure(figsize=(10, 6)); plt.fill_between(periods, mean_values * np.exp(-stddev_ln_values), mean_values * np.exp(stddev_ln_values), color='royalblue', alpha=0.2, label='Mean ± 1σ range'); plt.plot(periods, mean_values, 'b-o', color='darkblue', label='Mean SA', linewidth=2, markersize=4); plt.xscale('log'); plt.yscale('log'); plt.grid(True, which="both", ls="--", linewidth=0.5); plt.xlabel('Period (s)'); plt.ylabel('Spectral Acceleration (g)'); plt.title(f'Response Spectrum - {gmm_name}', fontweight='bold'); plt.legend(); plt.tight_layout(); plt.savefig(output_path, dpi=150); plt.close()
-        return output_path
-    except Exception:
-        return None
+def supports_batched_compute(gmm):
+    """Vrai si le modèle passe par GMPE.compute, ce qui permet d'évaluer plusieurs IMTs en un seul appel."""
+    from openquake.hazardlib.gsim.base import GMPE
+    return (hasattr(gmm, 'compute') and
+            getattr(type(gmm).get_mean_and_stddevs, '__code__', None) is GMPE.get_mean_and_stddevs.__code__)
 
-def create_avg_sa_spectrum_plot(avg_sa_results, gmm_name, output_path="/tmp/avg_sa_spectrum.png"):
-    if not avg_sa_results: return None
-    try:
-        avg_sa_results.sort(key=lambda r: r['sa_period'])
-        periods = [r["sa_period"] for r in avg_sa_results]
-        mean_values = np.array([r["mean_value"] for r in avg_sa_results])
-        stddev_ln_values = np.array([r["stddev_total_ln"] for r in avg_sa_results])
-        plt.figure(figsize=(10, 6))
-        plt.fill_between(periods, mean_values * np.exp(-stddev_ln_values), mean_values * np.exp(stddev_ln_values), color='darkorange', alpha=0.2, label='Mean ± 1σ range')
-        plt.plot(periods, mean_values, '-o', color='orangered', label='Mean AvgSA', linewidth=2, markersize=4)
-        plt.xscale('log'); plt.yscale('log'); plt.grid(True, which="both", ls="--", linewidth=0.5)
-        plt.xlabel('Period (s)'); plt.ylabel('Average Spectral Acceleration (g)'); plt.title(f'Average SA Spectrum - {gmm_name}', fontweight='bold'); plt.legend(); plt.tight_layout()
-        plt.savefig(output_path, dpi=150); plt.close()
-        return output_path
-    except Exception as e:
-        print(f"Erreur lors de la création du graphique AvgSA: {e}", file=sys.stderr)
-        return None
+def compute_imts_batched(gmm, sctx, rctx, dctx, imt_objs):
+    """Un seul appel vectorisé à gmm.compute pour tous les IMTs ; renvoie (mean, sig) de forme (M, N).
 
-def create_vh_ratio_spectrum_plot(vhr_results, gmm_name, output_path="/tmp/vh_ratio_spectrum.png"):
-    if not vhr_results: return None
-    try:
-        vhr_results.sort(key=lambda r: r['sa_period'])
-        periods = [r["sa_period"] for r in vhr_results]
-        mean_values = np.array([r["mean_value"] for r in vhr_results])
-        stddev_ln_values = np.array([r["stddev_total_ln"] for r in vhr_results])
-    except Exception as e:
-        print(f"Error preparing V/H ratio plot data: {e}", file=sys.stderr)
+    Reproduit la préparation du contexte faite par GMPE.get_mean_and_stddevs, les résultats sont donc identiques
+    à ceux du chemin IMT par IMT. Lève une exception si un des IMTs n'est pas supporté.
+    """
+    from openquake.hazardlib.contexts import ContextMaker, full_context
+    M, N = len(imt_objs), len(sctx.sids)
+    mean, sig, tau, phi = (np.zeros((M, N)) for _ in range(4))
+    # Comme get_mean_and_stddevs, on passe toujours un recarray construit par ContextMaker.recarray (sans
+    # dépendre de l'annotation de compute, qui peut être une chaîne ou absente).
+    ctx = full_context(sctx, rctx, dctx)
+    if not isinstance(ctx, np.ndarray):
+        params = {'imtls': {imt_obj.string: [0] for imt_obj in imt_objs}}
+        if hasattr(rctx, 'mag'):
+            params['mags'] = ['%.2f' % mag for mag in np.unique(rctx.mag)]
+        ctx = ContextMaker('*', [gmm], params).recarray([ctx])
+    gmm.compute(ctx, imt_objs, mean, sig, tau, phi)
+    return mean, sig
+
+def evaluate_imts(gmm, sctx, rctx, dctx, imt_objs, probes=None):
+    """Évalue une liste d'IMTs ; renvoie pour chacun (is_supported, mean, stddevs) comme test_imt_support.
+
+    Tente d'abord l'appel vectorisé ; si un IMT de la liste échoue, on revient au chemin IMT par IMT
+    pour isoler ceux qui ne sont pas supportés.
+    Si probes (dict) est fourni, il cumule le nombre d'IMTs non supportés (count), le temps passé à les sonder
+    (time_s) et les appels vectorisés abandonnés (batch_fallbacks, leur durée est comptée dans time_s). Les IMTs
+    évalués puis rejetés par format_imt_result y sont ajoutés par calculate_gmm_with_plot.
+    """
+    if imt_objs and supports_batched_compute(gmm):
+        started = time.perf_counter()
+        try:
+            mean, sig = compute_imts_batched(gmm, sctx, rctx, dctx, imt_objs)
+            return [(True, mean[m], [sig[m]]) for m in range(len(imt_objs))]
+        except Exception:
+            if probes is not None:
+                probes["batch_fallbacks"] = probes.get("batch_fallbacks", 0) + 1
+                probes["time_s"] = probes.get("time_s", 0.0) + time.perf_counter() - started
+    if probes is None:
+        return [test_imt_support(gmm, sctx, rctx, dctx, imt_obj) for imt_obj in imt_objs]
+    evaluations = []
+    for imt_obj in imt_objs:
+        started = time.perf_counter()
+        evaluations.append(test_imt_support(gmm, sctx, rctx, dctx, imt_obj))
+        if not evaluations[-1][0]:
+            probes["count"] = probes.get("count", 0) + 1
+            probes["time_s"] = probes.get("time_s", 0.0) + time.perf_counter() - started
+    return evaluations
+
+def convert_mean_value(class_name, imt_name, mean_ln):
+    """Convertit la moyenne (log naturel) dans l'unité affichée ; accepte un scalaire ou un tableau."""
+    # ### DÉBUT DU BLOC CORRIGÉ (INDENTATION PROPRE) ###
+    if "MorikawaFujiwara2013" in class_name and imt_name in ["JMA", "PGV"]:
+        return np.log10(np.exp(mean_ln) * 980.665)
+    elif imt_name in ["MMI", "JMA"]:
+        return mean_ln
+    elif 'ConvertitoEtAl2012' in class_name or 'TusaLangerAzzaro2019' in class_name:
+        return np.exp(mean_ln) / 1000.0
+    else:
+        return np.exp(mean_ln)
+    # ### FIN DU BLOC CORRIGÉ ###
+
+UNIT_MAP = {"PGA":"g", "PGV":"cm/s", "PGD":"cm", "IA":"m/s", "CAV":"g⋅s", "SA":"g", "AvgSA": "g", "FAS":"g.s", "SDi":"cm", "EAS":"cm/s", "DRVT":"s"}
+DURATION_IMTS = {"RSD575", "RSD595", "RSD2080", "D5_75", "D5_95"}
+
+def get_unit(imt_name):
+    return UNIT_MAP.get(imt_name, "s" if imt_name in DURATION_IMTS or imt_name == "DRVT" else "")
+
+def describe_imt(imt_name, imt_params, display_name, is_vh_ratio_model):
+    """Nom, nom d'affichage, unité et champs de période/fréquence d'un IMT tels qu'ils apparaissent dans la réponse."""
+    if is_vh_ratio_model:
+        unit = ""
+        imt_name_orig = imt_name
+        imt_name = f"VHR_{imt_name_orig}"
+        display_name = f"VHR({imt_params}s)" if imt_name_orig in ["SA", "AvgSA"] else f"VHR_{display_name}"
+    else:
+        unit = get_unit(imt_name)
+    extra = {}
+    if imt_name in ["SA", "VHR_SA", "AvgSA"]: extra["sa_period"] = imt_params
+    elif imt_name in ["FAS", "EAS", "DRVT"]: extra["frequency"] = imt_params
+    elif imt_name == "SDi": extra.update({"sdi_period": imt_params["period"], "strength_ratio": imt_params["strength_ratio"]})
+    return imt_name, display_name, unit, extra
+
+def imt_display_values(class_name, imt_name, mean_ln, stddev_ln, is_vh_ratio_model):
+    """Post-traitement commun d'un IMT (scalaire ou tableau de sites/scénarios) : renvoie (mean_value, valid).
+
+    mean_value est la moyenne dans l'unité affichée (exp pour un rapport V/H) ; valid est faux là où l'écart-type
+    est manquant ou aberrant (>= 9000, NaN), valeurs que la réponse écarte.
+    """
+    mean_ln, stddev_ln = np.asarray(mean_ln, dtype=float), np.asarray(stddev_ln, dtype=float)
+    mean_value = np.exp(mean_ln) if is_vh_ratio_model else convert_mean_value(class_name, imt_name, mean_ln)
+    return mean_value, stddev_ln < 9000
+
+def format_imt_result(class_name, imt_name, imt_params, display_name, is_supported, mean, stddevs, is_vh_ratio_model):
+    """Met en forme le résultat d'un IMT pour la réponse JSON, ou None si l'IMT n'est pas supporté."""
+    stddev_val = float(stddevs[0][0]) if stddevs and len(stddevs) > 0 and len(stddevs[0]) > 0 else 9999.0
+    if not is_supported:
         return None
+    mean_value, valid = imt_display_values(class_name, imt_name, mean[0], stddev_val, is_vh_ratio_model)
+    if not valid:
+        return None
+    mean_value = float(mean_value)
+    imt_name, display_name, unit, extra = describe_imt(imt_name, imt_params, display_name, is_vh_ratio_model)
     
-    plt.figure(figsize=(10, 6))
-    plt.fill_between(periods, mean_values * np.exp(-stddev_ln_values), mean_values * np.exp(stddev_ln_values), color='mediumseagreen', alpha=0.2, label='Mean ± 1σ range')
-    plt.plot(periods, mean_values, '-o', color='darkgreen', label='Mean V/H Ratio', linewidth=2, markersize=4)
-    plt.xscale('log'); plt.yscale('log'); plt.grid(True, which="both", ls="--", linewidth=0.5)
-    plt.xlabel('Period (s)'); plt.ylabel('V/H Ratio'); plt.title(f'V/H Ratio Spectrum - {gmm_name}', fontweight='bold')
-    plt.legend(); plt.tight_layout(); plt.savefig(output_path, dpi=150); plt.close()
-    return output_path
-
-def create_sdi_spectrum_plot(sdi_results, gmm_name, output_path="/tmp/sdi_spectrum.png"):
-    if not sdi_results: return None
-    try:
-        ratios_data = {}; colors = ['darkblue', 'darkgreen', 'darkred', 'orange', 'purple']
-        for result in sdi_results:
-            ratio = result["strength_ratio"]; 
-            if ratio not in ratios_data: ratios_data[ratio] = []
-            ratios_data[ratio].append(result)
-        plt.figure(figsize=(12, 8))
-        for i, ratio in enumerate(sorted(ratios_data.keys())):
-            data = sorted(ratios_data[ratio], key=lambda r: r['sdi_period']); periods = [r["sdi_period"] for r in data]; mean_values = np.array([r["mean_value"] for r in data]); stddev_ln = np.array([r["stddev_total_ln"] for r in data]); color = colors[i % len(colors)]; plt.fill_between(periods, mean_values * np.exp(-stddev_ln), mean_values * np.exp(stddev_ln), color=color, alpha=0.1); plt.plot(periods, mean_values, '-o', color=color, label=f'Mean SDi (R={ratio})', linewidth=2, markersize=4)
-        plt.xscale('log'); plt.yscale('log'); plt.grid(True, which="both", ls="--", linewidth=0.5); plt.xlabel('Period (s)'); plt.ylabel('Inelastic Spectral Displacement (cm)'); plt.title(f'Inelastic Displacement Spectra - {gmm_name}', fontweight='bold'); plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left'); plt.tight_layout(); plt.savefig(output_path, dpi=150); plt.close(); return output_path
-    except Exception as e: print(f"Error creating SDi plot: {e}", file=sys.stderr); return None
-
-def create_FAS_spectrum_plot(fas_results, gmm_name, output_path="/tmp/fas_spectrum.png"):
-    if not fas_results: return None
-    try:
-        fas_results.sort(key=lambda r: r['frequency']); frequencies = [r["frequency"] for r in fas_results]; mean_values = np.array([r["mean_value"] for r in fas_results]); stddev_ln_values = np.array([r["stddev_total_ln"] for r in fas_results]); plt.figure(figsize=(10, 6)); plt.fill_between(frequencies, mean_values * np.exp(-stddev_ln_values), mean_values * np.exp(stddev_ln_values), color='darkgreen', alpha=0.2, label='Mean ± 1σ range'); plt.plot(frequencies, mean_values, '-o', color='darkgreen', label='Mean FAS', linewidth=2, markersize=4); plt.xscale('log'); plt.yscale('log'); plt.grid(True, which="both", ls="--", linewidth=0.5); plt.xlabel('Frequency (Hz)'); plt.ylabel('Fourier Amplitude Spectrum (g.s)'); plt.title(f'Fourier Amplitude Spectrum - {gmm_name}', fontweight='bold'); plt.legend(); plt.tight_layout(); plt.savefig(output_path, dpi=150); plt.close(); return output_path
-    except Exception as e: print(f"Error creating FAS plot: {e}", file=sys.stderr); return None
+    result_data = {"imt": imt_name, "display_name": display_name, "mean_ln": round(float(mean[0]), 4),
+                   "mean_value": round(mean_value, 6), "unit": unit, "stddev_total_ln": round(stddev_val, 4), "success": True}
+    result_data.update(extra)
+    return result_data
+
+def format_imt_batch_result(class_name, imt_name, imt_params, display_name, is_supported, mean, stddevs, is_vh_ratio_model):
+    """Variante de format_imt_result pour N scénarios : une seule entrée par IMT, avec des listes de N valeurs."""
+    if not (is_supported and stddevs and len(stddevs) > 0):
+        return None
+    mean, sigma = np.asarray(mean, dtype=float), np.asarray(stddevs[0], dtype=float)
+    mean_value, valid = imt_display_values(class_name, imt_name, mean, sigma, is_vh_ratio_model)
+    if not np.all(valid):
+        return None
+    imt_name, display_name, unit, extra = describe_imt(imt_name, imt_params, display_name, is_vh_ratio_model)
+    result_data = {"imt": imt_name, "display_name": display_name, "unit": unit}
+    result_data.update(extra)
+    result_data.update({"mean_ln": np.round(mean, 4).tolist(), "mean_value": np.round(mean_value, 6).tolist(),
+                        "stddev_total_ln": np.round(sigma, 4).tolist()})
+    return result_data
 
-def create_EAS_spectrum_plot(eas_results, gmm_name, output_path="/tmp/eas_spectrum.png"):
-    if not eas_results: return None
+def render_response_plot(results, gmm_name, fmt="png", dpi=None, write=True):
+    """Trace le spectre principal des résultats ; renvoie (chemin unique ou None, image en bytes)."""
+    kind, series = plot_rendering.select_plot_series(results)
+    if kind is None: return None, None
     try:
-        eas_results.sort(key=lambda r: r['frequency']); frequencies = [r["frequency"] for r in eas_results]; mean_values = np.array([r["mean_value"] for r in eas_results]); stddev_ln_values = np.array([r["stddev_total_ln"] for r in eas_results]); plt.figure(figsize=(10, 6)); plt.fill_between(frequencies, mean_values * np.exp(-stddev_ln_values), mean_values * np.exp(stddev_ln_values), color='purple', alpha=0.2, label='Mean ± 1σ range'); plt.plot(frequencies, mean_values, '-o', color='purple', label='Mean EAS', linewidth=2, markersize=4); plt.xscale('log'); plt.yscale('log'); plt.grid(True, which="both", ls="--", linewidth=0.5); plt.xlabel('Frequency (Hz)'); plt.ylabel('Effective Amplitude Spectrum (cm/s)'); plt.title(f'Effective Amplitude Spectrum - {gmm_name}', fontweight='bold'); plt.legend(); plt.tight_layout(); plt.savefig(output_path, dpi=150); plt.close(); return output_path
-    except Exception as e: print(f"Error creating EAS plot: {e}", file=sys.stderr); return None
+        data = plot_rendering.render_spectrum(kind, series, gmm_name, fmt, dpi)
+        return (plot_rendering.write_plot(data, kind, fmt) if write else None), data
+    except Exception as e:
+        print(f"Error creating {kind} plot: {e}", file=sys.stderr)
+        return None, None
 
-def create_DRVT_spectrum_plot(drvt_results, gmm_name, output_path="/tmp/drvt_spectrum.png"):
-    if not drvt_results: return None
+def _create_plot_file(kind, results, gmm_name, output_path):
+    if not results: return None
     try:
-        drvt_results.sort(key=lambda r: r['frequency'])
-        frequencies = [r["frequency"] for r in drvt_results]
-        mean_values = np.array([r["mean_value"] for r in drvt_results])
-        stddev_ln_values = np.array([r["stddev_total_ln"] for r in drvt_results])
-        plt.figure(figsize=(10, 6))
-        plt.fill_between(frequencies, np.exp(np.log(mean_values) - stddev_ln_values), np.exp(np.log(mean_values) + stddev_ln_values), color='teal', alpha=0.2, label='Mean ± 1σ range')
-        plt.plot(frequencies, mean_values, '-o', color='darkcyan', label='Mean DRVT', linewidth=2, markersize=4)
-        plt.xscale('log'); plt.yscale('log'); plt.grid(True, which="both", ls="--", linewidth=0.5)
-        plt.xlabel('Frequency (Hz)'); plt.ylabel('Duration (s)')
-        plt.title(f'Duration Spectrum (DRVT) - {gmm_name}', fontweight='bold'); plt.legend(); plt.tight_layout()
-        plt.savefig(output_path, dpi=150); plt.close()
+        data = plot_rendering.render_spectrum(kind, results, gmm_name)
+        if output_path is None: return plot_rendering.write_plot(data, kind)
+        with open(output_path, "wb") as f: f.write(data)
         return output_path
     except Exception as e:
-        print(f"Erreur lors de la préparation des données pour le tracé DRVT: {e}", file=sys.stderr)
+        print(f"Error creating {kind} plot: {e}", file=sys.stderr)
         return None
 
+# Fonctions historiques, conservées pour les scripts existants ; sans output_path, le fichier reçoit un nom unique.
+def create_response_spectrum_plot(sa_results, gmm_name, output_path=None):
+    return _create_plot_file("SA", sa_results, gmm_name, output_path)
 
-def run_gmm_calculation(args):
-    try:
-        keys = [k.strip() for k in args.keys.split(',')]
-        raw_values = [v.strip() for v in args.values.split(',')]
-        values = []
-        for v in raw_values:
-            try: values.append(float(v))
-            except ValueError: values.append(v)
-        user_params = dict(zip(keys, values))
-        full_module_name = f"openquake.hazardlib.gsim.{args.module}"
-        module = importlib.import_module(full_module_name)
-        gmm_class = getattr(module, args.class_name)
-
-        # =================================================================================
-        # ### DÉBUT DE LA MODIFICATION V8.5 : MAPPING NUMÉRIQUE POUR LA GÉOLOGIE ###
-        # =================================================================================
-        # On applique cette logique UNIQUEMENT pour la classe GMM spécifiée.
-        if args.class_name == 'Weatherill2024ESHM20SlopeGeologyAvgSA':
-            # Dictionnaire de correspondance : l'utilisateur entre le chiffre, le script utilise le texte.
-            # L'utilisateur entrera un nombre de 1 à 8.
-            geology_map = (
-                "CENOZOIC", "HOLOCENE", "JURASSIC-TRIASSIC", "CRETACEOUS",
-                "PALEOZOIC", "PLEISTOCENE", "PRECAMBRIAN", "UNKNOWN"
-            )
-            
-            # On vérifie si le paramètre 'geology' a été fourni.
-            if 'geology' in user_params:
-                try:
-                    # On convertit l'entrée de l'utilisateur en index (ex: 1 -> index 0)
-                    geology_index = int(user_params['geology']) - 1
-                    
-                    # On vérifie si l'index est valide.
-                    if 0 <= geology_index < len(geology_map):
-                        # On remplace le nombre par la chaîne de caractères correspondante.
-                        user_params['geology'] = geology_map[geology_index]
-                    else:
-                        # Si le nombre est hors limites, on lève une erreur.
-                        raise ValueError(f"Numéro de géologie '{user_params['geology']}' invalide. Doit être entre 1 et {len(geology_map)}.")
-                except (ValueError, TypeError):
-                    # Si l'entrée n'est pas un nombre, on lève une erreur.
-                    raise ValueError(f"L'entrée pour la géologie '{user_params['geology']}' est invalide. Un nombre entier est attendu.")
-        # =================================================================================
-        # ### FIN DE LA MODIFICATION V8.5 ###
-        # =================================================================================
-
-
-        constructor_args = {}
-        # Gestion spécifique pour HassaniAtkinson2018
-        if 'HassaniAtkinson2018' in args.class_name:
-            # Paramètres obligatoires avec valeurs par défaut
-            constructor_args['d_sigma'] = user_params.pop('d_sigma')  # stress drop en bars
-            constructor_args['kappa0'] = user_params.pop('kappa0',)    # kappa0 en secondes
-          
-            # Paramètre optionnel pour l'atténuation anélastique
-            if 'gamma_fle' in user_params:
-                constructor_args['gamma_fle'] = user_params.pop('gamma_fle')
-        elif 'MacedoEtAl2019' in args.class_name:
-            if 'region' in user_params: constructor_args['region'] = str(user_params.pop('region'))
-            constructor_args['gmpe'] = {'AbrahamsonEtAl2015SInter': {}}
-
-        # Gestion des paramètres spécifiques pour différents GMMs
-        # Logique pour les paramètres region et siteclass
-        if ('KothaEtAl2020ESHM20' in args.class_name or 'Weatherill2024ESHM20' in args.class_name):
-            if 'region' not in user_params:
-                user_params['region'] = 3
-            else:
-                # S'assurer que region est un entier pour ces modèles
-                try:
-                    user_params['region'] = int(float(user_params['region']))
-                except (ValueError, TypeError):
-                    user_params['region'] = 3
+def create_avg_sa_spectrum_plot(avg_sa_results, gmm_name, output_path=None):
+    return _create_plot_file("AvgSA", avg_sa_results, gmm_name, output_path)
+
+def create_vh_ratio_spectrum_plot(vhr_results, gmm_name, output_path=None):
+    return _create_plot_file("VHR_SA", vhr_results, gmm_name, output_path)
+
+def create_sdi_spectrum_plot(sdi_results, gmm_name, output_path=None):
+    return _create_plot_file("SDi", sdi_results, gmm_name, output_path)
+
+def create_FAS_spectrum_plot(fas_results, gmm_name, output_path=None):
+    return _create_plot_file("FAS", fas_results, gmm_name, output_path)
+
+def create_EAS_spectrum_plot(eas_results, gmm_name, output_path=None):
+    return _create_plot_file("EAS", eas_results, gmm_name, output_path)
+
+def create_DRVT_spectrum_plot(drvt_results, gmm_name, output_path=None):
+    return _create_plot_file("DRVT", drvt_results, gmm_name, output_path)
+
+def parse_user_params(keys_string, values_string):
+    """Transforme les chaînes --keys/--values en dictionnaire (nombres convertis en float)."""
+    keys = [k.strip() for k in keys_string.split(',')]
+    raw_values = [v.strip() for v in values_string.split(',')]
+    values = []
+    for v in raw_values:
+        try: values.append(float(v))
+        except ValueError: values.append(v)
+    return dict(zip(keys, values))
+
+def normalize_user_params(class_name, user_params):
+    """Applique en place les conversions propres à certains GMMs (géologie, région, siteclass)."""
+    # =================================================================================
+    # ### DÉBUT DE LA MODIFICATION V8.5 : MAPPING NUMÉRIQUE POUR LA GÉOLOGIE ###
+    # =================================================================================
+    # On applique cette logique UNIQUEMENT pour la classe GMM spécifiée.
+    if class_name == 'Weatherill2024ESHM20SlopeGeologyAvgSA':
+        # Dictionnaire de correspondance : l'utilisateur entre le chiffre, le script utilise le texte.
+        # L'utilisateur entrera un nombre de 1 à 8.
+        geology_map = (
+            "CENOZOIC", "HOLOCENE", "JURASSIC-TRIASSIC", "CRETACEOUS",
+            "PALEOZOIC", "PLEISTOCENE", "PRECAMBRIAN", "UNKNOWN"
+        )
         
-        if 'LanzanoEtAl2020_Cluster' in args.class_name:
-            if 'siteclass' not in user_params:
-                user_params['siteclass'] = "3"
-            # S'assurer que siteclass est une string pour ce modèle
-            user_params['siteclass'] = str(user_params['siteclass'])
+        # On vérifie si le paramètre 'geology' a été fourni.
+        if 'geology' in user_params:
+            try:
+                # On convertit l'entrée de l'utilisateur en index (ex: 1 -> index 0)
+                geology_index = int(user_params['geology']) - 1
+                
+                # On vérifie si l'index est valide.
+                if 0 <= geology_index < len(geology_map):
+                    # On remplace le nombre par la chaîne de caractères correspondante.
+                    user_params['geology'] = geology_map[geology_index]
+                else:
+                    # Si le nombre est hors limites, on lève une erreur.
+                    raise ValueError(f"Numéro de géologie '{user_params['geology']}' invalide. Doit être entre 1 et {len(geology_map)}.")
+            except (ValueError, TypeError):
+                # Si l'entrée n'est pas un nombre, on lève une erreur.
+                raise ValueError(f"L'entrée pour la géologie '{user_params['geology']}' est invalide. Un nombre entier est attendu.")
+    # =================================================================================
+    # ### FIN DE LA MODIFICATION V8.5 ###
+    # =================================================================================
+
+    # Gestion des paramètres spécifiques pour différents GMMs
+    # Logique pour les paramètres region et siteclass
+    if ('KothaEtAl2020ESHM20' in class_name or 'Weatherill2024ESHM20' in class_name):
+        if 'region' not in user_params:
+            user_params['region'] = 3
+        else:
+            # S'assurer que region est un entier pour ces modèles
+            try:
+                user_params['region'] = int(float(user_params['region']))
+            except (ValueError, TypeError):
+                user_params['region'] = 3
+    
+    if 'LanzanoEtAl2020_Cluster' in class_name:
+        if 'siteclass' not in user_params:
+            user_params['siteclass'] = "3"
+        # S'assurer que siteclass est une string pour ce modèle
+        user_params['siteclass'] = str(user_params['siteclass'])
+    return user_params
+
+def build_constructor_args(gmm_class, class_name, user_params):
+    """Arguments du constructeur pour les GMMs qui en demandent ; les paramètres consommés sont retirés de user_params."""
+    constructor_args = {}
+    # Gestion spécifique pour HassaniAtkinson2018
+    if 'HassaniAtkinson2018' in class_name:
+        # Paramètres obligatoires avec valeurs par défaut
+        constructor_args['d_sigma'] = user_params.pop('d_sigma')  # stress drop en bars
+        constructor_args['kappa0'] = user_params.pop('kappa0',)    # kappa0 en secondes
+      
+        # Paramètre optionnel pour l'atténuation anélastique
+        if 'gamma_fle' in user_params:
+            constructor_args['gamma_fle'] = user_params.pop('gamma_fle')
+    elif 'MacedoEtAl2019' in class_name:
+        if 'region' in user_params: constructor_args['region'] = str(user_params.pop('region'))
+        constructor_args['gmpe'] = {'AbrahamsonEtAl2015SInter': {}}
 
+    import inspect
+    init_params = inspect.signature(gmm_class.__init__).parameters
+    if 'gmpe_name' in init_params:
+        constructor_args['gmpe_name'] = 'AbrahamsonSilva2008'
+    return constructor_args
 
-        init_params = inspect.signature(gmm_class.__init__).parameters
-        if 'gmpe_name' in init_params:
-            constructor_args['gmpe_name'] = 'AbrahamsonSilva2008'
-        gmm = gmm_class(**constructor_args)
+def prepare_gmm(module_name, class_name, user_params):
+    """Importe la classe GMM, normalise user_params en place et instancie le modèle."""
+    full_module_name = f"openquake.hazardlib.gsim.{module_name}"
+    module = importlib.import_module(full_module_name)
+    gmm_class = getattr(module, class_name)
+    normalize_user_params(class_name, user_params)
+    constructor_args = build_constructor_args(gmm_class, class_name, user_params)
+    return gmm_class, gmm_class(**constructor_args), constructor_args
+
+def is_vh_ratio_class(gmm_class):
+    """Vrai pour les modèles de rapport V/H (composante VERTICAL_TO_HORIZONTAL_RATIO)."""
+    from openquake.hazardlib import const
+    return getattr(gmm_class, 'DEFINED_FOR_INTENSITY_MEASURE_COMPONENT', None) == const.IMC.VERTICAL_TO_HORIZONTAL_RATIO
+
+def get_required_parameters(gmm_class):
+    req_sites = getattr(gmm_class, 'REQUIRES_SITES_PARAMETERS', set())
+    req_rupture = getattr(gmm_class, 'REQUIRES_RUPTURE_PARAMETERS', set())
+    req_distances = getattr(gmm_class, 'REQUIRES_DISTANCES', set())
+    return req_sites, req_rupture, req_distances
+
+def build_contexts(gmm_class, user_params):
+    """Construit les contextes site/rupture/distance d'un seul scénario à partir de user_params."""
+    req_sites, req_rupture, req_distances = get_required_parameters(gmm_class)
+    all_required = req_sites | req_rupture | req_distances
+    missing = [p for p in all_required if p not in user_params]
+    if missing:
+        raise GMMCalculationError(f"Missing parameters: {', '.join(missing)}")
+    
+    from openquake.hazardlib.contexts import SitesContext, RuptureContext, DistancesContext
+    sctx, rctx, dctx = SitesContext(), RuptureContext(), DistancesContext()
+    for p in req_sites: setattr(sctx, p, np.array([user_params[p]]))
+    for p in req_rupture: setattr(rctx, p, np.array([user_params[p]]))
+    for p in req_distances: setattr(dctx, p, np.array([user_params[p]]))
+    sctx.sids = np.array([1])
+    return sctx, rctx, dctx
+
+def make_imt(imt_name, imt_params):
+    """Renvoie l'objet IMT OpenQuake et son nom d'affichage."""
+    from openquake.hazardlib import imt
+    if imt_name == "SA": return imt.SA(imt_params), f"SA({imt_params}s)"
+    elif imt_name == "AvgSA": return imt.AvgSA(imt_params), f"AvgSA({imt_params}s)"
+    elif imt_name == "FAS": return imt.FAS(imt_params), f"FAS({imt_params}Hz)"
+    elif imt_name == "EAS": return imt.EAS(imt_params), f"EAS({imt_params}Hz)"
+    elif imt_name == "DRVT": return imt.DRVT(imt_params), f"DRVT({imt_params}Hz)"
+    elif imt_name == "SDi": return imt.SDi(imt_params["period"], imt_params["strength_ratio"]), f"SDi({imt_params['period']}s, R={imt_params['strength_ratio']})"
+    else: return getattr(imt, imt_name)(), imt_name
+
+def group_by_family(prepared):
+    """Regroupe les IMTs préparés par famille (PGA, SA, SDi, FAS...) en conservant l'ordre de détection."""
+    families = {}
+    for item in prepared:
+        families.setdefault(item[0], []).append(item)
+    return list(families.values())
+
+def _record_stage(timings, stage, started):
+    """Ajoute à timings[stage] le temps écoulé depuis started (si timings est fourni) ; renvoie l'instant courant."""
+    now = time.perf_counter()
+    if timings is not None: timings[stage] = timings.get(stage, 0.0) + now - started
+    return now
+
+def timings_report(timings):
+    """Bloc "timings" de la réponse (--timings) à partir du dict rempli par calculate_gmm_with_plot."""
+    stages = {k: round(v, 4) for k, v in timings.items() if isinstance(v, float)}
+    report = {"total_s": round(sum(stages.values()), 4), "stages_s": stages, "imt_source": timings.get("imt_source")}
+    if "families" in timings:
+        report["families"] = {name: dict(f, evaluation_s=round(f["evaluation_s"], 4)) for name, f in timings["families"].items()}
+    probes = timings.get("failed_probes", {})
+    report["failed_probes"] = {"count": probes.get("count", 0), "time_s": round(probes.get("time_s", 0.0), 4),
+                               "rejected": probes.get("rejected", 0), "batch_fallbacks": probes.get("batch_fallbacks", 0)}
+    return report
+
+def calculate_gmm(args, make_plot=True):
+    """Calcule tous les IMTs supportés et renvoie la réponse JSON sous forme de dict (avec un bloc timings si --timings)."""
+    timings = {} if getattr(args, 'timings', False) else None
+    response = calculate_gmm_with_plot(args, make_plot, timings=timings)[0]
+    if timings is not None: response["timings"] = timings_report(timings)
+    return response
+
+def calculate_gmm_with_plot(args, make_plot=True, write_plot=True, on_result=None, timings=None):
+    """Comme calculate_gmm, mais renvoie aussi l'image du graphique en mémoire : (response, plot_bytes).
+
+    Avec write_plot=False, l'image n'est pas écrite sur disque et plot_path vaut None.
+    Si on_result est fourni, il est appelé avec chaque résultat d'IMT dès qu'il est disponible : les IMTs
+    sont alors évalués famille par famille (un appel vectorisé par famille) au lieu d'un seul passage.
+    Si timings (dict) est fourni, il reçoit la durée en secondes de chaque étape : import, contexts, cache,
+    imt_detection, evaluation, plotting, ainsi que imt_source (index, introspection ou cache), le nombre d'IMTs
+    et d'échecs par famille (families) et les IMTs sondés sans succès (failed_probes). Mesurer ne change pas
+    l'évaluation : sans on_result, l'appel vectorisé unique est réparti entre familles au prorata de leurs IMTs
+    (evaluation_s marqué estimated) ; les IMTs évalués puis rejetés (moyenne NaN, sigma >= 9000) sont comptés dans
+    failed_probes (rejected) avec leur part de l'appel.
+    """
+    started = time.perf_counter()
+    try:
+        plot_fmt, plot_dpi = plot_rendering.plot_options(getattr(args, 'plot_format', None), getattr(args, 'preview', False))
+    except ValueError as e:
+        raise GMMCalculationError(f"Plot Option Error: {e}") from e
+    try:
+        user_params = parse_user_params(args.keys, args.values)
+        gmm_class, gmm, constructor_args = prepare_gmm(args.module, args.class_name, user_params)
     except Exception as e:
-        print(json.dumps({"success": False, "error": f"GMM Import Error: {e}"}), file=sys.stderr)
-        sys.exit(1)
+        raise GMMCalculationError(f"GMM Import Error: {e}") from e
+    started = _record_stage(timings, "import", started)
     
-    is_vh_ratio_model = (hasattr(gmm_class, 'DEFINED_FOR_INTENSITY_MEASURE_COMPONENT') and
-                       gmm_class.DEFINED_FOR_INTENSITY_MEASURE_COMPONENT == const.IMC.VERTICAL_TO_HORIZONTAL_RATIO)
+    is_vh_ratio_model = is_vh_ratio_class(gmm_class)
     try:
-        if ('KothaEtAl2020ESHM20' in args.class_name or 'Weatherill2024ESHM20' in args.class_name) and 'region' in user_params:
-            try: user_params['region'] = int(float(user_params['region']))
-            except (ValueError, TypeError): user_params['region'] = 3
-
-        req_sites = getattr(gmm_class, 'REQUIRES_SITES_PARAMETERS', set())
-        req_rupture = getattr(gmm_class, 'REQUIRES_RUPTURE_PARAMETERS', set())
-        req_distances = getattr(gmm_class, 'REQUIRES_DISTANCES', set())
-        all_required = req_sites | req_rupture | req_distances
-        missing = [p for p in all_required if p not in user_params]
-        if missing:
-            print(json.dumps({"success": False, "error": f"Missing parameters: {', '.join(missing)}"}), file=sys.stderr)
-            sys.exit(1)
-        
-        sctx, rctx, dctx = SitesContext(), RuptureContext(), DistancesContext()
-        for p in req_sites: setattr(sctx, p, np.array([user_params[p]]))
-        for p in req_rupture: setattr(rctx, p, np.array([user_params[p]]))
-        for p in req_distances: setattr(dctx, p, np.array([user_params[p]]))
-        sctx.sids = np.array([1])
+        sctx, rctx, dctx = build_contexts(gmm_class, user_params)
+    except GMMCalculationError:
+        raise
     except Exception as e:
-        print(json.dumps({"success": False, "error": f"Context Error: {e}"}), file=sys.stderr)
-        sys.exit(1)
+        raise GMMCalculationError(f"Context Error: {e}") from e
+    started = _record_stage(timings, "contexts", started)
+
+    cache, cache_key = get_result_cache(), None
+    if cache is not None:
+        try:
+            cache_key = result_cache_key(args.module, gmm_class, constructor_args, user_params, [make_plot, plot_fmt, plot_dpi])
+            cached = cache.get(cache_key)
+        except Exception as e:
+            print(f"Result cache unavailable: {e}", file=sys.stderr)
+            cache, cached = None, None
+        if cached is not None:
+            response, plot_bytes = cached
+            if on_result is not None:
+                for result_data in response["imt_results"]: on_result(result_data)
+            response["plot_path"] = None
+            if plot_bytes and write_plot:
+                kind, _ = plot_rendering.select_plot_series(response["imt_results"])
+                response["plot_path"] = plot_rendering.write_plot(plot_bytes, kind, plot_fmt)
+            _record_stage(timings, "cache", started)
+            if timings is not None: timings["imt_source"] = "cache"
+            return response, plot_bytes
+        started = _record_stage(timings, "cache", started)
 
     try:
-        supported_imts = get_supported_imts(gmm_class)
+        supported_imts, imt_source, index_skipped = select_imts(gmm_class)
     except Exception as e:
-        print(json.dumps({"success": False, "error": f"IMT Detection Error: {e}"}), file=sys.stderr)
-        sys.exit(1)
+        raise GMMCalculationError(f"IMT Detection Error: {e}") from e
+    started = _record_stage(timings, "imt_detection", started)
+    probes = families = None
+    if timings is not None:
+        timings["imt_source"] = imt_source
+        probes, families = timings.setdefault("failed_probes", {}), timings.setdefault("families", {})
         
     results, successful_imts, failed_imts = [], [], []
+    prepared = []
     for imt_name, imt_params in supported_imts:
-        display_name = ""
         try:
-            if imt_name == "SA": imt_obj, display_name = imt.SA(imt_params), f"SA({imt_params}s)"
-            elif imt_name == "AvgSA": imt_obj, display_name = imt.AvgSA(imt_params), f"AvgSA({imt_params}s)"
-            elif imt_name == "FAS": imt_obj, display_name = imt.FAS(imt_params), f"FAS({imt_params}Hz)"
-            elif imt_name == "EAS": imt_obj, display_name = imt.EAS(imt_params), f"EAS({imt_params}Hz)"
-            elif imt_name == "DRVT": imt_obj, display_name = imt.DRVT(imt_params), f"DRVT({imt_params}Hz)"
-            elif imt_name == "SDi": imt_obj, display_name = imt.SDi(imt_params["period"], imt_params["strength_ratio"]), f"SDi({imt_params['period']}s, R={imt_params['strength_ratio']})"
-            else: imt_obj, display_name = getattr(imt, imt_name)(), imt_name
-            
-            is_supported, mean, stddevs = test_imt_support(gmm, sctx, rctx, dctx, imt_obj)
-            
-            stddev_val = float(stddevs[0][0]) if stddevs and len(stddevs) > 0 and len(stddevs[0]) > 0 else 9999.0
-            
-            if is_supported and stddev_val < 9000:
-                if is_vh_ratio_model:
-                    mean_value = float(np.exp(mean[0]))
-                    unit = ""
-                    imt_name_orig = imt_name
-                    imt_name = f"VHR_{imt_name_orig}"
-                    display_name = f"VHR({imt_params}s)" if imt_name_orig in ["SA", "AvgSA"] else f"VHR_{display_name}"
-                else:
-                    # ### DÉBUT DU BLOC CORRIGÉ (INDENTATION PROPRE) ###
-                    if "MorikawaFujiwara2013" in args.class_name and imt_name in ["JMA", "PGV"]:
-                        mean_value = float(np.log10(np.exp(mean[0]) * 980.665))
-                    elif imt_name in ["MMI", "JMA"]:
-                        mean_value = float(mean[0])
-                    elif 'ConvertitoEtAl2012' in args.class_name or 'TusaLangerAzzaro2019' in args.class_name:
-                        mean_value = float(np.exp(mean[0]) / 1000.0)
-                    else:
-                        mean_value = float(np.exp(mean[0]))
-                    # ### FIN DU BLOC CORRIGÉ ###
-                    unit_map = {"PGA":"g", "PGV":"cm/s", "PGD":"cm", "IA":"m/s", "CAV":"g⋅s", "SA":"g", "AvgSA": "g", "FAS":"g.s", "SDi":"cm", "EAS":"cm/s", "DRVT":"s"}
-                    duration_units = {"RSD575", "RSD595", "RSD2080", "D5_75", "D5_95"}
-                    unit = unit_map.get(imt_name, "s" if imt_name in duration_units or imt_name == "DRVT" else "")
-                
-                result_data = {"imt": imt_name, "display_name": display_name, "mean_ln": round(float(mean[0]), 4),
-                               "mean_value": round(mean_value, 6), "unit": unit, "stddev_total_ln": round(stddev_val, 4), "success": True}
-                
-                if imt_name in ["SA", "VHR_SA", "AvgSA"]: result_data["sa_period"] = imt_params
-                elif imt_name in ["FAS", "EAS", "DRVT"]: result_data["frequency"] = imt_params
-                elif imt_name == "SDi": result_data.update({"sdi_period": imt_params["period"], "strength_ratio": imt_params["strength_ratio"]})
-                results.append(result_data)
-                successful_imts.append(display_name)
-            else:
-                failed_imts.append(display_name)
+            imt_obj, display_name = make_imt(imt_name, imt_params)
+            prepared.append((imt_name, imt_params, imt_obj, display_name))
         except Exception as e:
-            if not display_name: display_name = f"{imt_name}({imt_params})"
-            failed_imts.append(f"{display_name} (Error: {type(e).__name__})"); continue
+            prepared.append((imt_name, imt_params, None, f"{imt_name}({imt_params}) (Error: {type(e).__name__})"))
+    for chunk in (group_by_family(prepared) if on_result is not None else [prepared]):
+        chunk_started = time.perf_counter()
+        imt_objs = [p[2] for p in chunk if p[2] is not None]
+        evaluations = iter(evaluate_imts(gmm, sctx, rctx, dctx, imt_objs, probes))
+        # Part d'un IMT dans la durée de l'appel : temps par famille (exact si l'appel ne couvre qu'une famille)
+        # et temps perdu sur les IMTs rejetés après évaluation.
+        share_s = (time.perf_counter() - chunk_started) / len(imt_objs) if imt_objs else 0.0
+        for imt_name, imt_params, imt_obj, display_name in chunk:
+            failed_before, rejected = len(failed_imts), False
+            if imt_obj is None:
+                failed_imts.append(display_name)
+            else:
+                try:
+                    is_supported, mean, stddevs = next(evaluations)
+                    result_data = format_imt_result(args.class_name, imt_name, imt_params, display_name, is_supported, mean, stddevs, is_vh_ratio_model)
+                    if result_data is not None:
+                        results.append(result_data)
+                        successful_imts.append(result_data["display_name"])
+                        if on_result is not None: on_result(result_data)
+                    else:
+                        # Un IMT non supporté (exception) est déjà compté par evaluate_imts.
+                        failed_imts.append(display_name)
+                        rejected = is_supported
+                except Exception as e:
+                    failed_imts.append(f"{display_name} (Error: {type(e).__name__})")
+                    rejected = True
+            if probes is not None and rejected:
+                probes["rejected"] = probes.get("rejected", 0) + 1
+                probes["count"] = probes.get("count", 0) + 1
+                probes["time_s"] = probes.get("time_s", 0.0) + share_s
+            if families is not None:
+                family = families.setdefault(imt_name, {"imts": 0, "failed": 0, "evaluation_s": 0.0, "estimated": on_result is None})
+                family["imts"] += 1
+                family["failed"] += len(failed_imts) - failed_before
+                if imt_obj is not None: family["evaluation_s"] += share_s
             
     def sort_key(r):
         order = {"PGA":0, "PGV":1, "PGD":2, "LSD":3, "MMI": 3.5, "JMA": 3.6, "VHR_PGA": 3.7, "VHR_PGV": 3.8}
@@ -406,40 +684,592 @@ def run_gmm_calculation(args):
     fas_results = [r for r in results if r["imt"] == "FAS"]
     eas_results = [r for r in results if r["imt"] == "EAS"]
     drvt_results = [r for r in results if r["imt"] == "DRVT"]
-    plot_path = None
-    
-    if sa_results and len(sa_results) >= 3:
-        plot_path = create_response_spectrum_plot(sa_results, args.class_name)
-    elif avg_sa_results and len(avg_sa_results) >= 3:
-        plot_path = create_avg_sa_spectrum_plot(avg_sa_results, args.class_name)
-    elif vhr_sa_results and len(vhr_sa_results) >= 3:
-        plot_path = create_vh_ratio_spectrum_plot(vhr_sa_results, args.class_name)
-    elif drvt_results and len(drvt_results) >= 3:
-        plot_path = create_DRVT_spectrum_plot(drvt_results, args.class_name)
-    elif fas_results and len(fas_results) >= 3:
-        plot_path = create_FAS_spectrum_plot(fas_results, args.class_name)
-    elif eas_results and len(eas_results) >= 3:
-        plot_path = create_EAS_spectrum_plot(eas_results, args.class_name)
-    elif sdi_results and len(sdi_results) >= 3:
-        plot_path = create_sdi_spectrum_plot(sdi_results, args.class_name)
+    plot_path, plot_bytes = None, None
+    started = _record_stage(timings, "evaluation", started)
+    if make_plot:
+        plot_path, plot_bytes = render_response_plot(results, args.class_name, plot_fmt, plot_dpi, write=write_plot)
+    started = _record_stage(timings, "plotting", started)
     
     response = {
         "success": True, "gmm": args.class_name, "module": args.module,
         "total_imts_tested": len(supported_imts), "successful_imts_count": len(results),
         "failed_imts_count": len(failed_imts), "successful_imts": successful_imts,
         "failed_imts": failed_imts or None, "imt_results": results,
+        "imt_source": imt_source, "imts_skipped_by_index": index_skipped,
         "sa_count": len(sa_results), "avg_sa_count": len(avg_sa_results),
         "vhr_sa_count": len(vhr_sa_results), "sdi_count": len(sdi_results),
         "fas_count": len(fas_results), "eas_count": len(eas_results),
         "drvt_count": len(drvt_results), "plot_path": plot_path
     }
-    print(json.dumps(response, indent=2))
+    if cache is not None:
+        try:
+            cache.put(cache_key, response, plot_bytes)
+        except Exception as e:
+            print(f"Could not store result in cache: {e}", file=sys.stderr)
+    return response, plot_bytes
+
+# =================================================================================
+# Format de sortie en colonnes : un jeu de tableaux par famille d'IMTs au lieu d'un dict par IMT
+# =================================================================================
+OUTPUT_FORMATS = ("records", "columnar", "npz")
+# Champs d'un résultat qui ne deviennent pas des colonnes (le nom d'affichage se déduit de l'IMT et de ses paramètres).
+NON_COLUMN_FIELDS = {"imt", "display_name", "unit", "success"}
+VALUE_FIELDS = ("mean_ln", "mean_value", "stddev_total_ln")
+
+def to_columnar(results):
+    """imt_results -> {famille: {"unit": ..., colonne: [valeurs par IMT]}} en conservant l'ordre des résultats.
+
+    Les colonnes sont les champs des résultats (sa_period, frequency, sdi_period, strength_ratio, mean_ln,
+    mean_value, stddev_total_ln) ; en mode batch chaque valeur est elle-même la liste des N scénarios.
+    """
+    families = {}
+    for r in results:
+        family = families.setdefault(r["imt"], {"unit": r.get("unit", "")})
+        # Colonnes d'axe (période, fréquence...) avant les valeurs.
+        for key in sorted(r, key=lambda k: k in VALUE_FIELDS):
+            if key not in NON_COLUMN_FIELDS: family.setdefault(key, []).append(r[key])
+    return families
+
+def columnar_response(response):
+    """Réponse au format colonnes : imt_results (et la liste successful_imts) remplacés par imt_families."""
+    body = {k: v for k, v in response.items() if k not in ("imt_results", "successful_imts")}
+    body["output_format"] = "columnar"
+    body["imt_families"] = to_columnar(response.get("imt_results") or [])
+    return body
+
+def write_npz(response, target):
+    """Écrit les colonnes en NPZ compressé (tableaux "FAMILLE/colonne", unité en chaîne) ; le reste de la réponse va dans "response" (JSON).
+
+    target est un chemin ou un fichier binaire ouvert ; numpy.load(...)["SA/mean_ln"] relit un tableau.
+    """
+    body = columnar_response(response)
+    arrays = {"response": np.array(json.dumps({k: v for k, v in body.items() if k != "imt_families"}))}
+    for family, columns in body["imt_families"].items():
+        for key, values in columns.items():
+            arrays[f"{family}/{key}"] = np.array(values)
+    np.savez_compressed(target, **arrays)
+
+def format_output(response, output_format="records", npz_path=None):
+    """Applique --output-format à une réponse (mode simple ou batch) ; records la renvoie inchangée.
+
+    En npz sans npz_path (serveur), le fichier est renvoyé en base64 dans npz_base64.
+    """
+    if output_format == "columnar": return columnar_response(response)
+    if output_format == "npz":
+        body = {k: v for k, v in response.items() if k not in ("imt_results", "successful_imts")}
+        body["output_format"] = "npz"
+        if npz_path:
+            write_npz(response, npz_path)
+            body["npz_path"] = npz_path
+        else:
+            import io, base64
+            buffer = io.BytesIO()
+            write_npz(response, buffer)
+            body["npz_base64"] = base64.b64encode(buffer.getvalue()).decode("ascii")
+        return body
+    return response
+
+# =================================================================================
+# Mode batch : plusieurs scénarios (vecteurs, grilles, fichier CSV/NPZ) évalués en un seul passage
+# =================================================================================
+# Paramètres convertis par normalize_user_params / build_constructor_args : ils restent scalaires.
+BATCH_FIXED_PARAMETERS = {'geology', 'region', 'siteclass', 'd_sigma', 'kappa0', 'gamma_fle'}
+
+def parse_vector_value(value):
+    """'a;b;c' -> liste, 'start:stop:n' -> linspace, 'start:stop:n:log' -> logspace ; None pour une valeur scalaire."""
+    if not isinstance(value, str): return None
+    if ';' in value:
+        items = [v.strip() for v in value.split(';') if v.strip()]
+        try: return np.array([float(v) for v in items])
+        except ValueError: return np.array(items)
+    parts = value.split(':')
+    if len(parts) in (3, 4):
+        start, stop, num = float(parts[0]), float(parts[1]), int(parts[2])
+        if len(parts) == 4:
+            if parts[3].strip() != 'log': raise ValueError(f"Unknown range spacing '{parts[3]}' in '{value}'")
+            return np.logspace(np.log10(start), np.log10(stop), num)
+        return np.linspace(start, stop, num)
+    return None
+
+def load_scenarios_file(path):
+    """Lit un fichier de scénarios : CSV avec une ligne d'en-tête, ou NPZ avec un tableau 1-D par paramètre."""
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            columns = {name: np.asarray(data[name]).ravel() for name in data.files}
+    else:
+        import csv
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        if not rows: raise ValueError(f"No scenarios in {path}")
+        columns = {}
+        for name in rows[0]:
+            raw = [row[name].strip() for row in rows]
+            try: columns[name.strip()] = np.array([float(v) for v in raw])
+            except ValueError: columns[name.strip()] = np.array(raw)
+    lengths = {len(v) for v in columns.values()}
+    if len(lengths) != 1: raise ValueError(f"Columns of {path} have different lengths")
+    return columns
+
+def combine_scenario_axes(axes, grid=False):
+    """Combine des axes (dict nom -> tableau de même longueur) en colonnes de N scénarios, par zip ou produit cartésien."""
+    if not axes: return {}, 1
+    lengths = [len(next(iter(axis.values()))) for axis in axes]
+    if grid:
+        indices = [i.ravel() for i in np.meshgrid(*[np.arange(n) for n in lengths], indexing='ij')]
+    else:
+        if len(set(lengths)) != 1:
+            raise ValueError(f"Vector parameters have different lengths {lengths}; use --grid for a Cartesian product")
+        indices = [np.arange(lengths[0])] * len(axes)
+    columns = {}
+    for axis, idx in zip(axes, indices):
+        for name, values in axis.items(): columns[name] = values[idx]
+    return columns, len(indices[0])
+
+def group_vector_axes(vectors, gmm_class):
+    """Un axe par groupe de contexte (sites, rupture, distances) et par longueur : en mode grille, rrup, rjb et rx
+    de mêmes sites restent appariés terme à terme au lieu d'être croisés entre eux."""
+    groups = get_required_parameters(gmm_class)
+    axes = {}
+    for name, vector in vectors.items():
+        group = next((i for i, g in enumerate(groups) if name in g), name)
+        axes.setdefault((group, len(vector)), {})[name] = vector
+    return list(axes.values())
+
+def _as_column(value, n):
+    column = np.asarray(value)
+    return np.full(n, value) if column.ndim == 0 else column
+
+def build_batch_contexts(gmm_class, params, n):
+    """Comme build_contexts, mais chaque paramètre devient un tableau de N valeurs (scalaires répétés)."""
+    req_sites, req_rupture, req_distances = get_required_parameters(gmm_class)
+    missing = [p for p in req_sites | req_rupture | req_distances if p not in params]
+    if missing:
+        raise GMMCalculationError(f"Missing parameters: {', '.join(missing)}")
+    from openquake.hazardlib.contexts import SitesContext, RuptureContext, DistancesContext
+    sctx, rctx, dctx = SitesContext(), RuptureContext(), DistancesContext()
+    for p in req_sites: setattr(sctx, p, _as_column(params[p], n))
+    for p in req_rupture: setattr(rctx, p, _as_column(params[p], n))
+    for p in req_distances: setattr(dctx, p, _as_column(params[p], n))
+    sctx.sids = np.arange(n)
+    return sctx, rctx, dctx
+
+def is_batch_request(args):
+    if getattr(args, 'scenarios', None): return True
+    return any(';' in v or v.count(':') in (2, 3) for v in (args.values or '').split(','))
+
+def calculate_gmm_batch(args):
+    """Évalue N scénarios en un seul passage vectorisé ; un résultat par IMT avec des listes de N valeurs."""
+    try:
+        user_params = parse_user_params(args.keys, args.values) if args.keys else {}
+        scalars, vectors = {}, {}
+        for name, value in user_params.items():
+            vector = parse_vector_value(value)
+            if vector is None: scalars[name] = value
+            else: vectors[name] = vector
+        scenario_columns = load_scenarios_file(args.scenarios) if getattr(args, 'scenarios', None) else None
+    except Exception as e:
+        raise GMMCalculationError(f"Batch Input Error: {e}") from e
+    try:
+        gmm_class, gmm, _ = prepare_gmm(args.module, args.class_name, scalars)
+    except Exception as e:
+        raise GMMCalculationError(f"GMM Import Error: {e}") from e
+    try:
+        axes = group_vector_axes(vectors, gmm_class) + ([scenario_columns] if scenario_columns else [])
+        columns, n = combine_scenario_axes(axes, getattr(args, 'grid', False))
+        varying_fixed = sorted(BATCH_FIXED_PARAMETERS & set(columns))
+        if varying_fixed:
+            raise ValueError(f"Parameters {', '.join(varying_fixed)} cannot vary in batch mode")
+    except Exception as e:
+        raise GMMCalculationError(f"Batch Input Error: {e}") from e
+    is_vh_ratio_model = is_vh_ratio_class(gmm_class)
+    try:
+        sctx, rctx, dctx = build_batch_contexts(gmm_class, dict(scalars, **columns), n)
+    except GMMCalculationError:
+        raise
+    except Exception as e:
+        raise GMMCalculationError(f"Context Error: {e}") from e
+    try:
+        supported_imts, imt_source, index_skipped = select_imts(gmm_class)
+    except Exception as e:
+        raise GMMCalculationError(f"IMT Detection Error: {e}") from e
+
+    prepared, results, failed_imts = [], [], []
+    for imt_name, imt_params in supported_imts:
+        try:
+            imt_obj, display_name = make_imt(imt_name, imt_params)
+            prepared.append((imt_name, imt_params, imt_obj, display_name))
+        except Exception as e:
+            failed_imts.append(f"{imt_name}({imt_params}) (Error: {type(e).__name__})")
+    evaluations = evaluate_imts(gmm, sctx, rctx, dctx, [p[2] for p in prepared])
+    for (imt_name, imt_params, _, display_name), (is_supported, mean, stddevs) in zip(prepared, evaluations):
+        try:
+            result_data = format_imt_batch_result(args.class_name, imt_name, imt_params, display_name, is_supported, mean, stddevs, is_vh_ratio_model)
+        except Exception as e:
+            failed_imts.append(f"{display_name} (Error: {type(e).__name__})"); continue
+        if result_data is None: failed_imts.append(display_name)
+        else: results.append(result_data)
+
+    return {
+        "success": True, "mode": "batch", "gmm": args.class_name, "module": args.module,
+        "n_scenarios": n, "fixed_params": scalars,
+        "scenario_params": {k: v.tolist() for k, v in columns.items()},
+        "total_imts_tested": len(supported_imts), "successful_imts_count": len(results),
+        "failed_imts_count": len(failed_imts), "failed_imts": failed_imts or None, "imt_results": results,
+        "imt_source": imt_source, "imts_skipped_by_index": index_skipped,
+    }
+
+# =================================================================================
+# Mode ensemble : plusieurs GMMs pondérés (arbre logique) évalués en parallèle
+# =================================================================================
+DEFAULT_ENSEMBLE_PERCENTILES = (5, 16, 50, 84, 95)
+
+def parse_gmm_list(gmms_string):
+    """'module:Classe[:poids],...' -> liste de (module, classe, poids) avec des poids normalisés à 1."""
+    members = []
+    for item in gmms_string.split(','):
+        parts = [p.strip() for p in item.strip().split(':')]
+        if len(parts) not in (2, 3) or not all(parts):
+            raise ValueError(f"Invalid GMM spec '{item}', expected module:Class[:weight]")
+        members.append((parts[0], parts[1], float(parts[2]) if len(parts) == 3 else 1.0))
+    total = sum(w for _, _, w in members)
+    if total <= 0: raise ValueError("GMM weights must sum to a positive value")
+    return [(m, c, w / total) for m, c, w in members]
+
+def weighted_quantile(values, weights, quantile):
+    """Quantile pondéré des branches, par interpolation sur les poids cumulés (comme openquake.hazardlib.stats)."""
+    order = np.argsort(values)
+    cum_weights = np.cumsum(np.asarray(weights)[order])
+    return float(np.interp(quantile, cum_weights, np.asarray(values)[order]))
+
+def _evaluate_ensemble_member(module_name, class_name, keys, values):
+    """Exécuté dans un processus du pool : calcule un membre sans graphique et mesure son temps.
+
+    hazardlib, le module du GMM et l'index des IMTs sont importés avant de lancer le chronomètre : dans un
+    processus neuf, leur chargement coûte bien plus que le calcul et fausserait wall_time_s.
+    """
+    try:
+        importlib.import_module("openquake.hazardlib.contexts")
+        importlib.import_module(f"openquake.hazardlib.gsim.{module_name}")
+        load_imt_index()
+    except Exception:
+        pass  # l'erreur d'import est rapportée par calculate_gmm
+    started = time.perf_counter()
+    member_args = argparse.Namespace(module=module_name, class_name=class_name, keys=keys, values=values)
+    try:
+        response = calculate_gmm(member_args, make_plot=False)
+    except GMMCalculationError as e:
+        response = {"success": False, "gmm": class_name, "module": module_name, "error": str(e)}
+    response.pop("plot_path", None)
+    response["wall_time_s"] = round(time.perf_counter() - started, 4)
+    return response
+
+def combine_ensemble(members, percentiles=DEFAULT_ENSEMBLE_PERCENTILES):
+    """Moyenne pondérée et percentiles des IMTs communs à tous les membres qui ont réussi."""
+    ok = [m for m in members if m.get("success")]
+    if not ok: return None
+    weights = np.array([m["weight"] for m in ok])
+    weights = weights / weights.sum()
+    by_member = [{r["display_name"]: r for r in m["imt_results"]} for m in ok]
+    common = [name for name in by_member[0] if all(name in b for b in by_member[1:])]
+    results = []
+    for name in common:
+        first = by_member[0][name]
+        values = np.array([b[name]["mean_value"] for b in by_member])
+        # Les valeurs lognormales sont combinées en log ; MMI/JMA sont déjà sur une échelle d'intensité.
+        log_scale = first["imt"] not in ("MMI", "JMA") and np.all(values > 0)
+        x = np.log(values) if log_scale else values
+        back = np.exp if log_scale else (lambda v: v)
+        entry = {k: v for k, v in first.items() if k in ("imt", "display_name", "unit", "sa_period", "frequency", "sdi_period", "strength_ratio")}
+        entry["mean_value"] = round(float(back(np.dot(weights, x))), 6)
+        entry["percentiles"] = {str(p): round(float(back(weighted_quantile(x, weights, p / 100.0))), 6) for p in percentiles}
+        results.append(entry)
+    return {"members_used": [m["gmm"] for m in ok], "weights": [round(float(w), 6) for w in weights],
+            "percentile_levels": list(percentiles), "imt_results": results}
+
+def calculate_ensemble(args):
+    """Évalue chaque GMM de --gmms dans un pool de processus et combine les résultats.
+
+    Le pool compte au plus un processus par membre et par CPU ; avec workers=0 (worker de la file du serveur),
+    les membres sont évalués l'un après l'autre dans le processus courant, sans nouveau pool.
+    La réponse n'est un succès que si au moins un IMT est commun aux membres qui ont réussi.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    try:
+        members = parse_gmm_list(args.gmms)
+        percentiles = [float(p) for p in args.percentiles.split(',')] if getattr(args, 'percentiles', None) else list(DEFAULT_ENSEMBLE_PERCENTILES)
+        workers = getattr(args, 'workers', None)
+        if workers is not None and workers < 0: raise ValueError("workers must be a non-negative integer")
+    except ValueError as e:
+        raise GMMCalculationError(f"Ensemble Input Error: {e}") from e
+    started = time.perf_counter()
+    max_workers = min(len(members), os.cpu_count() or 1)
+    workers = max_workers if workers is None else min(workers, max_workers)
+    jobs = [(m, c, args.keys, args.values) for m, c, _ in members]
+    pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+    try:
+        if pool is None: calls = [functools.partial(_evaluate_ensemble_member, *job) for job in jobs]
+        else: calls = [pool.submit(_evaluate_ensemble_member, *job).result for job in jobs]
+        responses = []
+        for (module_name, class_name, weight), call in zip(members, calls):
+            try:
+                response = call()
+            except Exception as e:
+                response = {"success": False, "gmm": class_name, "module": module_name, "error": f"Worker Error: {type(e).__name__}: {e}"}
+            response["weight"] = round(weight, 6)
+            responses.append(response)
+    finally:
+        if pool is not None: pool.shutdown()
+    ensemble = combine_ensemble(responses, percentiles)
+    response = {
+        "success": bool(ensemble and ensemble["imt_results"]), "mode": "ensemble",
+        "members": responses, "ensemble": ensemble,
+        "wall_times_s": {r["gmm"]: r.get("wall_time_s") for r in responses},
+        "total_wall_time_s": round(time.perf_counter() - started, 4),
+    }
+    if not response["success"]:
+        response["error"] = "All ensemble members failed" if ensemble is None else "No IMT was computed by all successful ensemble members"
+    return response
+
+# =================================================================================
+# Tirage Monte Carlo : spectres simulés corrélés entre périodes (SA, AvgSA)
+# =================================================================================
+SAMPLED_IMTS = ("SA", "AvgSA")
+
+def sample_spectra(response, n_samples, correlation=None, seed=None, percentiles=DEFAULT_ENSEMBLE_PERCENTILES, samples_path=None):
+    """Tire n_samples spectres corrélés pour chaque famille SA/AvgSA de la réponse ; renvoie le bloc "sampling".
+
+    Les percentiles sont donnés dans l'unité affichée. Avec samples_path, les spectres tirés sont enregistrés
+    (float32, forme (n_samples, M)) dans un fichier .npy par famille.
+    """
+    import gm_sampling
+    correlation = correlation or gm_sampling.DEFAULT_CORRELATION
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2**32)  # tiré au hasard, mais renvoyé pour rejouer le tirage
+    started = time.perf_counter()
+    families = {}
+    for family in SAMPLED_IMTS:
+        series = sorted((r for r in response["imt_results"] if r["imt"] == family), key=lambda r: r["sa_period"])
+        if not series: continue
+        periods = [r["sa_period"] for r in series]
+        samples = gm_sampling.sample_ln([r["mean_ln"] for r in series], [r["stddev_total_ln"] for r in series],
+                                        periods, n_samples, correlation, seed)
+        levels = gm_sampling.percentiles_ln(samples, percentiles)
+        entry = {"periods": periods, "unit": series[0]["unit"],
+                 "percentiles": {str(p): np.round(convert_mean_value(response["gmm"], family, levels[i]), 6).tolist()
+                                 for i, p in enumerate(percentiles)}}
+        if samples_path:
+            # np.save ajoute .npy si besoin ; la première famille prend le nom demandé, les suivantes un suffixe.
+            root = samples_path[:-4] if samples_path.endswith(".npy") else samples_path
+            path = f"{root}.npy" if not families else f"{root}_{family}.npy"
+            np.save(path, convert_mean_value(response["gmm"], family, samples).astype(np.float32).T)
+            entry["samples_path"] = path
+        families[family] = entry
+    if not families:
+        raise GMMCalculationError("Sampling Error: no SA or AvgSA results to sample")
+    return {"n_samples": n_samples, "correlation": correlation, "seed": seed, "percentile_levels": list(percentiles),
+            "families": families, "wall_time_s": round(time.perf_counter() - started, 4)}
+
+def calculate_gmm_sampled(args):
+    """Calcul d'un scénario suivi du tirage Monte Carlo (--samples) ; la réponse reçoit un bloc "sampling"."""
+    try:
+        percentiles = [float(p) for p in args.percentiles.split(',')] if getattr(args, 'percentiles', None) else list(DEFAULT_ENSEMBLE_PERCENTILES)
+        if args.samples <= 0: raise ValueError("the number of samples must be positive")
+    except ValueError as e:
+        raise GMMCalculationError(f"Sampling Input Error: {e}") from e
+    response = calculate_gmm(args)
+    try:
+        response["sampling"] = sample_spectra(response, args.samples, getattr(args, 'correlation', None), getattr(args, 'seed', None),
+                                              percentiles, getattr(args, 'save_samples', None))
+    except (ValueError, MemoryError) as e:
+        raise GMMCalculationError(f"Sampling Error: {e}") from e
+    return response
+
+def dispatch_calculation(args):
+    """Point d'entrée commun CLI/serveur : ensemble si --gmms, batch si des vecteurs ou un fichier de scénarios sont fournis."""
+    if getattr(args, 'gmms', None): return calculate_ensemble(args)
+    if is_batch_request(args): return calculate_gmm_batch(args)
+    return calculate_gmm_sampled(args) if getattr(args, 'samples', None) else calculate_gmm(args)
+
+def stream_gmm_calculation(args, write=None):
+    """Mode streaming : une ligne NDJSON compacte par IMT dès son calcul, puis un enregistrement de synthèse.
+
+    write reçoit chaque ligne (sans retour chariot) ; par défaut elle est écrite sur stdout et vidée aussitôt.
+    Les résultats sont émis dans l'ordre de calcul ; la synthèse reprend la réponse habituelle sans imt_results.
+    """
+    if write is None:
+        def write(line):
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+    emit = lambda record: write(json.dumps(record, separators=(",", ":")))
+    timings = {} if getattr(args, 'timings', False) else None
+    response, _ = calculate_gmm_with_plot(args, on_result=lambda r: emit({"type": "imt_result", **r}), timings=timings)
+    summary = {"type": "summary", **{k: v for k, v in response.items() if k != "imt_results"}}
+    if timings is not None: summary["timings"] = timings_report(timings)
+    emit(summary)
+    return summary
+
+# Budget de démarrage à froid (somme des temps d'import, secondes) contrôlé par --profile-startup.
+STARTUP_BUDGET = float(os.environ.get("GMM_STARTUP_BUDGET", 5.0))
+
+def parse_importtime(stderr):
+    """Analyse la sortie de `python -X importtime` ; renvoie [(module, self_s, cumulative_s)] et le reste de stderr."""
+    modules, other = [], []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            other.append(line); continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            modules.append((fields[2].strip(), int(fields[0]) / 1e6, int(fields[1]) / 1e6))
+        except (IndexError, ValueError):
+            continue  # ligne d'en-tête "self [us] | cumulative | imported package"
+    return modules, "\n".join(other)
+
+def profile_startup(argv, budget=STARTUP_BUDGET, top=20):
+    """Relance la commande (sans --profile-startup) sous `python -X importtime` et résume le temps d'import.
+
+    Sans --module, seul l'import du wrapper est mesuré. Renvoie le rapport (dict) ; within_budget indique si
+    la somme des temps d'import reste sous le budget.
+    """
+    import subprocess
+    script = os.path.abspath(__file__)
+    argv = [a for a in argv if a != '--profile-startup']
+    if '--module' in argv or '--gmms' in argv:
+        command = [sys.executable, "-X", "importtime", script] + argv
+    else:
+        command = [sys.executable, "-X", "importtime", "-c", "import run_gmm_calculation_v8"]
+    started = time.perf_counter()
+    proc = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(script))
+    wall_time = time.perf_counter() - started
+    modules, other_stderr = parse_importtime(proc.stderr)
+    by_package = {}
+    for name, self_s, _ in modules:
+        package = name.split(".")[0]
+        if package == "openquake" and name.count(".") >= 2:
+            package = ".".join(name.split(".")[:3])  # openquake.hazardlib.gsim, openquake.baselib.hdf5...
+        by_package[package] = by_package.get(package, 0.0) + self_s
+    import_time = sum(self_s for _, self_s, _ in modules)
+    report = {
+        "command": "calculation" if command[3] == script else "import", "exit_code": proc.returncode,
+        "wall_time_s": round(wall_time, 3), "import_time_s": round(import_time, 3), "modules_imported": len(modules),
+        "budget_s": budget, "within_budget": import_time <= budget,
+        "by_package": [{"package": p, "self_s": round(t, 4)} for p, t in sorted(by_package.items(), key=lambda x: -x[1])[:top]],
+        "slowest_modules": [{"module": n, "self_s": round(t, 4), "cumulative_s": round(c, 4)}
+                            for n, t, c in sorted(modules, key=lambda m: -m[1])[:top]],
+    }
+    if proc.returncode and other_stderr: report["stderr"] = other_stderr[-2000:]
+    return report
+
+def metrics_label(args):
+    """Étiquette gmm des métriques : la classe calculée, ou "ensemble" pour --gmms."""
+    return "ensemble" if getattr(args, 'gmms', None) else args.class_name
+
+def record_metrics(args, status, started, response=None):
+    """Ajoute l'appel au fichier de métriques (--metrics-file) s'il est configuré ; une erreur d'écriture n'interrompt pas le calcul."""
+    if not getattr(args, 'metrics_file', None): return
+    import metrics
+    try:
+        metrics.update_metrics_file(args.metrics_file, metrics_label(args), status, time.perf_counter() - started,
+                                    (response or {}).get("timings"))
+    except OSError as e:
+        print(f"Could not update metrics file {args.metrics_file}: {e}", file=sys.stderr)
+
+def run_gmm_calculation(args):
+    # Les métriques ont besoin du détail des étapes : il est calculé (sans changer l'évaluation vectorisée), puis retiré
+    # de la sortie s'il n'a pas été demandé (en streaming, la synthèse est déjà émise : seul --timings l'ajoute).
+    show_timings = getattr(args, 'timings', False)
+    if getattr(args, 'metrics_file', None) and not getattr(args, 'stream', False): args.timings = True
+    started = time.perf_counter()
+    if getattr(args, 'stream', False):
+        try:
+            summary = stream_gmm_calculation(args)
+        except GMMCalculationError as e:
+            record_metrics(args, "error", started)
+            print(json.dumps({"success": False, "error": str(e)}), file=sys.stderr)
+            sys.exit(1)
+        record_metrics(args, "ok", started, summary)
+        return
+    try:
+        response = dispatch_calculation(args)
+    except GMMCalculationError as e:
+        record_metrics(args, "error", started)
+        print(json.dumps({"success": False, "error": str(e)}), file=sys.stderr)
+        sys.exit(1)
+    record_metrics(args, "ok" if response.get("success") else "error", started, response)
+    if not show_timings: response.pop("timings", None)
+    if response.get("mode") in ("batch", "ensemble") and not response.get("success"):
+        print(json.dumps(response, separators=(",", ":")), file=sys.stderr)
+        sys.exit(1)
+    output_format = getattr(args, 'output_format', None) or "records"
+    if output_format != "records":
+        try:
+            response = format_output(response, output_format, getattr(args, 'npz_path', None))
+        except OSError as e:
+            print(json.dumps({"success": False, "error": f"Output Error: {e}"}), file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(response, separators=(",", ":")))
+    elif response.get("mode") == "batch":
+        print(json.dumps(response, separators=(",", ":")))
+    else:
+        print(json.dumps(response, indent=2))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Calcul dynamique et intelligent de tous les IMTs supportés par un GMM OpenQuake")
-    parser.add_argument('--module', required=True, help="Module GMM")
-    parser.add_argument('--class_name', required=True, help="Nom de la classe GMM")
-    parser.add_argument('--keys', required=True, help="Clés des paramètres séparées par virgules")
-    parser.add_argument('--values', required=True, help="Valeurs des paramètres séparées par virgules")
+    parser.add_argument('--module', help="Module GMM")
+    parser.add_argument('--class_name', help="Nom de la classe GMM")
+    parser.add_argument('--gmms', help="Mode ensemble : liste 'module:Classe[:poids]' séparée par virgules (remplace --module/--class_name)")
+    parser.add_argument('--percentiles', help="Modes ensemble et tirage : percentiles à calculer, séparés par virgules (défaut 5,16,50,84,95)")
+    parser.add_argument('--workers', type=int, help="Mode ensemble : nombre de processus, limité à un par GMM et au nombre de CPU (0 : dans le processus courant)")
+    parser.add_argument('--keys', default="", help="Clés des paramètres séparées par virgules")
+    parser.add_argument('--values', default="", help="Valeurs des paramètres séparées par virgules ; 'a;b;c' ou 'début:fin:n[:log]' pour un vecteur (mode batch)")
+    parser.add_argument('--grid', action='store_true', help="Mode batch : produit cartésien des vecteurs au lieu d'un appariement terme à terme ; "
+                        "les vecteurs de même longueur d'un même contexte (sites, rupture ou distances, ex. rrup/rjb/rx) "
+                        "restent appariés et forment un seul axe")
+    parser.add_argument('--scenarios', help="Mode batch : fichier CSV (avec en-tête) ou NPZ de scénarios")
+    parser.add_argument('--samples', type=int, help="Tirage Monte Carlo : nombre de spectres SA/AvgSA corrélés à simuler")
+    parser.add_argument('--correlation', default="baker_jayaram_2008", choices=["baker_jayaram_2008", "goda_atkinson_2009", "none", "full"],
+                        help="Tirage : modèle de corrélation entre périodes")
+    parser.add_argument('--seed', type=int, help="Tirage : graine du générateur (renvoyée dans la réponse si absente)")
+    parser.add_argument('--save-samples', help="Tirage : fichier .npy où enregistrer les spectres simulés")
+    parser.add_argument('--plot-format', default="png", choices=["png", "svg"], help="Format du graphique")
+    parser.add_argument('--preview', action='store_true', help="Graphique basse résolution (aperçu Telegram)")
+    parser.add_argument('--stream', action='store_true', help="Sortie NDJSON : une ligne par IMT dès son calcul, puis une ligne de synthèse")
+    parser.add_argument('--output-format', default="records", choices=OUTPUT_FORMATS,
+                        help="records : un dict par IMT (défaut) ; columnar : tableaux par famille d'IMTs (JSON compact) ; npz : tableaux dans --npz-path")
+    parser.add_argument('--npz-path', help="Fichier .npz écrit avec --output-format npz")
+    parser.add_argument('--timings', action='store_true', help="Ajoute un bloc timings : temps par étape, IMTs, échecs et temps (estimé hors --stream) par famille, IMTs sondés sans succès ou rejetés")
+    parser.add_argument('--metrics-file', default=os.environ.get("GMM_METRICS_FILE"),
+                        help="Fichier de métriques Prometheus cumulées entre les appels (défaut : $GMM_METRICS_FILE)")
+    parser.add_argument('--profile-startup', action='store_true', help="Mesure le temps d'import par module (python -X importtime) de la commande et quitte")
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET, help="Budget du temps d'import total en secondes (défaut : $GMM_STARTUP_BUDGET ou 5)")
+    parser.add_argument('--cache-dir', help="Répertoire du cache de résultats (défaut : $GMM_CACHE_DIR, sinon pas de cache)")
+    parser.add_argument('--no-cache', action='store_true', help="Ignore le cache de résultats pour cet appel")
+    parser.add_argument('--cache-stats', action='store_true', help="Affiche les statistiques du cache (hits/misses, taille) et quitte")
     args = parser.parse_args()
+    if args.profile_startup:
+        argv = sys.argv[1:]
+        if '--startup-budget' in argv:
+            i = argv.index('--startup-budget'); del argv[i:i + 2]
+        report = profile_startup(argv, args.startup_budget)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["within_budget"] else 1)
+    if args.cache_dir: os.environ["GMM_CACHE_DIR"] = args.cache_dir
+    if args.no_cache: os.environ.pop("GMM_CACHE_DIR", None)
+    if args.cache_stats:
+        cache = get_result_cache()
+        print(json.dumps(cache.stats() if cache else {"error": "No cache directory configured"}, indent=2))
+        sys.exit(0 if cache else 1)
+    if not args.gmms and not (args.module and args.class_name):
+        parser.error("--module and --class_name (or --gmms) are required")
+    if not args.keys and not args.scenarios:
+        parser.error("--keys/--values or --scenarios is required")
+    if args.stream and (args.gmms or is_batch_request(args)):
+        parser.error("--stream is only available for single-scenario calculations")
+    if args.samples is not None and args.samples < 1:
+        parser.error("--samples must be at least 1")
+    if args.samples and (args.stream or args.gmms or is_batch_request(args)):
+        parser.error("--samples is only available for single-scenario calculations without --stream")
+    if args.output_format != "records" and (args.gmms or args.stream):
+        parser.error("--output-format columnar/npz is only available for single-scenario and batch calculations")
+    if args.output_format == "npz" and not args.npz_path:
+        parser.error("--output-format npz requires --npz-path")
     run_gmm_calculation(args)
\ No newline at end of file
@@ -0,0 +1,224 @@
+# Fichier : scenario_map.py
+# Carte de mouvement du sol d'un scénario : rupture plane finie, distances calculées pour chaque site d'une
+# grille (ou d'une liste de sites), évaluation vectorisée du GMM par blocs.
+#
+# Usage : python3 scenario_map.py --module abrahamson_2014 --class_name AbrahamsonEtAl2014 \
+#           --lon 10.0 --lat 40.0 --depth 10 --mag 6.5 --strike 30 --dip 70 --rake 90 \
+#           --bbox 9.5,39.5,10.5,40.5 --spacing 1 --keys vs30,z1pt0,vs30measured --values 500,50,0 --imts PGA,SA(1.0)
+# Les résultats sont écrits dans --output-dir : un fichier .npy (float32, mappable en mémoire) par champ,
+# un manifest.json qui les décrit, et l'image de la carte du premier IMT.
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+import run_gmm_calculation_v8 as wrapper
+import plot_rendering
+
+DEFAULT_CHUNK_SIZE = 50_000
+KM_PER_DEGREE = 111.195
+# Paramètres de rupture déduits de la géométrie : ils remplacent ceux de --keys/--values.
+RUPTURE_GEOMETRY_PARAMETERS = ("mag", "rake", "dip", "ztor", "width", "hypo_depth", "hypo_lat", "hypo_lon")
+
+def build_rupture(lon, lat, depth, mag, strike, dip, rake, aratio=1.5, ztor=None):
+    """Rupture plane centrée sur l'hypocentre, dimensions données par la relation de Wells & Coppersmith (1994)."""
+    from openquake.hazardlib import const
+    from openquake.hazardlib.geo import Point
+    from openquake.hazardlib.scalerel import WC1994
+    from openquake.hazardlib.source.rupture import BaseRupture
+    from openquake.hazardlib.geo.surface.planar import PlanarSurface
+    hypocentre = Point(lon, lat, depth)
+    surface = PlanarSurface.from_hypocenter(hypocentre, WC1994(), mag, aratio, strike, dip, rake, ztor)
+    return BaseRupture(mag, rake, const.TRT.ACTIVE_SHALLOW_CRUST, hypocentre, surface)
+
+def rupture_parameters(rupture):
+    surface = rupture.surface
+    return {"mag": rupture.mag, "rake": rupture.rake, "dip": surface.get_dip(), "ztor": surface.get_top_edge_depth(),
+            "width": surface.get_width(), "hypo_depth": rupture.hypocenter.depth,
+            "hypo_lat": rupture.hypocenter.latitude, "hypo_lon": rupture.hypocenter.longitude}
+
+def rupture_outline(rupture):
+    """Contour fermé de la surface (haut gauche, haut droit, bas droit, bas gauche) pour la carte."""
+    surface = rupture.surface
+    order = [0, 1, 3, 2, 0]
+    return surface.corner_lons[order], surface.corner_lats[order]
+
+def make_grid(bbox, spacing_km):
+    """Grille régulière couvrant bbox (lon_min, lat_min, lon_max, lat_max) ; renvoie (lons, lats, (ny, nx))."""
+    lon_min, lat_min, lon_max, lat_max = bbox
+    if lon_min >= lon_max or lat_min >= lat_max:
+        raise ValueError("bbox must be lon_min,lat_min,lon_max,lat_max")
+    dlat = spacing_km / KM_PER_DEGREE
+    dlon = spacing_km / (KM_PER_DEGREE * np.cos(np.radians((lat_min + lat_max) / 2)))
+    lons = np.arange(lon_min, lon_max + dlon / 2, dlon)
+    lats = np.arange(lat_min, lat_max + dlat / 2, dlat)
+    grid_lons, grid_lats = np.meshgrid(lons, lats)
+    return grid_lons.ravel(), grid_lats.ravel(), (len(lats), len(lons))
+
+def parse_imt_list(imts_string):
+    """'PGA,SA(1.0),FAS(2.0)' -> [(nom, paramètre)] ; SDi n'est pas cartographié."""
+    parsed = []
+    for item in (i.strip() for i in imts_string.split(',')):
+        if not item: continue
+        if item.endswith(')') and '(' in item:
+            name, param = item[:-1].split('(', 1)
+            parsed.append((name.strip(), float(param)))
+        else:
+            parsed.append((item, None))
+    return parsed
+
+def default_map_imt(gmm_class):
+    """IMT cartographié sans --imts : PGA s'il est supporté, sinon le premier IMT confirmé par l'index, sinon le premier
+    dans l'ordre trié (jamais l'ordre d'un ensemble, qui varie d'un processus à l'autre)."""
+    candidates = [(name, param) for name, param in wrapper.get_supported_imts(gmm_class) if name != "SDi"]
+    if ("PGA", None) in candidates: return "PGA", None
+    confirmed = [(name, param) for name, param in wrapper.get_indexed_imts(gmm_class, confirmed_only=True) or () if name != "SDi"]
+    if confirmed: return confirmed[0]
+    if not candidates: raise ValueError(f"{gmm_class.__name__} has no IMT that can be mapped")
+    return min(candidates, key=lambda c: (c[0], c[1] or 0.0))
+
+def _field_name(display_name):
+    """Nom de fichier d'un IMT : 'SA(1.0s)' -> 'SA_1.0s'."""
+    return re.sub(r'[^A-Za-z0-9.]+', '_', display_name).strip('_')
+
+def calculate_scenario_map(args):
+    started = time.perf_counter()
+    try:
+        user_params = wrapper.parse_user_params(args.keys, args.values) if args.keys else {}
+        rupture = build_rupture(args.lon, args.lat, args.depth, args.mag, args.strike, args.dip, args.rake, args.aratio, args.ztor)
+        if args.sites:
+            site_columns = wrapper.load_scenarios_file(args.sites)
+            lons, lats = np.asarray(site_columns.pop("lon"), float), np.asarray(site_columns.pop("lat"), float)
+            grid_shape = None
+        else:
+            lons, lats, grid_shape = make_grid([float(v) for v in args.bbox.split(',')], args.spacing)
+            site_columns = {}
+    except Exception as e:
+        raise wrapper.GMMCalculationError(f"Map Input Error: {e}") from e
+    user_params.update(rupture_parameters(rupture))
+    try:
+        gmm_class, gmm, _ = wrapper.prepare_gmm(args.module, args.class_name, user_params)
+    except Exception as e:
+        raise wrapper.GMMCalculationError(f"GMM Import Error: {e}") from e
+    req_sites, req_rupture, req_distances = wrapper.get_required_parameters(gmm_class)
+    missing = [p for p in req_sites | req_rupture if p not in user_params and p not in site_columns and p not in ("lon", "lat")]
+    if missing:
+        raise wrapper.GMMCalculationError(f"Missing parameters: {', '.join(sorted(missing))}")
+
+    try:
+        imt_specs = parse_imt_list(args.imts) if args.imts else [default_map_imt(gmm_class)]
+        imts = [(name, param) + wrapper.make_imt(name, param) for name, param in imt_specs]
+    except Exception as e:
+        raise wrapper.GMMCalculationError(f"IMT Error: {e}") from e
+    is_vh_ratio_model = wrapper.is_vh_ratio_class(gmm_class)
+
+    n = len(lons)
+    os.makedirs(args.output_dir, exist_ok=True)
+    def open_field(name):
+        return np.lib.format.open_memmap(os.path.join(args.output_dir, f"{name}.npy"), mode="w+", dtype=np.float32, shape=(n,))
+    fields = {name: open_field(name) for name in ["lon", "lat"] + sorted(req_distances)}
+    outputs = []
+    for imt_name, imt_param, imt_obj, display_name in imts:
+        # Nom, nom d'affichage et unité tels que calculate_gmm les renvoie (préfixe VHR_ pour un rapport V/H).
+        shown_imt, shown_name, unit, _ = wrapper.describe_imt(imt_name, imt_param, display_name, is_vh_ratio_model)
+        field = _field_name(shown_name)
+        outputs.append({"imt_name": imt_name, "imt": shown_imt, "display_name": shown_name, "field": field, "unit": unit,
+                        "mean": open_field(f"mean_{field}"), "sigma": open_field(f"sigma_ln_{field}"), "errors": 0})
+
+    from openquake.hazardlib.geo.mesh import Mesh
+    from openquake.hazardlib.contexts import get_distances
+    for start in range(0, n, args.chunk_size):
+        stop = min(start + args.chunk_size, n)
+        chunk_lons, chunk_lats = lons[start:stop], lats[start:stop]
+        mesh = Mesh(chunk_lons, chunk_lats)
+        params = dict(user_params, lon=chunk_lons, lat=chunk_lats)
+        params.update({name: column[start:stop] for name, column in site_columns.items()})
+        try:
+            for p in req_distances:
+                params[p] = np.asarray(get_distances(rupture, mesh, p), dtype=float)
+            sctx, rctx, dctx = wrapper.build_batch_contexts(gmm_class, params, stop - start)
+        except wrapper.GMMCalculationError:
+            raise
+        except Exception as e:
+            raise wrapper.GMMCalculationError(f"Context Error: {e}") from e
+        fields["lon"][start:stop], fields["lat"][start:stop] = chunk_lons, chunk_lats
+        for p in req_distances: fields[p][start:stop] = params[p]
+        evaluations = wrapper.evaluate_imts(gmm, sctx, rctx, dctx, [imt[2] for imt in imts])
+        for output, (is_supported, mean, stddevs) in zip(outputs, evaluations):
+            if not is_supported:
+                output["mean"][start:stop], output["sigma"][start:stop] = np.nan, np.nan
+                output["errors"] += stop - start
+                continue
+            # Même post-traitement que calculate_gmm ; un site à l'écart-type aberrant est mis à NaN et compté en échec.
+            mean_value, valid = wrapper.imt_display_values(args.class_name, output["imt_name"], mean, stddevs[0], is_vh_ratio_model)
+            output["mean"][start:stop] = np.where(valid, mean_value, np.nan)
+            output["sigma"][start:stop] = np.where(valid, stddevs[0], np.nan)
+            output["errors"] += int(np.count_nonzero(~valid))
+
+    map_path = None
+    if outputs and not args.no_map:
+        first = outputs[0]
+        data = plot_rendering.render_map(lons, lats, first["mean"], f"{first['display_name']} - {args.class_name} (M{args.mag:g})",
+                                         f"{first['display_name']} ({first['unit']})", grid_shape, rupture_outline(rupture),
+                                         log_scale=first["imt"] not in ("MMI", "JMA"))
+        map_path = os.path.join(args.output_dir, f"map_{first['field']}.png")
+        with open(map_path, "wb") as f: f.write(data)
+
+    for memmap in list(fields.values()) + [o["mean"] for o in outputs] + [o["sigma"] for o in outputs]:
+        memmap.flush()
+    surface = rupture.surface
+    manifest = {
+        "success": True, "mode": "map", "gmm": args.class_name, "module": args.module, "n_sites": n,
+        "grid": {"shape": list(grid_shape), "bbox": [float(v) for v in args.bbox.split(',')], "spacing_km": args.spacing} if grid_shape else None,
+        "rupture": dict({k: round(float(v), 5) for k, v in rupture_parameters(rupture).items()}, strike=args.strike,
+                        length_km=round(float(surface.get_area() / surface.get_width()), 3),
+                        corner_lons=np.round(surface.corner_lons, 5).tolist(), corner_lats=np.round(surface.corner_lats, 5).tolist(),
+                        corner_depths=np.round(surface.corner_depths, 3).tolist()),
+        "fixed_params": {k: v for k, v in user_params.items() if k not in RUPTURE_GEOMETRY_PARAMETERS},
+        "fields": {name: f"{name}.npy" for name in fields},
+        "imt_results": [{"imt": o["imt"], "display_name": o["display_name"], "unit": o["unit"],
+                         "mean_file": f"mean_{o['field']}.npy", "sigma_ln_file": f"sigma_ln_{o['field']}.npy",
+                         "failed_sites": o["errors"],
+                         "max_value": round(float(np.nanmax(o["mean"])), 6) if o["errors"] < n else None} for o in outputs],
+        "dtype": "float32", "chunk_size": args.chunk_size, "map_path": map_path,
+        "wall_time_s": round(time.perf_counter() - started, 3),
+    }
+    with open(os.path.join(args.output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carte de mouvement du sol d'un scénario de rupture finie sur une grille de sites")
+    parser.add_argument('--module', required=True, help="Module GMM")
+    parser.add_argument('--class_name', required=True, help="Nom de la classe GMM")
+    parser.add_argument('--lon', type=float, required=True, help="Longitude de l'épicentre (°)")
+    parser.add_argument('--lat', type=float, required=True, help="Latitude de l'épicentre (°)")
+    parser.add_argument('--depth', type=float, required=True, help="Profondeur de l'hypocentre (km)")
+    parser.add_argument('--mag', type=float, required=True, help="Magnitude")
+    parser.add_argument('--strike', type=float, required=True, help="Azimut de la faille (°)")
+    parser.add_argument('--dip', type=float, required=True, help="Pendage (°)")
+    parser.add_argument('--rake', type=float, required=True, help="Angle de glissement (°)")
+    parser.add_argument('--aratio', type=float, default=1.5, help="Rapport longueur/largeur de la rupture")
+    parser.add_argument('--ztor', type=float, help="Profondeur du toit de la rupture (km), déduite de l'hypocentre par défaut")
+    parser.add_argument('--bbox', help="Grille : lon_min,lat_min,lon_max,lat_max")
+    parser.add_argument('--spacing', type=float, default=1.0, help="Grille : pas en km")
+    parser.add_argument('--sites', help="Liste de sites : CSV (colonnes lon, lat et paramètres de site éventuels) ou NPZ")
+    parser.add_argument('--keys', default="", help="Paramètres de site/rupture communs à tous les sites, séparés par virgules")
+    parser.add_argument('--values', default="", help="Valeurs correspondantes, séparées par virgules")
+    parser.add_argument('--imts', help="IMTs à cartographier, ex. 'PGA,SA(1.0)' (défaut : PGA, sinon le premier IMT confirmé par l'index, sinon le premier dans l'ordre trié)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Sites traités par bloc (mémoire bornée)")
+    parser.add_argument('--output-dir', default="scenario_map", help="Répertoire de sortie")
+    parser.add_argument('--no-map', action='store_true', help="N'écrit pas l'image de la carte")
+    args = parser.parse_args()
+    if not args.bbox and not args.sites:
+        parser.error("--bbox or --sites is required")
+    try:
+        print(json.dumps(calculate_scenario_map(args), indent=2))
+    except wrapper.GMMCalculationError as e:
+        print(json.dumps({"success": False, "error": str(e)}), file=sys.stderr)
+        sys.exit(1)